@@ -0,0 +1,438 @@
+import unittest
+import bisect
+import collections
+import concurrent.futures
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+
+import gtpv2
+import gtppcap
+
+# GTPv2 session management requests, mapped to the response that completes each
+CREATE_SESSION_REQUEST = 32
+CREATE_SESSION_RESPONSE = 33
+MODIFY_BEARER_REQUEST = 34
+MODIFY_BEARER_RESPONSE = 35
+DELETE_SESSION_REQUEST = 36
+DELETE_SESSION_RESPONSE = 37
+
+transaction_response_types = {
+    CREATE_SESSION_REQUEST: CREATE_SESSION_RESPONSE,
+    MODIFY_BEARER_REQUEST: MODIFY_BEARER_RESPONSE,
+    DELETE_SESSION_REQUEST: DELETE_SESSION_RESPONSE,
+}
+
+GTPC_PORTS = (2123,)
+
+# A GTP message reduced to what session analysis needs, small enough to pass between processes.  'source'
+# and 'destination' are (packed address, port); 'imsi' is the IMSI, as digits, when the message carries one.
+MessageRecord = collections.namedtuple('MessageRecord', ('timestamp', 'version', 'type', 'teid', 'sequence_number', 'source', 'destination', 'imsi'))
+
+
+def sender_fteid(message, source):
+    """Return the (address, TEID) of the Sender F-TEID for Control Plane in 'message', falling back to the
+       packet's source address if the F-TEID carries none, or None if there is no such IE"""
+    ie = message.get_IE(87)
+    if ie is None:
+        return None
+    try:
+        fteid = ie.decoded_value()
+    except ValueError:
+        return None
+    return (fteid.ipv4() or fteid.ipv6() or source[0], fteid.teid())
+
+
+class SessionDirectory(object):
+    """Maps a control plane endpoint, (address, TEID), to the IMSI of the session it belonged to at a
+       given time.  TEIDs are reused over a long capture, so every binding is kept with the time it was
+       made and lookup() returns the latest binding made at or before the time asked about."""
+
+    __slots__ = ('_bindings',)
+
+    def __init__(self):
+        self._bindings = {}
+
+
+    def __len__(self):
+        return len(self._bindings)
+
+
+    def add(self, timestamp, endpoint, imsi):
+        times = self._bindings.get(endpoint)
+        if times is None:
+            self._bindings[endpoint] = ([timestamp], [imsi])
+        else:
+            i = bisect.bisect_right(times[0], timestamp)
+            times[0].insert(i, timestamp)
+            times[1].insert(i, imsi)
+
+
+    def lookup(self, endpoint, timestamp):
+        times = self._bindings.get(endpoint)
+        if times is None:
+            return None
+        i = bisect.bisect_right(times[0], timestamp)
+        return times[1][i - 1] if i else None
+
+
+class SessionAnalyzer(object):
+    """Rebuilds the Create/Modify/Delete Session sequence of every session and measures the latency
+       of each of those transactions, from the first transmission of the request to its response.
+       Records are added one session at a time, in capture order."""
+
+    __slots__ = ('_sessions', '_pending', '_latencies')
+
+    def __init__(self):
+        self._sessions = {}
+        self._pending = {}
+        self._latencies = {}
+
+
+    def add(self, session, record):
+        sequence = self._sessions.get(session)
+        if sequence is None:
+            sequence = self._sessions[session] = []
+        sequence.append((record.timestamp, record.type))
+
+        if record.type in transaction_response_types:
+            # a retransmission keeps the time of the original request
+            self._pending.setdefault((record.source, record.destination, record.sequence_number), record)
+        else:
+            request = self._pending.pop((record.destination, record.source, record.sequence_number), None)
+            if request is not None and transaction_response_types[request.type] == record.type:
+                latencies = self._latencies.get(request.type)
+                if latencies is None:
+                    latencies = self._latencies[request.type] = []
+                latencies.append(record.timestamp - request.timestamp)
+
+
+    def result(self):
+        """Return {'sessions': {session: [(timestamp, message type), ...]}, 'latencies': {request type:
+           [seconds, ...]}}"""
+        return {'sessions': self._sessions, 'latencies': self._latencies}
+
+
+    @staticmethod
+    def merge(results):
+        """Combine the results of analyzers that saw disjoint sets of sessions"""
+        merged = {'sessions': {}, 'latencies': {}}
+        for result in results:
+            merged['sessions'].update(result['sessions'])
+            for (type, latencies) in result['latencies'].items():
+                merged['latencies'].setdefault(type, []).extend(latencies)
+        return merged
+
+
+def _learn_session(timestamp, message, source, destination, bindings, links):
+    # Record what a GTPv2 Create Session exchange tells about session identity: the IMSI of a Create
+    # Session Request is bound to its sender F-TEID (and returned), and the sender F-TEID of a Create
+    # Session Response is linked to the requester's endpoint
+    type = message.type()
+    imsi = None
+
+    if type == CREATE_SESSION_REQUEST:
+        ie = message.get_IE(1)
+        if ie is not None:
+            imsi = ie.decoded_value()
+        fteid = sender_fteid(message, source)
+        if fteid is not None and imsi is not None:
+            bindings.append((timestamp, fteid, imsi))
+    elif type == CREATE_SESSION_RESPONSE and message.teid():
+        fteid = sender_fteid(message, source)
+        if fteid is not None:
+            links.append((timestamp, fteid, (destination[0], message.teid())))
+
+    return imsi
+
+
+def extract_sessions(path, part, ports=GTPC_PORTS):
+    """Read the GTP messages in 'part', a CaptureRange of the capture at 'path', and return
+       (bindings, links).  'bindings' lists (timestamp, endpoint, IMSI) for each Create Session Request
+       sender F-TEID, and 'links' lists (timestamp, endpoint, peer endpoint) for each Create Session
+       Response sender F-TEID, where an endpoint is (address, TEID).  Only the IEs of Create Session
+       messages are decoded."""
+    bindings = []
+    links = []
+
+    with gtppcap.CaptureReader(path, ports) as reader:
+        for (timestamp, source, destination, message) in reader.messages(*part):
+            if isinstance(message, gtpv2.v2message):
+                _learn_session(timestamp, message, source, destination, bindings, links)
+
+    return (bindings, links)
+
+
+def _records(path, part, ports, bindings, links):
+    # yield a MessageRecord for each GTP message in 'part', adding what the Create Session exchanges
+    # tell about sessions to 'bindings' and 'links'
+    with gtppcap.CaptureReader(path, ports) as reader:
+        for (timestamp, source, destination, message) in reader.messages(*part):
+            if isinstance(message, gtpv2.v2message):
+                version = 2
+                imsi = _learn_session(timestamp, message, source, destination, bindings, links)
+            else:
+                version = 1
+                imsi = None
+
+            yield MessageRecord(timestamp, version, message.type(), message.teid(), message.sequence_number(), source, destination, imsi)
+
+
+def extract_records(path, part, ports=GTPC_PORTS):
+    """Read the GTP messages in 'part', a CaptureRange of the capture at 'path', and return
+       (records, bindings, links), 'records' being a list of MessageRecord and the others as for
+       extract_sessions()"""
+    bindings = []
+    links = []
+    records = list(_records(path, part, ports, bindings, links))
+    return (records, bindings, links)
+
+
+def build_directory(extracted):
+    """Build a SessionDirectory from the (bindings, links) of every extract_sessions() result: each
+       binding, then each link whose peer endpoint is bound to an IMSI at the time"""
+    directory = SessionDirectory()
+    for (bindings, links) in extracted:
+        for (timestamp, endpoint, imsi) in bindings:
+            directory.add(timestamp, endpoint, imsi)
+
+    resolved = []
+    for (bindings, links) in extracted:
+        for (timestamp, endpoint, peer) in links:
+            imsi = directory.lookup(peer, timestamp)
+            if imsi is not None:
+                resolved.append((timestamp, endpoint, imsi))
+    for (timestamp, endpoint, imsi) in resolved:
+        directory.add(timestamp, endpoint, imsi)
+
+    return directory
+
+
+def session_shard(session, shards):
+    """The shard, of 'shards', for 'session' (an IMSI, or an (address, TEID) endpoint).  Unlike hash(),
+       which is salted per process for str and bytes, this is the same in every worker."""
+    if isinstance(session, tuple):
+        key = bytes(session[0]) + (session[1] or 0).to_bytes(4, 'big')
+    else:
+        key = session.encode()
+    return zlib.crc32(key) % shards
+
+
+def _routed_records(path, part, directory, shards, ports):
+    # yield (shard, session, record) for each GTP message in 'part'
+    lookup = directory.lookup
+
+    for record in _records(path, part, ports, [], []):
+        session = record.imsi
+        if session is None:
+            endpoint = (record.destination[0], record.teid)
+            session = lookup(endpoint, record.timestamp) or endpoint
+        yield (session_shard(session, shards), session, record)
+
+
+def route_records(path, part, directory, shards, ports=GTPC_PORTS):
+    """Read the GTP messages in 'part', a CaptureRange of the capture at 'path', and assign each to
+       one of 'shards' lists by its session: the IMSI when it is known from the message or 'directory',
+       otherwise the (address, TEID) of the endpoint the message was sent to.  Return the list of
+       shards, each a list of (session, record)."""
+    routed = [[] for i in range(shards)]
+
+    for (shard, session, record) in _routed_records(path, part, directory, shards, ports):
+        routed[shard].append((session, record))
+
+    return routed
+
+
+# records are written to spool files in pickled lists of this many (session, record) pairs
+spool_batch = 4096
+
+def spool_path(spool, shard, index):
+    """The spool file, in the directory 'spool', of the records of 'shard' from range 'index'"""
+    return os.path.join(spool, '{}.{}'.format(shard, index))
+
+
+def spool_records(path, part, index, directory, shards, spool, ports=GTPC_PORTS):
+    """As route_records(), but stream the records of each shard to its spool file for range 'index' in
+       the directory 'spool' rather than returning them.  Return the number of records per shard."""
+    files = [None] * shards
+    batches = [[] for i in range(shards)]
+    counts = [0] * shards
+
+    try:
+        for (shard, session, record) in _routed_records(path, part, directory, shards, ports):
+            batch = batches[shard]
+            batch.append((session, record))
+            if len(batch) >= spool_batch:
+                if files[shard] is None:
+                    files[shard] = open(spool_path(spool, shard, index), 'wb')
+                pickle.dump(batch, files[shard], pickle.HIGHEST_PROTOCOL)
+                counts[shard] += len(batch)
+                del batch[:]
+
+        for (shard, batch) in enumerate(batches):
+            if batch:
+                if files[shard] is None:
+                    files[shard] = open(spool_path(spool, shard, index), 'wb')
+                pickle.dump(batch, files[shard], pickle.HIGHEST_PROTOCOL)
+                counts[shard] += len(batch)
+    finally:
+        for f in files:
+            if f is not None:
+                f.close()
+
+    return counts
+
+
+def analyze_shard(analyzer, shard):
+    """Run a fresh 'analyzer' over one shard, in capture order, and return its result"""
+    shard.sort(key=lambda routed: routed[1].timestamp)
+    instance = analyzer()
+    add = instance.add
+    for (session, record) in shard:
+        add(session, record)
+    return instance.result()
+
+
+def analyze_spooled(analyzer, spool, shard, parts):
+    """Read the records of 'shard' spooled by spool_records() from each of 'parts' ranges and return
+       the result of analyze_shard() over them"""
+    records = []
+
+    for index in range(parts):
+        path = spool_path(spool, shard, index)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    records.extend(pickle.load(f))
+                except EOFError:
+                    break
+
+    return analyze_shard(analyzer, records)
+
+
+def _analyze(map, path, ranges, analyzer, shards, ports, spool):
+    parts = len(ranges)
+
+    directory = build_directory(list(map(extract_sessions, [path] * parts, ranges, [ports] * parts)))
+    list(map(spool_records, [path] * parts, ranges, range(parts), [directory] * parts, [shards] * parts, [spool] * parts, [ports] * parts))
+
+    return analyzer.merge(list(map(analyze_spooled, [analyzer] * shards, [spool] * shards, range(shards), [parts] * shards)))
+
+
+def analyze(path, analyzer=SessionAnalyzer, workers=None, ports=GTPC_PORTS, spool_directory=None):
+    """Analyze the capture at 'path' across 'workers' processes (one per CPU by default).  The capture is
+       split into byte ranges, which workers read in two passes.  The first pass collects only the
+       session identities learned from Create Session exchanges, from which a SessionDirectory is built
+       here; that is small, one entry per session.  In the second pass each worker routes the messages
+       of its range by session (IMSI, or TEID where the IMSI cannot be learned from the capture) with a
+       stable hash, and streams each shard's records to a spool file in a temporary directory (under
+       'spool_directory' if given), so that all of a session's messages reach the same shard.  A worker
+       per shard then feeds that shard's spool files to an 'analyzer' instance, and only the per-shard
+       results come back here, to be combined with analyzer.merge().  Records never pass through this
+       process.  GTPv2 sessions are identified by IMSI through their Create Session exchange; GTPv1
+       messages, and sessions already established when the capture began, are identified by TEID.  With
+       'workers' of 1 everything runs in this process."""
+    workers = workers or os.cpu_count() or 1
+
+    with gtppcap.CaptureReader(path, ports) as reader:
+        ranges = reader.split(workers)
+
+    spool = tempfile.mkdtemp(prefix='gtpanalysis-', dir=spool_directory)
+    try:
+        if workers == 1:
+            return _analyze(map, path, ranges, analyzer, 1, ports, spool)
+
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            return _analyze(pool.map, path, ranges, analyzer, workers, ports, spool)
+    finally:
+        shutil.rmtree(spool)
+
+
+
+class Test_analysis(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self._directory = tempfile.mkdtemp()
+        self._path = self._directory + '/s11.pcap'
+
+        mme = ('10.0.0.1', 2123)
+        sgw = ('10.0.0.2', 2123)
+        with gtppcap.CaptureWriter(self._path) as writer:
+            t = 100.0
+            for (n, imsi) in enumerate((b'\x21\x43\x65\x87\x09\x21\x43\xf5', b'\x21\x43\x65\x87\x09\x21\x53\xf6')):
+                mme_teid = 0x100 + n
+                sgw_teid = 0x200 + n
+                mme_fteid = gtpv2.IE(87, gtpv2.FTEID.create(10, mme_teid, '10.0.0.1'))
+                sgw_fteid = gtpv2.IE(87, gtpv2.FTEID.create(11, sgw_teid, '10.0.0.2'))
+
+                writer.write(gtpv2.v2message(CREATE_SESSION_REQUEST, 10 + n, 0, (gtpv2.IE(1, imsi), mme_fteid)), mme, sgw, t)
+                # retransmission
+                writer.write(gtpv2.v2message(CREATE_SESSION_REQUEST, 10 + n, 0, (gtpv2.IE(1, imsi), mme_fteid)), mme, sgw, t + 0.5)
+                writer.write(gtpv2.v2message(CREATE_SESSION_RESPONSE, 10 + n, mme_teid, (sgw_fteid,)), sgw, mme, t + 1.0)
+                writer.write(gtpv2.v2message(MODIFY_BEARER_REQUEST, 20 + n, sgw_teid), mme, sgw, t + 2.0)
+                writer.write(gtpv2.v2message(MODIFY_BEARER_RESPONSE, 20 + n, mme_teid), sgw, mme, t + 2.25)
+                writer.write(gtpv2.v2message(DELETE_SESSION_REQUEST, 30 + n, sgw_teid), mme, sgw, t + 3.0)
+                writer.write(gtpv2.v2message(DELETE_SESSION_RESPONSE, 30 + n, mme_teid), sgw, mme, t + 3.125)
+                t += 0.1
+
+            # a session that began before the capture did
+            writer.write(gtpv2.v2message(MODIFY_BEARER_REQUEST, 40, 0x300), mme, sgw, 200.0)
+
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self._directory)
+
+
+    def test_analyze(self):
+        expected_sequence = [CREATE_SESSION_REQUEST, CREATE_SESSION_REQUEST, CREATE_SESSION_RESPONSE, MODIFY_BEARER_REQUEST, MODIFY_BEARER_RESPONSE, DELETE_SESSION_REQUEST, DELETE_SESSION_RESPONSE]
+
+        for workers in (1, 3):
+            result = analyze(self._path, workers=workers, spool_directory=self._directory)
+            self.assertEqual(os.listdir(self._directory), ['s11.pcap'], "spool files removed ({} workers)".format(workers))
+            sessions = result['sessions']
+            self.assertEqual(len(sessions), 3, "two IMSI sessions and one TEID-only session ({} workers)".format(workers))
+            self.assertEqual([type for (t, type) in sessions['123456789012345']], expected_sequence, "session sequence rebuilt ({} workers)".format(workers))
+            self.assertEqual([type for (t, type) in sessions['123456789012356']], expected_sequence, "session sequence rebuilt ({} workers)".format(workers))
+            self.assertEqual(len(sessions[(b'\x0a\x00\x00\x02', 0x300)]), 1, "message of unknown session keyed by TEID ({} workers)".format(workers))
+            self.assertEqual(sorted(result['latencies'][CREATE_SESSION_REQUEST]), [1.0, 1.0], "setup latency from first transmission ({} workers)".format(workers))
+            self.assertEqual(sorted(result['latencies'][MODIFY_BEARER_REQUEST]), [0.25, 0.25], "modify latency ({} workers)".format(workers))
+            self.assertEqual(sorted(result['latencies'][DELETE_SESSION_REQUEST]), [0.125, 0.125], "delete latency ({} workers)".format(workers))
+
+
+    def test_session_directory(self):
+        directory = SessionDirectory()
+        directory.add(10.0, (b'a', 1), b'first')
+        directory.add(50.0, (b'a', 1), b'second')
+        self.assertEqual(directory.lookup((b'a', 1), 5.0), None, "no binding before first use")
+        self.assertEqual(directory.lookup((b'a', 1), 20.0), b'first', "binding in effect")
+        self.assertEqual(directory.lookup((b'a', 1), 60.0), b'second', "TEID reuse")
+        self.assertEqual(directory.lookup((b'b', 1), 60.0), None, "unknown endpoint")
+
+
+    def test_route_records(self):
+        with gtppcap.CaptureReader(self._path) as reader:
+            part = reader.split(1)[0]
+
+        directory = build_directory([extract_sessions(self._path, part)])
+        self.assertEqual(len(directory), 4, "sender F-TEIDs of both sides bound to the IMSI")
+
+        shards = route_records(self._path, part, directory, 4)
+        routed = [session for shard in shards for (session, record) in shard]
+        self.assertEqual(len(routed), 15, "every message routed once")
+        for (i, shard) in enumerate(shards):
+            for (session, record) in shard:
+                self.assertEqual(session_shard(session, 4), i, "shard chosen by session")
+        spool = self._directory + '/spool'
+        os.mkdir(spool)
+        self.assertEqual(spool_records(self._path, part, 0, directory, 4, spool), [len(shard) for shard in shards], "records spooled per shard")
+        self.assertEqual(analyze_spooled(SessionAnalyzer, spool, 0, 1), analyze_shard(SessionAnalyzer, shards[0]), "spooled shard analyzed as in memory")
+        self.assertEqual(session_shard('123456789012345', 4), zlib.crc32(b'123456789012345') % 4, "shard does not depend on the process hash seed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import gtppcap
+
+# Parsed GTP headers, one record per packet.  'sequence_number' is -1 for a GTPv1 message without
+# one; 'teid' is 0 and 'has_teid' False for a GTPv2 message without a TEID.  'valid' is False for a
+# packet that is not a well-formed GTPv1 or GTPv2 header, and its other fields are then meaningless.
+header_fields = [
+    ('version',         'u1'),
+    ('flags',           'u1'),
+    ('type',            'u1'),
+    ('length',          'u2'),
+    ('has_teid',        '?'),
+    ('teid',            'u4'),
+    ('sequence_number', 'i8'),
+    ('valid',           '?'),
+]
+
+header_dtype = numpy.dtype(header_fields) if numpy is not None else None
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('gtpbatch requires numpy')
+
+
+def _word(columns, first, size):
+    # big-endian unsigned integer from 'size' octet columns, starting at column 'first'
+    value = columns[first].astype(numpy.uint32)
+    for i in range(first + 1, first + size):
+        value = (value << 8) | columns[i]
+    return value
+
+
+def parse_headers(buffer, offsets, lengths=None):
+    """Parse the GTP headers of many packets at once.  'buffer' is any contiguous bytes-like object
+       holding the packets (e.g. a mapped capture, or one buffer filled by recvmsg_into()), 'offsets' is
+       a sequence or array of the offset of each GTP message in it and 'lengths', if given, the number
+       of octets available for each (the UDP payload length); otherwise each message may run to the end
+       of 'buffer'.  Return a NumPy structured array of header_dtype, one record per offset, computed
+       with vectorized operations over the whole batch."""
+    _require_numpy()
+
+    data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+    count = len(offsets)
+    headers = numpy.zeros(count, dtype=header_dtype)
+
+    if count == 0 or len(data) == 0:
+        return headers
+
+    if lengths is None:
+        available = len(data) - offsets
+    else:
+        available = numpy.minimum(numpy.asarray(lengths, dtype=numpy.int64), len(data) - offsets)
+
+    available = numpy.where(offsets >= 0, available, 0)
+
+    # gather the first twelve octets of every packet, one column at a time.  Packets starting in the
+    # last twelve octets of 'data' are read from a zero-padded copy of that tail instead, and any
+    # octets they lack are caught by the length checks below.
+    tail_start = max(len(data) - 12, 0)
+    near_end = (offsets > tail_start) | (offsets < 0)
+    base = numpy.where(near_end, 0, offsets)
+
+    if near_end.any():
+        tail = numpy.concatenate((data[tail_start:], numpy.zeros(12, dtype=numpy.uint8)))
+        tail_offsets = numpy.clip(offsets[near_end] - tail_start, 0, len(tail) - 12)
+
+    columns = []
+    for i in range(12):
+        column = data.take(base + i, mode='clip')
+        if near_end.any():
+            column[near_end] = tail.take(tail_offsets + i)
+        columns.append(column)
+
+    flags = columns[0]
+    version = flags >> 5
+    length = _word(columns, 2, 2)
+    word1 = _word(columns, 4, 4)
+    word2 = _word(columns, 8, 4)
+
+    is_v1 = version == 1
+    is_v2 = version == 2
+    v2_teid = is_v2 & ((flags & 0x08) != 0)
+    v1_sequence = is_v1 & ((flags & 0x02) != 0)
+
+    headers['version'] = version
+    headers['flags'] = flags
+    headers['type'] = columns[1]
+    headers['length'] = length
+    headers['has_teid'] = is_v1 | v2_teid
+    headers['teid'] = numpy.where(is_v1 | v2_teid, word1, 0)
+
+    sequence_number = numpy.full(count, -1, dtype=numpy.int64)
+    sequence_number = numpy.where(v1_sequence, word2 >> 16, sequence_number)
+    sequence_number = numpy.where(is_v2, numpy.where(v2_teid, word2, word1) >> 8, sequence_number)
+    headers['sequence_number'] = sequence_number
+
+    # GTPv1 lengths exclude the eight mandatory octets, GTPv2 lengths the first four
+    total = numpy.where(is_v1, length.astype(numpy.int64) + 8, length.astype(numpy.int64) + 4)
+    minimum = numpy.where(is_v1 & ((flags & 0x07) != 0), 12, numpy.where(v2_teid, 12, 8))
+    headers['valid'] = (is_v1 | is_v2) & (available >= minimum) & (total >= minimum) & (total <= available)
+
+    return headers
+
+
+def count_types_per_teid(headers):
+    """Count valid messages by (TEID, message type).  Return a structured array with fields 'teid',
+       'type' and 'count', sorted by TEID and then type."""
+    _require_numpy()
+
+    keys = ((headers['teid'].astype(numpy.uint64) << numpy.uint64(8)) | headers['type'])[headers['valid']]
+    (unique, counts) = numpy.unique(keys, return_counts=True)
+
+    result = numpy.zeros(len(unique), dtype=[('teid', 'u4'), ('type', 'u1'), ('count', 'i8')])
+    result['teid'] = unique >> numpy.uint64(8)
+    result['type'] = unique & numpy.uint64(0xff)
+    result['count'] = counts
+    return result
+
+
+def capture_offsets(reader, ports=gtppcap.GTP_PORTS):
+    """Locate the GTP message in every frame of a gtppcap.CaptureReader without decoding it and return
+       (offsets, lengths) as NumPy arrays, for parse_headers(reader.view(), offsets, lengths)"""
+    _require_numpy()
+
+    view = reader.view()
+    locate = gtppcap.locate_gtp
+    offsets = []
+    lengths = []
+
+    for (timestamp, linktype, offset, end) in reader.frames():
+        located = locate(view, offset, end, linktype, ports)
+        if located is not None:
+            offsets.append(located[2])
+            lengths.append(located[3] - located[2])
+
+    return (numpy.array(offsets, dtype=numpy.int64), numpy.array(lengths, dtype=numpy.int64))
+
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class Test_parse_headers(unittest.TestCase):
+    def test_parse_headers(self):
+        import gtpv1
+        import gtpv2
+
+        messages = [
+            gtpv2.v2message(32, 0x123456, 0x100).encode(),
+            gtpv2.v2message(1, 7).encode(),
+            gtpv1.v1message(16, 0xdeadbeef, 0x1234).encode(),
+            gtpv1.v1message(255, 0x200).encode(),
+            b'\x48\x20\x00\x40\x00\x00\x01\x00\x00\x00\x01\x00',
+            b'\x00\x01',
+        ]
+        buffer = b''.join(messages)
+        offsets = [sum(len(m) for m in messages[:i]) for i in range(len(messages))]
+        lengths = [len(m) for m in messages]
+
+        headers = parse_headers(buffer, offsets, lengths)
+        self.assertEqual(list(headers['version'][:4]), [2, 2, 1, 1], "version")
+        self.assertEqual(list(headers['type'][:4]), [32, 1, 16, 255], "message type")
+        self.assertEqual(list(headers['teid'][:4]), [0x100, 0, 0xdeadbeef, 0x200], "TEID")
+        self.assertEqual(list(headers['has_teid'][:4]), [True, False, True, True], "has_teid")
+        self.assertEqual(list(headers['sequence_number'][:4]), [0x123456, 7, 0x1234, -1], "sequence number")
+        self.assertEqual(list(headers['valid']), [True, True, True, True, False, False], "asserted length past available and short packets are invalid")
+
+        self.assertEqual(len(parse_headers(buffer, [])), 0, "empty batch")
+
+
+    def test_count_types_per_teid(self):
+        import gtpv2
+
+        encoded = [gtpv2.v2message(type, 1, teid).encode() for (type, teid) in ((34, 2), (34, 2), (36, 2), (34, 1))]
+        buffer = bytearray(b''.join(encoded))
+        headers = parse_headers(buffer, numpy.arange(4) * len(encoded[0]))
+        counts = count_types_per_teid(headers)
+        self.assertEqual([tuple(int(v) for v in c) for c in counts], [(1, 34, 1), (2, 34, 2), (2, 36, 1)], "count_types_per_teid()")
+
+
+    def test_capture_offsets(self):
+        import tempfile
+        import shutil
+        import gtpv2
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = directory + '/test.pcap'
+            with gtppcap.CaptureWriter(path) as writer:
+                writer.write(gtpv2.v2message(32, 5, 0), ('10.0.0.1', 2123), ('10.0.0.2', 2123), 1.0)
+                writer.write(b'not gtp', ('10.0.0.1', 5000), ('10.0.0.2', 5001), 2.0)
+                writer.write(gtpv2.v2message(33, 5, 0x100), ('10.0.0.2', 2123), ('10.0.0.1', 2123), 3.0)
+
+            with gtppcap.CaptureReader(path) as reader:
+                (offsets, lengths) = capture_offsets(reader)
+                headers = parse_headers(reader.view(), offsets, lengths)
+                self.assertEqual(list(headers['type']), [32, 33], "capture_offsets() locates GTP messages")
+                self.assertEqual(list(headers['teid']), [0, 0x100], "capture_offsets() headers TEID")
+                del headers
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
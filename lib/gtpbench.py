@@ -0,0 +1,416 @@
+import unittest
+import argparse
+import gc
+import json
+import os
+import statistics
+import struct
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import gtpv1
+import gtpv2
+
+# Microbenchmarks for IE and message construction, encoding and decoding.  Each benchmark runs over the
+# recorded payloads in the fixtures file and reports:
+#
+#   ops            -- operations per second (best of several repeats)
+#   score          -- operations per second relative to a fixed calibration loop timed alongside, so
+#                     that the machine slowing down or speeding up during a run affects both alike
+#   allocated      -- peak octets of memory allocated while performing one operation
+#   retained       -- memory blocks still allocated per operation afterwards (non-zero means a leak or
+#                     a growing cache)
+#   spread         -- the largest deviation of a single round's score from the median, as a fraction
+#
+# CPython has no counter of allocation calls, so 'allocated' (from tracemalloc) stands in for
+# allocations per operation; unlike timings it is deterministic and so flags any new allocation.
+#
+# Scores vary far more between interpreter processes (memory layout, hash seed) than within one, so the
+# suite runs several rounds, each in a fresh interpreter, and reports the median.  The baseline keeps
+# each benchmark's spread, which widens that benchmark's regression threshold.  A baseline is only
+# meaningful on the machine and Python build it was recorded on.
+#
+#   python3 gtpbench.py                  run and compare against the stored baseline
+#   python3 gtpbench.py --update         run and store the results as the new baseline
+#   python3 gtpbench.py --record FILE    rebuild the fixtures file, taking payloads from a pcap capture
+#                                        when one is given
+
+here = os.path.dirname(os.path.abspath(__file__))
+fixtures_path = os.path.join(here, 'gtpbench_fixtures.json')
+baseline_path = os.path.join(here, 'gtpbench_baseline.json')
+
+# a benchmark regresses when its score drops by more than this fraction plus its baseline spread, or its
+# allocation grows by more than this fraction
+default_threshold = 0.2
+default_rounds = 5
+
+calibration_struct = struct.Struct('! B B H I I')
+
+
+def fixture_messages():
+    """The messages recorded as fixtures when no capture is given: {name: encoded message}"""
+    csr_IEs = (
+        gtpv2.IE(1, '001010123456789'),
+        gtpv2.IE(76, '15551234567'),
+        gtpv2.IE(75, '3534900698733190'),
+        gtpv2.IE(86, gtpv2.ULI.create(tai=gtpv2.TAI('001', '01', 0x0001), ecgi=gtpv2.ECGI('001', '01', 0x0001001))),
+        gtpv2.IE(83, ('001', '01')),
+        gtpv2.IE(82, b'\x06'),
+        gtpv2.IE(87, gtpv2.FTEID.create(10, 0x10000001, '10.0.0.1')),
+        gtpv2.IE(87, gtpv2.FTEID.create(7, 0, '10.0.0.3'), instance=1),
+        gtpv2.IE(71, b'\x08internet'),
+        gtpv2.IE(128, b'\x00'),
+        gtpv2.IE(99, b'\x01'),
+        gtpv2.IE(79, gtpv2.PAA.create('0.0.0.0')),
+        gtpv2.IE(127, b'\x00'),
+        gtpv2.IE(72, gtpv2.AMBR(100000, 100000)),
+        gtpv2.IE(93, (gtpv2.IE(73, b'\x05'), gtpv2.IE(80, gtpv2.BearerQoS(0, 9, 0, 9, 0, 0, 0, 0)))),
+    )
+
+    cpcr_IEs = (
+        gtpv1.ie(2, '001010123456789'),
+        gtpv1.ie(14, 3),
+        gtpv1.ie(15, 0xfc),
+        gtpv1.ie(16, 0x10000001),
+        gtpv1.ie(17, 0x10000002),
+        gtpv1.ie(20, 5),
+        gtpv1.ie(128, b'\xf1\x21'),
+        gtpv1.ie(131, b'\x08internet'),
+        gtpv1.ie(133, b'\x0a\x00\x00\x01'),
+        gtpv1.ie(133, b'\x0a\x00\x00\x01'),
+        gtpv1.ie(134, b'\x91\x51\x55\x21\x43\x65\xf7'),
+        gtpv1.ie(135, b'\x02\x23\x92\x1f'),
+    )
+
+    return {
+        'v2_create_session_request': bytes(gtpv2.v2message(32, 0x1234, 0, csr_IEs).encode()),
+        'v2_echo_request': bytes(gtpv2.v2message(1, 0x1235, None, (gtpv2.IE(3, b'\x07'), gtpv2.IE(152, b'\x01'))).encode()),
+        'v1_create_pdp_context_request': bytes(gtpv1.v1message(16, 0, 0x1234, IEs=cpcr_IEs).encode()),
+        'v1_echo_response': bytes(gtpv1.v1message(2, 0, 0x1235, IEs=(gtpv1.ie(14, 7),)).encode()),
+    }
+
+
+def record_fixtures(path=fixtures_path, capture=None):
+    """Write the fixture payloads to 'path' as JSON of name to hex.  If 'capture' names a pcap or pcapng
+       file, the first message of each (version, type) in it is recorded as well."""
+    messages = fixture_messages()
+
+    if capture is not None:
+        import gtppcap
+        with gtppcap.CaptureReader(capture) as reader:
+            view = reader.view()
+            for (timestamp, linktype, offset, end) in reader.frames():
+                located = gtppcap.locate_gtp(view, offset, end, linktype, gtppcap.GTP_PORTS)
+                if located is None:
+                    continue
+                payload = bytes(view[located[2]:located[3]])
+                name = 'capture_v{}_{}'.format(payload[0] >> 5, payload[1])
+                messages.setdefault(name, payload)
+            del view
+
+    with open(path, 'w') as f:
+        json.dump(dict((name, payload.hex()) for (name, payload) in sorted(messages.items())), f, indent=4, sort_keys=True)
+        f.write('\n')
+
+
+def load_fixtures(path=fixtures_path):
+    """Read the fixture payloads: {name: encoded message as bytes}"""
+    with open(path) as f:
+        return dict((name, bytes.fromhex(payload)) for (name, payload) in json.load(f).items())
+
+
+def _decode_all(message):
+    # decode a message and every IE value in it, as an application reading every field would
+    for ie in message.IEs():
+        ie.decoded_value()
+
+
+def benchmarks(fixtures):
+    """Return [(name, operation)], each operation a callable taking no arguments"""
+    # only the schema benchmark needs gtpschema, so the rest of the suite does not depend on it
+    import gtpschema
+
+    v2_csr = fixtures['v2_create_session_request']
+    v2_echo = fixtures['v2_echo_request']
+    v1_cpcr = fixtures['v1_create_pdp_context_request']
+    v1_echo = fixtures['v1_echo_response']
+
+    v2_csr_message = gtpv2.v2message.decode(v2_csr)
+    v2_csr_IEs = v2_csr_message.IEs()
+    v2_echo_message = gtpv2.v2message.decode(v2_echo)
+    v1_cpcr_message = gtpv1.v1message.decode(v1_cpcr)
+    v1_cpcr_IEs = v1_cpcr_message.IEs()
+
+    v2_fteid = v2_csr_message.get_IE(87)
+    v2_fteid_value = bytes(v2_fteid.encoded_value())
+    v2_fteid_encoded = bytes(v2_fteid.encode())
+    v1_apn = v1_cpcr_message.get_IE(131)
+    v1_apn_encoded = bytes(v1_apn.encode())
+    v2_buffer = bytearray(len(v2_csr))
+
+    dispatcher = gtpv2.MessageDispatcher()
+    dispatcher.register(1, lambda message: message.sequence_number())
+
+    # ten echoes to every Create Session, as on a quiet S11 link
+    mix = [v2_echo] * 10 + [v2_csr]
+
+    return [
+        ('v2_ie_construct_raw',         lambda: gtpv2.IE(87, v2_fteid_value, raw=True)),
+        ('v2_ie_construct_imsi',        lambda: gtpv2.IE(1, '001010123456789')),
+        ('v2_ie_construct_u8',          lambda: gtpv2.IE(82, b'\x06')),
+        ('v2_ie_encode',                lambda: v2_fteid.encode()),
+        ('v2_decode_next_ie',           lambda: gtpv2.decode_next_IE(v2_fteid_encoded)),
+        ('v2_csr_decode',               lambda: gtpv2.v2message.decode(v2_csr).IEs()),
+        ('v2_csr_decode_all',           lambda: _decode_all(gtpv2.v2message.decode(v2_csr))),
+        ('v2_csr_construct_encode',     lambda: gtpv2.v2message(32, 0x1234, 0, v2_csr_IEs).encode()),
+        ('v2_csr_encode',               lambda: v2_csr_message.encode()),
+        ('v2_csr_encode_into',          lambda: v2_csr_message.encode_into(v2_buffer)),
+        ('v2_echo_decode',              lambda: gtpv2.v2message.decode(v2_echo).IEs()),
+        ('v2_echo_encode',              lambda: v2_echo_message.encode()),
+        ('v2_mix_decode',               lambda: [gtpv2.v2message.decode(m).IEs() for m in mix]),
+        ('v2_dispatch',                 lambda: dispatcher.dispatch(v2_echo)),
+        ('v2_dispatch_reject',          lambda: dispatcher.dispatch(v2_csr)),
+        ('v2_csr_schema_check',         lambda: gtpschema.check(v2_csr)),
+        ('v1_ie_construct_raw',         lambda: gtpv1.ie(131, b'\x08internet', raw=True)),
+        ('v1_ie_construct_u32',         lambda: gtpv1.ie(16, 0x10000001)),
+        ('v1_ie_encode',                lambda: v1_apn.encode()),
+        ('v1_decode_next_ie',           lambda: gtpv1.decode_next_IE(v1_apn_encoded)),
+        ('v1_cpcr_decode',              lambda: gtpv1.v1message.decode(v1_cpcr).IEs()),
+        ('v1_cpcr_decode_all',          lambda: _decode_all(gtpv1.v1message.decode(v1_cpcr))),
+        ('v1_cpcr_construct_encode',    lambda: gtpv1.v1message(16, 0, 0x1234, IEs=v1_cpcr_IEs).encode()),
+        ('v1_echo_decode',              lambda: gtpv1.v1message.decode(v1_echo).IEs()),
+    ]
+
+
+def _calibration():
+    # a fixed workload of the same kind as the benchmarks (struct unpacking, tuple and object creation)
+    header = b'\x48\x20\x00\x10\x00\x00\x01\x00\x00\x12\x34\x00'
+    for i in range(20):
+        calibration_struct.unpack_from(header, 0)
+
+
+def _loop_count(operation, target):
+    # the number of calls to 'operation' taking about 'target' seconds
+    clock = time.perf_counter
+    number = 1
+    while True:
+        start = clock()
+        for i in range(number):
+            operation()
+        elapsed = clock() - start
+        if elapsed >= target / 5:
+            return max(1, int(number * target / max(elapsed, 1e-9)))
+        number *= 2
+
+
+def _timed(operation, number):
+    clock = time.perf_counter
+    start = clock()
+    for i in range(number):
+        operation()
+    return clock() - start
+
+
+def time_operation(operation, target=0.05, repeats=5):
+    """Time 'repeats' runs of about 'target' seconds of 'operation', each immediately preceded by a run of
+       the calibration loop.  Return (best operations per second, median ratio of operation to calibration
+       rate); pairing every run with a calibration run makes the ratio insensitive to the machine slowing
+       down or speeding up during the benchmark."""
+    number = _loop_count(operation, target)
+    calibration_number = _loop_count(_calibration, target)
+    rates = []
+    ratios = []
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for r in range(repeats):
+            calibration_rate = calibration_number / _timed(_calibration, calibration_number)
+            rate = number / _timed(operation, number)
+            rates.append(rate)
+            ratios.append(rate / calibration_rate)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    ratios.sort()
+    return (max(rates), ratios[len(ratios) // 2])
+
+
+def measure_allocations(operation, count=100):
+    """Return (peak octets allocated by one operation, blocks retained per operation over 'count' runs)"""
+    operation()
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        operation()
+        allocated = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+    blocks = sys.getallocatedblocks()
+    for i in range(count):
+        operation()
+    retained = (sys.getallocatedblocks() - blocks) / float(count)
+
+    return (allocated, retained)
+
+
+def run_benchmarks(fixtures=None, names=None, target=0.05, repeats=5):
+    """Run the benchmarks (those in 'names' only, if given) and return {'results': {name: {'ops', 'score',
+       'allocated', 'retained'}}}"""
+    if fixtures is None:
+        fixtures = load_fixtures()
+
+    results = {}
+
+    for (name, operation) in benchmarks(fixtures):
+        if names is not None and name not in names:
+            continue
+        (ops, score) = time_operation(operation, target, repeats)
+        (allocated, retained) = measure_allocations(operation)
+        results[name] = {'ops': ops, 'score': score, 'allocated': allocated, 'retained': retained}
+
+    return {'results': results}
+
+
+def run_rounds(rounds=default_rounds, fixtures=fixtures_path, names=None, target=0.05):
+    """Run the benchmarks (those in 'names' only, if given) over the fixtures file 'fixtures' in 'rounds'
+       fresh interpreters, one after another, and combine the results as for run_benchmarks(): the median
+       score, with its 'spread', the best ops, and the median allocation and retention"""
+    command = [sys.executable, os.path.abspath(__file__), '--json', '--fixtures', fixtures, '--target', str(target)] + list(names or ())
+    runs = [json.loads(subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout)['results'] for r in range(rounds)]
+
+    results = {}
+    for name in runs[0]:
+        scores = [run[name]['score'] for run in runs]
+        score = statistics.median(scores)
+        results[name] = {
+            'ops': max(run[name]['ops'] for run in runs),
+            'score': score,
+            'spread': max(abs(s / score - 1) for s in scores),
+            'allocated': statistics.median_low([run[name]['allocated'] for run in runs]),
+            'retained': statistics.median_low([run[name]['retained'] for run in runs]),
+        }
+
+    return {'rounds': rounds, 'results': results}
+
+
+def compare(current, baseline, threshold=default_threshold):
+    """Return a list of descriptions of the benchmarks in 'current' that regressed against 'baseline':
+       score lower by more than 'threshold' plus the benchmark's baseline spread, or allocation (beyond
+       a 64 octet allowance) higher by more than 'threshold'.  Benchmarks missing from either are
+       ignored."""
+    regressions = []
+
+    for (name, result) in sorted(current['results'].items()):
+        reference = baseline['results'].get(name)
+        if reference is None:
+            continue
+
+        tolerance = threshold + reference.get('spread', 0)
+        if result['score'] < reference['score'] * (1 - tolerance):
+            regressions.append('{}: score {:.4f} is {:.1%} below baseline {:.4f} (tolerance {:.1%})'.format(name, result['score'], 1 - result['score'] / reference['score'], reference['score'], tolerance))
+
+        if result['allocated'] > reference['allocated'] * (1 + threshold) + 64:
+            regressions.append('{}: allocates {} octets per operation, baseline {}'.format(name, result['allocated'], reference['allocated']))
+
+        if result['retained'] > reference['retained'] + 0.5:
+            regressions.append('{}: retains {:.2f} blocks per operation, baseline {:.2f}'.format(name, result['retained'], reference['retained']))
+
+    return regressions
+
+
+def format_results(current, baseline=None):
+    lines = ['{:<28} {:>12} {:>10} {:>8} {:>10} {:>9}'.format('benchmark', 'ops/sec', 'score', 'spread', 'vs base', 'octets')]
+    for (name, result) in sorted(current['results'].items()):
+        reference = baseline['results'].get(name) if baseline is not None else None
+        change = '{:+.1%}'.format(result['score'] / reference['score'] - 1) if reference is not None else '-'
+        lines.append('{:<28} {:>12.0f} {:>10.4f} {:>8.1%} {:>10} {:>9}'.format(name, result['ops'], result['score'], result.get('spread', 0), change, result['allocated']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='GTP codec microbenchmarks')
+    parser.add_argument('--baseline', default=baseline_path, help='baseline results file')
+    parser.add_argument('--fixtures', default=fixtures_path, help='fixture payloads file')
+    parser.add_argument('--threshold', type=float, default=default_threshold, help='regression threshold, as a fraction')
+    parser.add_argument('--target', type=float, default=0.05, help='seconds per timing repeat')
+    parser.add_argument('--rounds', type=int, default=default_rounds, help='rounds, each in a fresh interpreter')
+    parser.add_argument('--json', action='store_true', help='run a single round in this interpreter and print the results as JSON')
+    parser.add_argument('--update', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--record', nargs='?', const='', metavar='CAPTURE', help='rebuild the fixtures file, optionally from a capture, and exit')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default all)')
+    args = parser.parse_args(argv)
+
+    if args.record is not None:
+        record_fixtures(args.fixtures, args.record or None)
+        return 0
+
+    if args.json:
+        json.dump(run_benchmarks(load_fixtures(args.fixtures), args.names or None, args.target), sys.stdout)
+        return 0
+
+    current = run_rounds(args.rounds, args.fixtures, args.names or None, args.target)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(format_results(current, baseline))
+
+    if args.update:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=4, sort_keys=True)
+            f.write('\n')
+        return 0
+
+    if baseline is None:
+        print('No baseline at {}; run with --update to create one'.format(args.baseline))
+        return 0
+
+    regressions = compare(current, baseline, args.threshold)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    return 1 if regressions else 0
+
+
+
+class Test_benchmarks(unittest.TestCase):
+    def test_fixtures(self):
+        fixtures = load_fixtures()
+        self.assertEqual(fixtures['v2_create_session_request'], fixture_messages()['v2_create_session_request'], "stored fixture matches encoder output")
+        self.assertEqual(len(gtpv2.v2message.decode(fixtures['v2_create_session_request']).IEs()), 15, "15-IE Create Session Request")
+        self.assertEqual(len(gtpv2.v2message.decode(fixtures['v2_echo_request']).IEs()), 2, "2-IE Echo Request")
+
+
+    def test_run_and_compare(self):
+        current = run_benchmarks(names=('v2_echo_decode', 'v1_ie_encode'), target=0.002, repeats=2)
+        self.assertEqual(sorted(current['results']), ['v1_ie_encode', 'v2_echo_decode'], "selected benchmarks run")
+        self.assertGreater(current['results']['v2_echo_decode']['allocated'], 0, "decode allocates")
+        self.assertEqual(compare(current, current), [], "no regression against itself")
+
+        faster = {'results': dict((name, dict(result, score=result['score'] * 2)) for (name, result) in current['results'].items())}
+        self.assertEqual(len(compare(current, faster)), 2, "halved score is a regression")
+        self.assertEqual(compare(faster, current), [], "improvement is not a regression")
+
+        noisy = {'results': dict((name, dict(result, score=result['score'] * 2, spread=0.6)) for (name, result) in current['results'].items())}
+        self.assertEqual(compare(current, noisy), [], "baseline spread widens the threshold")
+
+
+    def test_rounds(self):
+        current = run_rounds(2, names=('v2_echo_decode',), target=0.002)
+        self.assertEqual((current['rounds'], sorted(current['results'])), (2, ['v2_echo_decode']), "rounds run in fresh interpreters")
+        self.assertGreaterEqual(current['results']['v2_echo_decode']['spread'], 0, "spread reported")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,633 @@
+import unittest
+import asyncio
+import heapq
+import itertools
+import time
+
+import gtpv1
+import gtpv2
+
+GTPC_PORT = 2123
+
+
+class ResponseCache(object):
+    """Encoded responses keyed by (peer, GTP version, sequence number, request message type), so that a
+       retransmitted request is answered with the original response rather than being processed again.
+       Entries live for between 'window' and twice 'window' seconds: the cache keeps two generations of
+       entries and discards the older one wholesale every 'window' seconds, or as soon as the current
+       generation holds 'max_entries', which bounds memory no matter the request rate."""
+
+    __slots__ = ('_window', '_max_entries', '_clock', '_current', '_previous', '_rotate_at')
+
+    def __init__(self, window=12.0, max_entries=1 << 20, clock=time.monotonic):
+        self._window = window
+        self._max_entries = max_entries
+        self._clock = clock
+        self._current = {}
+        self._previous = {}
+        self._rotate_at = clock() + window
+
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+
+    def _rotate_if_due(self):
+        now = self._clock()
+        if now >= self._rotate_at or len(self._current) >= self._max_entries:
+            # after a long idle period both generations are stale
+            self._previous = self._current if now < self._rotate_at + self._window else {}
+            self._current = {}
+            self._rotate_at = now + self._window
+
+
+    def get(self, key):
+        """The encoded response for 'key', b'' if the request is still being processed, or None if the
+           request has not been seen within the window"""
+        self._rotate_if_due()
+        response = self._current.get(key)
+        if response is None:
+            response = self._previous.get(key)
+        return response
+
+
+    def reserve(self, key):
+        """Record that the request for 'key' is being processed, so duplicates arriving before its
+           response is stored are dropped"""
+        self._rotate_if_due()
+        self._current[key] = b''
+
+
+    def release(self, key):
+        """Drop the reservation for 'key' when the request produced no response, so a retransmission of
+           it is processed again.  A stored response is kept."""
+        for generation in (self._current, self._previous):
+            if generation.get(key) == b'':
+                del generation[key]
+
+
+    def store(self, key, response):
+        """Record the encoded 'response' for 'key'"""
+        self._rotate_if_due()
+        self._current[key] = response
+
+
+def request_key(data, peer):
+    """The ResponseCache key (peer, GTP version, sequence number, message type) for the encoded GTPv1 or
+       GTPv2 message 'data', read straight from the header octets, or None if the header carries no
+       sequence number or is too short"""
+    if len(data) < 8:
+        return None
+
+    flags = data[0]
+
+    if flags >> 5 == 2:
+        offset = 8 if flags & 0x08 else 4
+        if len(data) < offset + 4:
+            return None
+        return (peer, 2, (data[offset] << 16) | (data[offset + 1] << 8) | data[offset + 2], data[1])
+
+    if flags & 0x02 and len(data) >= 12:
+        return (peer, 1, (data[8] << 8) | data[9], data[1])
+
+    return None
+
+
+# Message types that may answer any request with its sequence number: Version Not Supported (both
+# versions) and, in GTPv1, Supported Extension Headers Notification; indexed by GTP version
+any_request_responses = (None, frozenset((3, 31)), frozenset((3,)))
+
+def response_types(version, request_type):
+    """The message types that answer a request of 'request_type' in GTP 'version': its response, which
+       in both versions has the next message type, or a message that may answer any request"""
+    return any_request_responses[version] | frozenset((request_type + 1,))
+
+
+class _transaction(object):
+    """An outstanding request: the encoded message (for retransmission), the message types that answer
+       it, the future waiting on the response, and the retransmission state."""
+
+    __slots__ = ('encoded', 'peer', 'response_types', 'future', 'deadline', 'retries')
+
+    def __init__(self, encoded, peer, response_types, future, deadline):
+        self.encoded = encoded
+        self.peer = peer
+        self.response_types = response_types
+        self.future = future
+        self.deadline = deadline
+        self.retries = 0
+
+
+class GTPCEndpoint(asyncio.DatagramProtocol):
+    """A GTP-C endpoint over UDP.  Outgoing requests are matched to their responses by (peer, GTP
+       version, sequence number) and are retransmitted every 't3_response' seconds up to 'n3_requests'
+       times.  All retransmission deadlines live in a single heap driven by one loop timer, so there is
+       no task or timer handle per request.
+
+       Incoming messages that do not answer an outstanding request are passed, with the peer address,
+       to 'request_handler'.  If it returns a message (or an awaitable producing one), that message is
+       encoded and sent back to the peer.  Unless 'cache_responses' is False, responses are kept in a
+       ResponseCache for the peer's retransmission window (t3_response * (n3_requests + 1) seconds),
+       and a retransmitted request is answered from it, or dropped while still being processed,
+       using only its header octets.  A request whose handler produces no response, or raises, is
+       forgotten, so its retransmissions are processed again; exceptions from the handler are passed
+       to the loop's exception handler.
+
+       If 'restart_counter' is given, Echo Requests (GTPv1 and GTPv2) are answered on a fast path by
+       gtpv1.EchoResponder and gtpv2.EchoResponder, with that restart counter in the Recovery IE, and
+       never reach 'request_handler'."""
+
+    def __init__(self, request_handler=None, t3_response=3.0, n3_requests=3, cache_responses=True, restart_counter=None):
+        self._request_handler = request_handler
+        if restart_counter is None:
+            self._echo_responders = None
+        else:
+            self._echo_responders = (None, gtpv1.EchoResponder(restart_counter), gtpv2.EchoResponder(restart_counter))
+        self._response_cache = ResponseCache(t3_response * (n3_requests + 1)) if cache_responses else None
+        self._t3_response = t3_response
+        self._n3_requests = n3_requests
+        self._transport = None
+        self._loop = None
+        self._pending = {}
+        self._timers = []
+        self._timer_order = itertools.count()
+        self._timer_handle = None
+        self._sequence_number = 0
+        # tasks answering requests from awaitable handlers, referenced here so they are not collected
+        self._tasks = set()
+
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._loop = asyncio.get_running_loop()
+
+
+    def connection_lost(self, exc):
+        if self._timer_handle is not None:
+            self._timer_handle.cancel()
+            self._timer_handle = None
+
+        for transaction in self._pending.values():
+            if not transaction.future.done():
+                transaction.future.set_exception(ConnectionError('GTP-C endpoint closed'))
+
+        self._pending.clear()
+        del self._timers[:]
+
+        for task in self._tasks:
+            task.cancel()
+
+
+    def close(self):
+        """Close the underlying transport, failing any outstanding requests and cancelling any handlers
+           still producing responses"""
+        if self._transport is not None:
+            self._transport.close()
+
+
+    def outstanding_requests(self):
+        """The number of requests still waiting on a response"""
+        return len(self._pending)
+
+
+    def next_sequence_number(self, version=2):
+        """A sequence number for a new request: 24 bits for GTPv2, 16 bits for GTPv1"""
+        self._sequence_number = (self._sequence_number + 1) & 0xffffff
+        if version == 1:
+            return self._sequence_number & 0xffff
+        return self._sequence_number
+
+
+    def send_request(self, message, peer, expected_types=None):
+        """Send the request 'message' (a gtpv2.v2message or gtpv1.v1message) to 'peer' and return a
+           future for the decoded response: the first message from the peer with the same GTP version
+           and sequence number and a type in 'expected_types' (by default, response_types() of the
+           request; a Command, for instance, may instead be answered by the request it triggers).  The
+           future raises asyncio.TimeoutError if no response arrives after all retransmissions.  Raises
+           ValueError if the message has no sequence number, or if a request of the same GTP version
+           with the same sequence number to the same peer is already outstanding."""
+        sequence_number = message.sequence_number()
+
+        if sequence_number is None:
+            raise ValueError('Request of type ({}) has no sequence number'.format(str(message.type())))
+
+        version = 2 if isinstance(message, gtpv2.v2message) else 1
+        key = (peer, version, sequence_number)
+
+        if expected_types is None:
+            expected_types = response_types(version, message.type())
+
+        if key in self._pending:
+            raise ValueError('Request with sequence number ({}) to peer ({}) is already outstanding'.format(str(sequence_number), str(peer)))
+
+        encoded = message.encode()
+        future = self._loop.create_future()
+        deadline = self._loop.time() + self._t3_response
+
+        self._pending[key] = _transaction(encoded, peer, expected_types, future, deadline)
+        heapq.heappush(self._timers, (deadline, next(self._timer_order), key))
+        self._arm_timer()
+
+        self._transport.sendto(encoded, peer)
+
+        return future
+
+
+    def send_response(self, message, peer):
+        """Send the response 'message' to 'peer'.  Responses are never retransmitted."""
+        self._transport.sendto(message.encode(), peer)
+
+
+    def datagram_received(self, data, addr):
+        if self._echo_responders is not None and len(data) > 1 and data[1] == 1:
+            version = data[0] >> 5
+            if 1 <= version <= 2:
+                response = self._echo_responders[version].respond(data)
+                if response is not None:
+                    self._transport.sendto(response, addr)
+                    return
+
+        cache = self._response_cache
+        cache_key = None
+
+        if cache is not None:
+            cache_key = request_key(data, addr)
+            if cache_key is not None:
+                response = cache.get(cache_key)
+                if response is not None:
+                    if response:
+                        self._transport.sendto(response, addr)
+                    return
+
+        try:
+            if data[0] >> 5 == 2:
+                message = gtpv2.v2message.decode(data)
+            else:
+                message = gtpv1.v1message.decode(data)
+        except (ValueError, IndexError):
+            return
+
+        key = (addr, data[0] >> 5, message.sequence_number())
+        transaction = self._pending.get(key)
+
+        # a peer request can reuse the sequence number of one of ours, so only an expected response
+        # type completes the transaction
+        if transaction is not None and message.type() in transaction.response_types:
+            del self._pending[key]
+            if not transaction.future.done():
+                transaction.future.set_result(message)
+            return
+
+        if self._request_handler is not None:
+            reserved = cache_key is not None
+            if reserved:
+                cache.reserve(cache_key)
+
+            try:
+                response = self._request_handler(message, addr)
+                if response is not None:
+                    if hasattr(response, '__await__'):
+                        task = asyncio.ensure_future(self._respond_later(response, addr, cache_key))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                    else:
+                        self._respond(response, addr, cache_key)
+                    # _respond() stored the response, or _respond_later() now owns the reservation
+                    reserved = False
+            finally:
+                if reserved:
+                    cache.release(cache_key)
+
+
+    def _respond(self, response, peer, cache_key):
+        encoded = response.encode()
+        if cache_key is not None:
+            self._response_cache.store(cache_key, encoded)
+        self._transport.sendto(encoded, peer)
+
+
+    async def _respond_later(self, awaitable, peer, cache_key):
+        responded = False
+        try:
+            response = await awaitable
+            if response is not None and self._transport is not None and not self._transport.is_closing():
+                self._respond(response, peer, cache_key)
+                responded = True
+        except Exception as e:
+            self._loop.call_exception_handler({'message': 'GTP-C request handler failed', 'exception': e, 'protocol': self})
+        finally:
+            if not responded and cache_key is not None:
+                self._response_cache.release(cache_key)
+
+
+    def _arm_timer(self):
+        deadline = self._timers[0][0]
+        if self._timer_handle is None or self._timer_handle.when() > deadline:
+            if self._timer_handle is not None:
+                self._timer_handle.cancel()
+            self._timer_handle = self._loop.call_at(deadline, self._expire_timers)
+
+
+    def _expire_timers(self):
+        self._timer_handle = None
+        now = self._loop.time()
+        timers = self._timers
+
+        while timers and timers[0][0] <= now:
+            (deadline, order, key) = heapq.heappop(timers)
+            transaction = self._pending.get(key)
+
+            # answered, or superseded by a later deadline for the same transaction
+            if transaction is None or transaction.deadline != deadline:
+                continue
+
+            if transaction.future.done():
+                del self._pending[key]
+            elif transaction.retries < self._n3_requests:
+                transaction.retries += 1
+                transaction.deadline = now + self._t3_response
+                heapq.heappush(timers, (transaction.deadline, next(self._timer_order), key))
+                self._transport.sendto(transaction.encoded, transaction.peer)
+            else:
+                del self._pending[key]
+                transaction.future.set_exception(asyncio.TimeoutError('No response to request with sequence number ({}) from peer ({})'.format(str(key[2]), str(key[0]))))
+
+        if timers:
+            self._arm_timer()
+
+
+async def create_endpoint(local_addr=('0.0.0.0', GTPC_PORT), **kwargs):
+    """Create a GTPCEndpoint bound to 'local_addr' on the running event loop.  Keyword arguments are
+       passed to the GTPCEndpoint constructor."""
+    loop = asyncio.get_running_loop()
+    (transport, endpoint) = await loop.create_datagram_endpoint(lambda: GTPCEndpoint(**kwargs), local_addr=local_addr)
+    return endpoint
+
+
+
+class Test_ResponseCache(unittest.TestCase):
+    def test_eviction(self):
+        now = [0.0]
+        cache = ResponseCache(window=10, max_entries=3, clock=lambda: now[0])
+
+        cache.reserve('a')
+        self.assertEqual(cache.get('a'), b'', "reserved entry is b''")
+        cache.release('a')
+        self.assertIsNone(cache.get('a'), "released reservation is gone")
+        cache.reserve('a')
+        cache.store('a', b'response')
+        cache.release('a')
+        self.assertEqual(cache.get('a'), b'response', "stored entry is returned, and not released")
+        self.assertIsNone(cache.get('b'), "unknown entry is None")
+
+        now[0] = 15
+        self.assertEqual(cache.get('a'), b'response', "entry survives into the previous generation")
+        now[0] = 25
+        self.assertIsNone(cache.get('a'), "entry is gone after two windows")
+
+        for key in ('a', 'b', 'c', 'd'):
+            cache.store(key, b'x')
+        self.assertLessEqual(len(cache), 4, "generation size is bounded by max_entries")
+        self.assertEqual(cache.get('d'), b'x', "newest entry kept when max_entries forces a rotation")
+
+
+    def test_request_key(self):
+        self.assertEqual(request_key(gtpv2.v2message(32, 0x123456, teid=1).encode(), 'peer'), ('peer', 2, 0x123456, 32), "request_key() for GTPv2 with TEID")
+        self.assertEqual(request_key(gtpv2.v2message(1, 0x123456).encode(), 'peer'), ('peer', 2, 0x123456, 1), "request_key() for GTPv2 without TEID")
+        self.assertIsNone(request_key(gtpv2.v2message(32, 1, teid=1).encode()[:10], 'peer'), "request_key() for truncated GTPv2")
+        self.assertEqual(request_key(gtpv1.v1message(16, 1, 0x1234).encode(), 'peer'), ('peer', 1, 0x1234, 16), "request_key() for GTPv1")
+        self.assertNotEqual(request_key(gtpv1.v1message(1, 0, 5).encode(), 'peer'), request_key(gtpv2.v2message(1, 5).encode(), 'peer'), "request_key() differs between GTP versions")
+        self.assertIsNone(request_key(gtpv1.v1message(255, 1, IEs=(gtpv1.ie(14, 1),) * 4).encode(), 'peer'), "request_key() without sequence number")
+
+
+class Test_GTPCEndpoint(unittest.TestCase):
+    def run_async(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(asyncio.wait_for(coroutine, 5))
+        finally:
+            loop.close()
+
+
+    def test_request_response(self):
+        async def scenario():
+            def echo(message, peer):
+                return gtpv2.v2message(2, message.sequence_number(), IEs=(gtpv2.IE(3, b'\x05'),))
+
+            server = await create_endpoint(('127.0.0.1', 0), request_handler=echo)
+            client = await create_endpoint(('127.0.0.1', 0))
+            peer = server._transport.get_extra_info('sockname')
+
+            responses = await asyncio.gather(*[client.send_request(gtpv2.v2message(1, client.next_sequence_number()), peer) for i in range(100)])
+            self.assertEqual(set(r.type() for r in responses), set([2]), "every Echo Request gets an Echo Response")
+            self.assertEqual(sorted(r.sequence_number() for r in responses), list(range(1, 101)), "responses are matched by sequence number")
+            self.assertEqual(client.outstanding_requests(), 0, "no requests outstanding")
+
+            client.close()
+            server.close()
+
+        self.run_async(scenario())
+
+
+    def test_echo(self):
+        async def scenario():
+            def fail(message, peer):
+                self.fail("Echo Request reached the request handler")
+
+            server = await create_endpoint(('127.0.0.1', 0), request_handler=fail, restart_counter=9)
+            client = await create_endpoint(('127.0.0.1', 0))
+            peer = server._transport.get_extra_info('sockname')
+
+            response = await client.send_request(gtpv2.v2message(1, 3), peer)
+            self.assertEqual((response.type(), response.sequence_number(), response.get_IE(3).decoded_value()), (2, 3, b'\x09'), "GTPv2 Echo Response")
+
+            response = await client.send_request(gtpv1.v1message(1, 0, 4), peer)
+            self.assertEqual((response.type(), response.sequence_number(), response.get_IE(14).decoded_value()), (2, 4, 9), "GTPv1 Echo Response")
+
+            client.close()
+            server.close()
+
+        self.run_async(scenario())
+
+
+    def test_duplicate_requests(self):
+        async def scenario():
+            handled = []
+            received = []
+
+            def respond(message, peer):
+                handled.append(message.sequence_number())
+                return gtpv2.v2message(2, message.sequence_number(), IEs=(gtpv2.IE(3, bytes(bytearray([len(handled)]))),))
+
+            async def respond_slowly(message, peer):
+                handled.append(message.sequence_number())
+                await asyncio.sleep(0.05)
+                return gtpv2.v2message(2, message.sequence_number())
+
+            def collect(message, peer):
+                received.append(bytes(message.encode()))
+
+            server = await create_endpoint(('127.0.0.1', 0), request_handler=respond)
+            slow_server = await create_endpoint(('127.0.0.1', 0), request_handler=respond_slowly)
+            client = await create_endpoint(('127.0.0.1', 0), request_handler=collect, cache_responses=False)
+
+            request = gtpv2.v2message(1, 5).encode()
+            for i in range(3):
+                client._transport.sendto(request, server._transport.get_extra_info('sockname'))
+            await asyncio.sleep(0.05)
+            self.assertEqual(handled, [5], "duplicate requests are not processed again")
+            self.assertEqual(len(received), 3, "every duplicate is answered")
+            self.assertEqual(len(set(received)), 1, "duplicates get the original response")
+
+            del handled[:]
+            del received[:]
+            for i in range(3):
+                slow_server_address = slow_server._transport.get_extra_info('sockname')
+                client._transport.sendto(request, slow_server_address)
+            await asyncio.sleep(0.1)
+            self.assertEqual((handled, len(received)), ([5], 1), "duplicates are dropped while the request is processed")
+            client._transport.sendto(request, slow_server_address)
+            await asyncio.sleep(0.05)
+            self.assertEqual((handled, len(received)), ([5], 2), "later duplicate is answered from the cache")
+
+            client.close()
+            server.close()
+            slow_server.close()
+
+        self.run_async(scenario())
+
+
+    def test_handler_without_response(self):
+        async def scenario():
+            handled = []
+            errors = []
+            asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context['exception']))
+
+            def no_response(message, peer):
+                handled.append('none')
+
+            def fail(message, peer):
+                handled.append('raise')
+                raise RuntimeError('handler failed')
+
+            async def no_response_later(message, peer):
+                handled.append('none later')
+
+            async def fail_later(message, peer):
+                handled.append('raise later')
+                raise RuntimeError('handler failed')
+
+            client = await create_endpoint(('127.0.0.1', 0), cache_responses=False)
+            request = gtpv2.v2message(1, 5).encode()
+
+            for handler in (no_response, fail, no_response_later, fail_later):
+                server = await create_endpoint(('127.0.0.1', 0), request_handler=handler)
+                for i in range(2):
+                    client._transport.sendto(request, server._transport.get_extra_info('sockname'))
+                    await asyncio.sleep(0.02)
+                self.assertEqual(len(server._response_cache), 0, "nothing left in the cache by {}".format(handler.__name__))
+                server.close()
+
+            self.assertEqual(handled, ['none', 'none', 'raise', 'raise', 'none later', 'none later', 'raise later', 'raise later'], "retransmissions are processed again")
+            self.assertEqual([str(e) for e in errors], ['handler failed'] * 4, "handler exceptions reach the loop exception handler")
+
+            client.close()
+
+        self.run_async(scenario())
+
+
+    def test_request_reusing_sequence_number(self):
+        async def scenario():
+            requests = []
+
+            def collect(message, peer):
+                requests.append((message.type(), message.sequence_number()))
+
+            client = await create_endpoint(('127.0.0.1', 0), request_handler=collect)
+            server = await create_endpoint(('127.0.0.1', 0), request_handler=collect)
+            client_address = client._transport.get_extra_info('sockname')
+
+            outstanding = client.send_request(gtpv1.v1message(16, 0, 5), server._transport.get_extra_info('sockname'))
+            await asyncio.sleep(0.02)
+
+            # the server's own Echo Request happens to reuse the sequence number
+            server._transport.sendto(gtpv1.v1message(1, 0, 5).encode(), client_address)
+            await asyncio.sleep(0.02)
+            self.assertEqual(requests, [(16, 5), (1, 5)], "peer request with the same sequence number reaches the handler")
+            self.assertFalse(outstanding.done(), "peer request does not complete the transaction")
+
+            server._transport.sendto(gtpv1.v1message(17, 0, 5).encode(), client_address)
+            self.assertEqual((await outstanding).type(), 17, "response completes the transaction")
+            self.assertEqual(response_types(2, 32), frozenset((33, 3)), "response_types()")
+
+            client.close()
+            server.close()
+
+        self.run_async(scenario())
+
+
+    def test_close_cancels_handlers(self):
+        async def scenario():
+            started = asyncio.Event()
+
+            async def never_respond(message, peer):
+                started.set()
+                await asyncio.sleep(60)
+
+            server = await create_endpoint(('127.0.0.1', 0), request_handler=never_respond)
+            client = await create_endpoint(('127.0.0.1', 0))
+            client._transport.sendto(gtpv2.v2message(32, 5, 0).encode(), server._transport.get_extra_info('sockname'))
+            await started.wait()
+
+            (task,) = server._tasks
+            self.assertEqual(len(server._response_cache), 1, "request reserved while the handler runs")
+            server.close()
+            client.close()
+            await asyncio.sleep(0.01)
+            self.assertTrue(task.cancelled(), "handler task cancelled on close")
+            self.assertEqual((len(server._tasks), len(server._response_cache)), (0, 0), "task and reservation released")
+
+        self.run_async(scenario())
+
+
+    def test_retransmission(self):
+        async def scenario():
+            seen = []
+
+            async def answer_third(message, peer):
+                seen.append(message.sequence_number())
+                if len(seen) == 3:
+                    return gtpv1.v1message(2, 0, message.sequence_number())
+
+            # without a response cache, so the server sees each retransmission
+            server = await create_endpoint(('127.0.0.1', 0), request_handler=answer_third, cache_responses=False)
+            client = await create_endpoint(('127.0.0.1', 0), t3_response=0.02, n3_requests=3)
+            peer = server._transport.get_extra_info('sockname')
+
+            response = await client.send_request(gtpv1.v1message(1, 0, 7), peer)
+            self.assertEqual((response.type(), response.sequence_number()), (2, 7), "response after two retransmissions")
+            self.assertEqual(seen, [7, 7, 7], "request was retransmitted twice")
+
+            with self.assertRaises(asyncio.TimeoutError) as context:
+                await client.send_request(gtpv1.v1message(1, 0, 8), ('127.0.0.1', 9))
+
+            outstanding = client.send_request(gtpv2.v2message(1, 9), ('127.0.0.1', 9))
+            with self.assertRaises(ValueError) as context:
+                client.send_request(gtpv2.v2message(1, 9), ('127.0.0.1', 9))
+            other_version = client.send_request(gtpv1.v1message(1, 0, 9), ('127.0.0.1', 9))
+            self.assertEqual(client.outstanding_requests(), 2, "same sequence number in another GTP version is a separate transaction")
+            with self.assertRaises(ValueError) as context:
+                client.send_request(gtpv1.v1message(1, 0, None), ('127.0.0.1', 9))
+
+            client.close()
+            server.close()
+
+            for future in (outstanding, other_version):
+                with self.assertRaises(ConnectionError) as context:
+                    await future
+
+        self.run_async(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
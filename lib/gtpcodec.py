@@ -0,0 +1,178 @@
+import unittest
+import collections.abc
+import importlib
+import struct
+
+# Codec machinery shared by gtpv1 and gtpv2: the integer packers, the basic IE value codecs, the builder
+# for the flat per-type dispatch tables, and LazyTable, through which each version exposes the
+# human-readable name tables of its spec module (gtpv1spec, gtpv2spec) without loading them at import.
+
+try:
+    integer_types = (int, long)
+except NameError:
+    integer_types = (int,)
+
+
+u8_packer = struct.Struct('B')
+u16_packer = struct.Struct('!H')
+u32_packer = struct.Struct('!I')
+
+def encode_u8(v): return u8_packer.pack(v)
+def encode_u16(v): return u16_packer.pack(v)
+def encode_u32(v): return u32_packer.pack(v)
+def encode_string(v): return bytes(v)
+def encode_octetstring(v): return v
+
+
+def decode_u8(v): return u8_packer.unpack(v)[0]
+def decode_u16(v): return u16_packer.unpack(v)[0]
+def decode_u32(v): return u32_packer.unpack(v)[0]
+def decode_string(v): return bytes(v).decode("ascii")
+def decode_octetstring(v): return bytes(v)
+
+# Codecs for the IE value types common to both versions.  Each version copies these and adds its own.
+ie_decoders = {
+    "u8":           decode_u8,
+    "u16":          decode_u16,
+    "u32":          decode_u32,
+    "string":       decode_string,
+    "octetstring":  decode_octetstring,
+}
+
+
+ie_encoders = {
+    "u8":           encode_u8,
+    "u16":          encode_u16,
+    "u32":          encode_u32,
+    "string":       encode_string,
+    "octetstring":  encode_octetstring,
+}
+
+
+ie_codec_structs = {
+    "u8":           u8_packer,
+    "u16":          u16_packer,
+    "u32":          u32_packer,
+}
+
+
+# Marks an IE whose value has not been decoded yet
+undecoded = object()
+
+
+def compile_ie_tables(ie_types, encoders, decoders, structs, shared_types, encoder_table, decoder_table, struct_table, shared_table):
+    """Fill the flat per-type dispatch tables (each a 256-slot list, indexed by IE type) from 'ie_types',
+       a dict of IE type to codec name, and the codec dicts: the encoder and decoder for the type, the
+       struct.Struct for fixed-size integer types (otherwise None), and whether the type is in
+       'shared_types'"""
+    for type in range(256):
+        codec = ie_types.get(type)
+        encoder_table[type] = encoders[codec] if codec is not None else None
+        decoder_table[type] = decoders[codec] if codec is not None else None
+        struct_table[type] = structs.get(codec)
+        shared_table[type] = type in shared_types
+
+
+def first_IE(ies):
+    """The first IE from an iterator of IEs (e.g., iter_IEs()), or None if it yields nothing"""
+    for ie in ies:
+        return ie
+
+    return None
+
+
+class LazyTable(collections.abc.Mapping):
+    """A read-only dict loaded on first use from the attribute 'name' of 'module', which is imported
+       only then.  With reverse=True the table maps each value back to the first key having it (e.g.,
+       type to name, for logging)."""
+
+    __slots__ = ('_module', '_name', '_reverse', '_table')
+
+    def __init__(self, module, name, reverse=False):
+        self._module = module
+        self._name = name
+        self._reverse = reverse
+        self._table = None
+
+
+    def _load(self):
+        table = getattr(importlib.import_module(self._module), self._name)
+        if self._reverse:
+            reversed_table = {}
+            for (key, value) in table.items():
+                reversed_table.setdefault(value, key)
+            table = reversed_table
+        self._table = table
+        return table
+
+
+    def loaded(self):
+        """True once the table has been loaded"""
+        return self._table is not None
+
+
+    def _loaded_table(self):
+        # an empty table is falsy, so test for None rather than 'self._table or self._load()'
+        table = self._table
+        return table if table is not None else self._load()
+
+
+    def __getitem__(self, key):
+        return self._loaded_table()[key]
+
+
+    def __contains__(self, key):
+        return key in self._loaded_table()
+
+
+    def get(self, key, default=None):
+        return self._loaded_table().get(key, default)
+
+
+    def __iter__(self):
+        return iter(self._loaded_table())
+
+
+    def __len__(self):
+        return len(self._loaded_table())
+
+
+    def __repr__(self):
+        return 'LazyTable({!r}, {!r}{})'.format(self._module, self._name, ', reverse=True' if self._reverse else '')
+
+
+
+class Test_gtpcodec(unittest.TestCase):
+    def test_lazy_table(self):
+        names = LazyTable('gtpv1spec', 'message_name_to_type')
+        types = LazyTable('gtpv1spec', 'message_name_to_type', reverse=True)
+        self.assertFalse(names.loaded(), "table not loaded before first use")
+        self.assertEqual(names['Echo Request'], 1, "lookup by name")
+        self.assertTrue(names.loaded(), "table loaded on first use")
+        self.assertIn('G-PDU', names, "membership")
+        self.assertEqual(types[255], 'G-PDU', "reverse lookup")
+        self.assertIsNone(types.get(0), "reverse get() of undefined type")
+        self.assertEqual(len(types), len(names), "reverse table length")
+        class CountingTable(LazyTable):
+            loads = 0
+            def _load(self):
+                self.loads += 1
+                return LazyTable._load(self)
+
+        empty = CountingTable('gtpv1spec', 'message_name_to_type', reverse=True)
+        empty._load()
+        empty._table = {}
+        self.assertEqual((len(empty), empty.get(1), 1 in empty, empty.loads), (0, None, False, 1), "empty table is not loaded again")
+        self.assertEqual(LazyTable('gtpv2spec', 'ie_name_to_type', reverse=True)[1], 'International Mobile Subscriber Identity (IMSI)', "first name kept for aliased type")
+
+
+    def test_compile_ie_tables(self):
+        tables = ([None] * 256, [None] * 256, [None] * 256, [False] * 256)
+        compile_ie_tables({1: "u8", 2: "octetstring"}, ie_encoders, ie_decoders, ie_codec_structs, frozenset((2,)), *tables)
+        self.assertEqual((tables[0][1], tables[1][2], tables[2][1], tables[2][2]), (encode_u8, decode_octetstring, u8_packer, None), "codec tables")
+        self.assertEqual((tables[3][1], tables[3][2], tables[0][3]), (False, True, None), "shared and undefined types")
+        self.assertIsNone(first_IE(iter(())), "first_IE() of nothing")
+
+
+if __name__ == "__main__":
+    unittest.main()
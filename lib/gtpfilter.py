@@ -0,0 +1,271 @@
+import unittest
+
+import gtpv1
+import gtpv2
+import tbcd
+from gtpcodec import u16_packer, u32_packer
+
+# IE types for the named predicates, by GTP version
+imsi_ie_types = {1: 2, 2: 1}
+apn_ie_types = {1: 131, 2: 71}
+cause_ie_types = {1: 1, 2: 2}
+
+
+def encode_apn(name):
+    """Encode a dotted APN, such as 'internet.mnc001.mcc001.gprs', as the length-prefixed labels carried
+       in the APN IE"""
+    encoded = bytearray()
+    for label in name.split('.'):
+        encoded.append(len(label))
+        encoded += label.encode('ascii')
+    return bytes(encoded)
+
+
+class MessageFilter(object):
+    """A predicate over encoded GTPv1 and GTPv2 messages, compiled into checks on raw header and IE bytes so
+       that messages can be rejected without decoding them.  Every condition given must hold:
+
+         version        -- 1 or 2
+         types          -- iterable of message types
+         teid           -- header TEID
+         sequence_range -- (first, last) sequence numbers, inclusive
+         ies            -- dict of IE type to None (the IE must be present) or bytes (the encoded value of
+                           some IE of that type must equal it); applies to every version the filter admits
+         imsi           -- IMSI, either as digits or already TBCD-encoded
+         apn            -- APN, either dotted or already encoded
+         cause          -- cause value
+
+       The IE conditions are checked by walking the IE headers in place, as decode_next_IE() does, and stop
+       as soon as every condition has been met.  Only top-level IEs are examined."""
+
+    __slots__ = ('_versions', '_types', '_teid', '_first', '_last', '_conditions')
+
+    def __init__(self, version=None, types=None, teid=None, sequence_range=None, ies=None, imsi=None, apn=None, cause=None):
+        self._versions = (1, 2) if version is None else (version,)
+
+        for v in self._versions:
+            if v not in (1, 2):
+                raise ValueError('GTP version ({}) must be 1 or 2'.format(str(v)))
+
+        if types is None:
+            self._types = None
+        else:
+            self._types = bytearray(256)
+            for type in types:
+                self._types[type] = 1
+
+        self._teid = teid
+        (self._first, self._last) = sequence_range if sequence_range is not None else (None, None)
+
+        if isinstance(apn, str):
+            apn = encode_apn(apn)
+        if imsi is not None:
+            imsi = tbcd.encode_tbcd(imsi)
+
+        # per version, a 256-slot table of IE type to list of (condition bit, value, prefix only)
+        self._conditions = [None, None, None]
+        for v in self._versions:
+            conditions = []
+            for (type, value) in (ies or {}).items():
+                conditions.append((type, None if value is None else bytes(value), False))
+            if imsi is not None:
+                conditions.append((imsi_ie_types[v], bytes(imsi), False))
+            if apn is not None:
+                conditions.append((apn_ie_types[v], apn, False))
+            if cause is not None:
+                # the GTPv2 Cause IE carries flags and an offending IE after the cause value
+                conditions.append((cause_ie_types[v], bytes((cause,)), v == 2))
+
+            if conditions:
+                table = [None] * 256
+                for (bit, (type, value, prefix)) in enumerate(conditions):
+                    if table[type] is None:
+                        table[type] = []
+                    table[type].append((1 << bit, value, prefix))
+                self._conditions[v] = (table, (1 << len(conditions)) - 1)
+
+
+    def __call__(self, buffer, offset=0):
+        return self.match(buffer, offset)
+
+
+    def match(self, buffer, offset=0):
+        """Return True if the message encoded at 'offset' in 'buffer' (bytes, bytearray or memoryview)
+           satisfies the filter.  Malformed messages never match."""
+        available = len(buffer) - offset
+
+        if available < 8:
+            return False
+
+        flags = buffer[offset]
+        version = flags >> 5
+
+        if version not in self._versions:
+            return False
+
+        if self._types is not None and not self._types[buffer[offset + 1]]:
+            return False
+
+        end = offset + 4 + u16_packer.unpack_from(buffer, offset + 2)[0]
+
+        if version == 2:
+            if end > offset + available:
+                return False
+            if flags & 0x08:
+                if available < 12:
+                    return False
+                teid = u32_packer.unpack_from(buffer, offset + 4)[0]
+                sequence_number = u32_packer.unpack_from(buffer, offset + 8)[0] >> 8
+                ie_offset = offset + 12
+            else:
+                if self._teid is not None:
+                    return False
+                teid = None
+                sequence_number = u32_packer.unpack_from(buffer, offset + 4)[0] >> 8
+                ie_offset = offset + 8
+        else:
+            end += 4
+            if end > offset + available:
+                return False
+            teid = u32_packer.unpack_from(buffer, offset + 4)[0]
+            ie_offset = offset + 8
+            sequence_number = None
+            if flags & 0x07:
+                if end - ie_offset < 4:
+                    return False
+                if flags & 0x02:
+                    sequence_number = u16_packer.unpack_from(buffer, ie_offset)[0]
+                next_type = buffer[ie_offset + 3] if flags & 0x04 else 0
+                try:
+                    ie_offset = gtpv1.skip_extension_headers(buffer, ie_offset + 4, next_type, end)
+                except ValueError:
+                    return False
+
+        if self._teid is not None and teid != self._teid:
+            return False
+
+        if self._first is not None and (sequence_number is None or sequence_number < self._first or sequence_number > self._last):
+            return False
+
+        conditions = self._conditions[version]
+
+        if conditions is None:
+            return True
+
+        if version == 2:
+            return self._match_v2_IEs(buffer, ie_offset, end, conditions[0], conditions[1])
+        return self._match_v1_IEs(buffer, ie_offset, end, conditions[0], conditions[1])
+
+
+    def _match_v2_IEs(self, buffer, offset, end, table, required):
+        met = 0
+        header = gtpv2.ie_header_struct.unpack_from
+
+        while offset + 4 <= end:
+            (type, length, instance) = header(buffer, offset)
+            value_offset = offset + 4
+            offset = value_offset + length
+            if offset > end:
+                return False
+            checks = table[type]
+            if checks is not None:
+                met |= self._check(buffer, value_offset, offset, checks)
+                if met == required:
+                    return True
+
+        return False
+
+
+    def _match_v1_IEs(self, buffer, offset, end, table, required):
+        met = 0
+        lengths = gtpv1.ie_length_table
+
+        while offset < end:
+            type = buffer[offset]
+            length = lengths[type]
+            if length < 0:
+                # an undefined TV type cannot be stepped over; gtpv1.iter_IEs() rejects it too
+                if type < 128 or offset + 3 > end:
+                    return False
+                length = u16_packer.unpack_from(buffer, offset + 1)[0]
+                value_offset = offset + 3
+            else:
+                value_offset = offset + 1
+            offset = value_offset + length
+            if offset > end:
+                return False
+            checks = table[type]
+            if checks is not None:
+                met |= self._check(buffer, value_offset, offset, checks)
+                if met == required:
+                    return True
+
+        return False
+
+
+    def _check(self, buffer, start, end, checks):
+        met = 0
+        for (bit, value, prefix) in checks:
+            if value is None:
+                met |= bit
+            elif prefix:
+                if end - start >= len(value) and buffer[start:start + len(value)] == value:
+                    met |= bit
+            elif end - start == len(value) and buffer[start:end] == value:
+                met |= bit
+        return met
+
+
+
+class Test_MessageFilter(unittest.TestCase):
+    def setUp(self):
+        self.imsi = b'\x21\x43\x65\x87\x09\x21\x43\xf5'
+        self.v2_request = gtpv2.v2message(32, 0x1234, 0, (gtpv2.IE(1, self.imsi), gtpv2.IE(71, encode_apn('internet.example'))))
+        self.v2_response = gtpv2.v2message(33, 0x1234, 0x100, (gtpv2.IE(2, b'\x10\x00'),))
+        self.v1_request = gtpv1.v1message(16, 0, 7, IEs=(gtpv1.ie(2, self.imsi), gtpv1.ie(14, 3), gtpv1.ie(131, encode_apn('internet.example'))))
+
+
+    def test_header_conditions(self):
+        encoded = self.v2_request.encode()
+        self.assertTrue(MessageFilter().match(encoded), "empty filter matches everything")
+        self.assertTrue(MessageFilter(types=(32, 36)).match(encoded), "message type in set")
+        self.assertFalse(MessageFilter(types=(36,)).match(encoded), "message type not in set")
+        self.assertFalse(MessageFilter(version=1).match(encoded), "version")
+        self.assertTrue(MessageFilter(teid=0).match(encoded), "TEID")
+        self.assertFalse(MessageFilter(teid=0x100).match(encoded), "TEID differs")
+        self.assertFalse(MessageFilter(teid=0).match(gtpv2.v2message(1, 1).encode()), "TEID filter rejects message without TEID")
+        self.assertTrue(MessageFilter(sequence_range=(0x1000, 0x2000)).match(encoded), "sequence number in range")
+        self.assertFalse(MessageFilter(sequence_range=(0, 0x1000)).match(encoded), "sequence number out of range")
+        self.assertTrue(MessageFilter(version=1, sequence_range=(7, 7), teid=0).match(self.v1_request.encode()), "GTPv1 header conditions")
+        self.assertFalse(MessageFilter().match(encoded[:-1]), "truncated message never matches")
+
+        padded = bytearray(b'\x00\x00') + encoded
+        self.assertTrue(MessageFilter(types=(32,)).match(memoryview(padded), 2), "match() at offset")
+
+
+    def test_ie_conditions(self):
+        for message in (self.v2_request, self.v1_request):
+            encoded = message.encode()
+            self.assertTrue(MessageFilter(imsi=self.imsi).match(encoded), "IMSI")
+            self.assertTrue(MessageFilter(imsi='123456789012345').match(encoded), "IMSI as digits")
+            self.assertFalse(MessageFilter(imsi=self.imsi[:-1] + b'\xf6').match(encoded), "other IMSI")
+            self.assertTrue(MessageFilter(imsi=self.imsi, apn='internet.example').match(encoded), "IMSI and APN")
+            self.assertFalse(MessageFilter(imsi=self.imsi, apn='ims').match(encoded), "IMSI and other APN")
+
+        self.assertTrue(MessageFilter(cause=16).match(self.v2_response.encode()), "GTPv2 cause compares first octet")
+        self.assertFalse(MessageFilter(cause=64).match(self.v2_response.encode()), "GTPv2 other cause")
+        self.assertFalse(MessageFilter(cause=16).match(self.v2_request.encode()), "cause absent")
+        self.assertTrue(MessageFilter(version=1, ies={14: None}).match(self.v1_request.encode()), "GTPv1 TV IE presence")
+        self.assertTrue(MessageFilter(version=2, ies={71: None, 1: self.imsi}).match(self.v2_request.encode()), "raw IE conditions")
+
+        # an undefined TV type (0) ahead of the IMSI
+        encoded = bytearray(gtpv1.v1message(16, 0, 7, IEs=(gtpv1.ie(2, self.imsi),)).encode())
+        encoded[12:12] = b'\x00\x00\x00'
+        encoded[3] += 3
+        with self.assertRaises(ValueError) as context:
+            list(gtpv1.iter_IEs(encoded, 12))
+        self.assertFalse(MessageFilter(imsi=self.imsi).match(encoded), "undefined GTPv1 TV type never matches")
+
+
+if __name__ == "__main__":
+    unittest.main()
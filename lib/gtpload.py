@@ -0,0 +1,461 @@
+import unittest
+import array
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import select
+import socket
+import struct
+import time
+
+import gtpv2
+import gtppcap
+import tbcd
+
+CREATE_SESSION_REQUEST = gtpv2.message_name_to_type['Create Session Request']
+CREATE_SESSION_RESPONSE = gtpv2.message_name_to_type['Create Session Response']
+MODIFY_BEARER_REQUEST = gtpv2.message_name_to_type['Modify Bearer Request']
+MODIFY_BEARER_RESPONSE = gtpv2.message_name_to_type['Modify Bearer Response']
+DELETE_SESSION_REQUEST = gtpv2.message_name_to_type['Delete Session Request']
+DELETE_SESSION_RESPONSE = gtpv2.message_name_to_type['Delete Session Response']
+
+GTPC_PORT = 2123
+
+# F-TEID interface types for the S11 MME and SGW GTP-C endpoints and the S1-U eNodeB
+S11_MME_GTPC = 10
+S11_SGW_GTPC = 11
+S1U_ENODEB_GTPU = 0
+
+# flags, message type, length, TEID, sequence number and spare
+header_with_teid_struct = struct.Struct('! B B H I I')
+
+# Cause "Request accepted"
+cause_accepted = gtpv2.IE(2, b'\x10\x00')
+
+# The requests sent for each simulated UE, in order; a UE starts over at the first once its last request
+# has been answered
+scenario = (CREATE_SESSION_REQUEST, MODIFY_BEARER_REQUEST, DELETE_SESSION_REQUEST)
+
+
+# 'peer' is the (address, port) of the node under test, or 'loopback' to start LoopbackResponder processes
+# on 'loopback_port'; 'pcap' is a path to write the traffic to instead of sending it.  'rate' is the
+# total request rate per second across all 'workers'.  UEs have consecutive IMSIs from 'imsi_first' and
+# consecutive MME control plane TEIDs from 'teid_first', and are divided between the workers.
+LoadSettings = collections.namedtuple('LoadSettings', ('peer', 'pcap', 'rate', 'duration', 'ues', 'imsi_first', 'teid_first',
+                                                       'workers', 'local_address', 'timeout', 'loopback_port'))
+
+
+def reuse_port_socket(address):
+    """A UDP socket bound to 'address' with SO_REUSEPORT set (where the platform has it), so that several
+       processes can bind the same port and the kernel spreads incoming flows between them"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    return sock
+
+
+class LoopbackResponder(object):
+    """Plays the SGW side of the load scenario: accepts every Create Session, Modify Bearer and Delete
+       Session Request, allocating an SGW control plane TEID per session.  Responses are stamped from
+       templates; the buffer returned by respond() is reused by the next call."""
+
+    __slots__ = ('_templates', '_sessions', '_next_teid', '_fteid_address')
+
+    def __init__(self, address='127.0.0.1', teid_first=0x80000000):
+        self._fteid_address = socket.inet_aton(address)
+        self._next_teid = teid_first
+        self._sessions = {}
+
+        self._templates = [None] * 256
+        self._templates[CREATE_SESSION_REQUEST] = gtpv2.v2template(gtpv2.v2message(CREATE_SESSION_RESPONSE, 0, 0, (
+            cause_accepted,
+            gtpv2.IE(87, gtpv2.FTEID.create(S11_SGW_GTPC, 0, address)),
+            gtpv2.IE(79, gtpv2.PAA.create('10.45.0.1')),
+            gtpv2.IE(93, (gtpv2.IE(73, b'\x05'), cause_accepted)),
+        )), fields=((87, 0),))
+        self._templates[MODIFY_BEARER_REQUEST] = gtpv2.v2template(gtpv2.v2message(MODIFY_BEARER_RESPONSE, 0, 0, (cause_accepted,)))
+        self._templates[DELETE_SESSION_REQUEST] = gtpv2.v2template(gtpv2.v2message(DELETE_SESSION_RESPONSE, 0, 0, (cause_accepted,)))
+
+
+    def respond(self, request):
+        """Return the encoded response to the encoded 'request', or None if it is not a request of the
+           scenario or belongs to an unknown session"""
+        if len(request) < 12 or request[0] & 0xe8 != 0x48:
+            return None
+
+        template = self._templates[request[1]]
+
+        if template is None:
+            return None
+
+        (flags, type, length, teid, sequence_number) = header_with_teid_struct.unpack_from(request, 0)
+        sequence_number >>= 8
+
+        if type == CREATE_SESSION_REQUEST:
+            fteid = gtpv2.v2message.decode(request).get_IE(87)
+            if fteid is None:
+                return None
+            mme_teid = fteid.decoded_value().teid()
+            sgw_teid = self._next_teid
+            self._next_teid = (self._next_teid + 1) & 0xffffffff
+            self._sessions[sgw_teid] = mme_teid
+            return template.stamp(sequence_number, mme_teid, gtpv2.fteid_header_struct.pack(0x80 | S11_SGW_GTPC, sgw_teid) + self._fteid_address)
+
+        if type == DELETE_SESSION_REQUEST:
+            mme_teid = self._sessions.pop(teid, None)
+        else:
+            mme_teid = self._sessions.get(teid)
+
+        if mme_teid is None:
+            return None
+
+        return template.stamp(sequence_number, mme_teid)
+
+
+def serve_loopback(address):
+    """Answer requests arriving at 'address' with a LoopbackResponder until the process is terminated.
+       Several processes may serve the same address."""
+    sock = reuse_port_socket(address)
+    responder = LoopbackResponder(address[0])
+    buffer = bytearray(65536)
+    view = memoryview(buffer)
+
+    while True:
+        (length, peer) = sock.recvfrom_into(buffer)
+        response = responder.respond(view[:length])
+        if response is not None:
+            sock.sendto(response, peer)
+
+
+class LoadWorker(object):
+    """Drives the scenario for UEs [first_ue, first_ue + ues) at 'rate' requests per second"""
+
+    def __init__(self, settings, index):
+        self._settings = settings
+        self._rate = float(settings.rate) / settings.workers
+
+        per_worker = settings.ues // settings.workers
+        self._first_ue = index * per_worker
+        self._ues = per_worker if index < settings.workers - 1 else settings.ues - self._first_ue
+
+        self._imsi_first = int(settings.imsi_first)
+
+        # the Create Session template patches an IMSI field of 15 digits
+        last_imsi = str(self._imsi_first + self._first_ue + self._ues - 1)
+        if len(last_imsi) > 15:
+            raise ValueError('IMSI ({}) is longer than 15 digits'.format(last_imsi))
+
+        self._active = bytearray(self._ues)
+        self._next_ue = 0
+        self._ready = collections.deque()
+        self._pending = {}
+        self._sequence_number = 0
+
+        self.sent = 0
+        self.received = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.latencies = array.array('d')
+
+        self._fteid_address = socket.inet_aton(settings.local_address if settings.local_address != '0.0.0.0' else '127.0.0.1')
+        mme_fteid = gtpv2.IE(87, gtpv2.FTEID.create(S11_MME_GTPC, 0, self._fteid_address))
+        bearer_qos = gtpv2.IE(80, gtpv2.BearerQoS(0, 9, 0, 9, 0, 0, 0, 0))
+
+        self._templates = [None] * 256
+        self._templates[CREATE_SESSION_REQUEST] = gtpv2.v2template(gtpv2.v2message(CREATE_SESSION_REQUEST, 0, 0, (
+            gtpv2.IE(1, '0' * 15),
+            gtpv2.IE(82, b'\x06'),
+            mme_fteid,
+            gtpv2.IE(71, b'\x08internet'),
+            gtpv2.IE(93, (gtpv2.IE(73, b'\x05'), bearer_qos)),
+        )), fields=(1, (87, 0)))
+        self._templates[MODIFY_BEARER_REQUEST] = gtpv2.v2template(gtpv2.v2message(MODIFY_BEARER_REQUEST, 0, 0, (
+            gtpv2.IE(93, (gtpv2.IE(73, b'\x05'), gtpv2.IE(87, gtpv2.FTEID.create(S1U_ENODEB_GTPU, 1, '10.1.0.1')))),
+        )))
+        self._templates[DELETE_SESSION_REQUEST] = gtpv2.v2template(gtpv2.v2message(DELETE_SESSION_REQUEST, 0, 0, (gtpv2.IE(73, b'\x05'),)))
+
+
+    def _next_request(self, now):
+        """Stamp the next request, from a UE whose previous request was answered or else from a new UE,
+           and record it as pending.  Return the encoded request, or None if every UE is busy."""
+        if self._ready:
+            (ue, step, sgw_teid) = self._ready.popleft()
+        else:
+            for i in range(self._ues):
+                ue = self._next_ue
+                self._next_ue = (self._next_ue + 1) % self._ues
+                if not self._active[ue]:
+                    break
+            else:
+                return None
+            self._active[ue] = 1
+            (step, sgw_teid) = (0, 0)
+
+        self._sequence_number = (self._sequence_number + 1) & 0xffffff
+        type = scenario[step]
+        template = self._templates[type]
+        self._pending[self._sequence_number] = (ue, step, sgw_teid, now)
+
+        if type == CREATE_SESSION_REQUEST:
+            imsi = str(self._imsi_first + self._first_ue + ue).zfill(15)
+            teid = (self._settings.teid_first + self._first_ue + ue) & 0xffffffff
+            return template.stamp(self._sequence_number, 0, tbcd.encode_tbcd(imsi), gtpv2.fteid_header_struct.pack(0x80 | S11_MME_GTPC, teid) + self._fteid_address)
+
+        return template.stamp(self._sequence_number, sgw_teid)
+
+
+    def _handle_response(self, response, now):
+        if len(response) < 12:
+            return
+        sequence_number = header_with_teid_struct.unpack_from(response, 0)[4] >> 8
+        pending = self._pending.pop(sequence_number, None)
+        if pending is None:
+            return
+
+        (ue, step, sgw_teid, sent) = pending
+        self.received += 1
+        self.latencies.append(now - sent)
+
+        if response[1] == CREATE_SESSION_RESPONSE:
+            fteid = gtpv2.v2message.decode(response).get_IE(87)
+            if fteid is None:
+                self._active[ue] = 0
+                return
+            sgw_teid = fteid.decoded_value().teid()
+
+        if step + 1 < len(scenario):
+            self._ready.append((ue, step + 1, sgw_teid))
+        else:
+            self._active[ue] = 0
+            self.completed += 1
+
+
+    def _expire(self, now):
+        # pending requests are kept in the order they were sent, so only the oldest need checking
+        deadline = now - self._settings.timeout
+        pending = self._pending
+        while pending:
+            sequence_number = next(iter(pending))
+            (ue, step, sgw_teid, sent) = pending[sequence_number]
+            if sent > deadline:
+                break
+            del pending[sequence_number]
+            self._active[ue] = 0
+            self.timeouts += 1
+
+
+    def run_network(self, peer):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self._settings.local_address, 0))
+        sock.setblocking(False)
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
+        interval = 1.0 / self._rate
+
+        start = time.perf_counter()
+        stop = start + self._settings.duration
+        next_send = start
+        next_expiry = start + 0.1
+
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= stop:
+                    break
+
+                # never build up more than a short burst after a stall
+                if next_send < now - 0.01:
+                    next_send = now - 0.01
+
+                while next_send <= now:
+                    request = self._next_request(now)
+                    if request is None:
+                        next_send = now + interval
+                        break
+                    sock.sendto(request, peer)
+                    self.sent += 1
+                    next_send += interval
+
+                while True:
+                    try:
+                        (length, address) = sock.recvfrom_into(buffer)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    self._handle_response(view[:length], time.perf_counter())
+
+                if now >= next_expiry:
+                    self._expire(now)
+                    next_expiry = now + 0.1
+
+                wait = next_send - time.perf_counter()
+                if wait > 0:
+                    select.select((sock,), (), (), min(wait, stop - now))
+
+            return time.perf_counter() - start
+        finally:
+            sock.close()
+
+
+    def run_pcap(self, path):
+        """Write the scenario to 'path' as if run against a LoopbackResponder, with timestamps spaced at
+           the configured rate, as fast as the file can be written"""
+        responder = LoopbackResponder('10.0.0.2')
+        mme = ('10.0.0.1', GTPC_PORT)
+        self._fteid_address = socket.inet_aton(mme[0])
+        sgw = ('10.0.0.2', GTPC_PORT)
+        interval = 1.0 / self._rate
+        count = int(self._rate * self._settings.duration)
+        timestamp = time.time()
+
+        start = time.perf_counter()
+        with gtppcap.CaptureWriter(path) as writer:
+            for i in range(count):
+                request = self._next_request(timestamp)
+                if request is None:
+                    break
+                writer.write(request, mme, sgw, timestamp)
+                self.sent += 1
+                response = responder.respond(request)
+                if response is not None:
+                    writer.write(response, sgw, mme, timestamp + interval / 2)
+                    self._handle_response(response, timestamp + interval / 2)
+                timestamp += interval
+
+        return time.perf_counter() - start
+
+
+def run_worker(settings, index):
+    """Run one LoadWorker and return its counters and latencies"""
+    worker = LoadWorker(settings, index)
+
+    if settings.pcap is not None:
+        path = settings.pcap if settings.workers == 1 else '{}.{}'.format(settings.pcap, index)
+        elapsed = worker.run_pcap(path)
+    else:
+        peer = ('127.0.0.1', settings.loopback_port) if settings.peer == 'loopback' else settings.peer
+        elapsed = worker.run_network(peer)
+
+    return {'sent': worker.sent, 'received': worker.received, 'completed': worker.completed,
+            'timeouts': worker.timeouts, 'elapsed': elapsed, 'latencies': worker.latencies}
+
+
+def percentiles(values, points=(50, 90, 99, 99.9)):
+    """Return {point: value} for the given percentiles of 'values', or an empty dict if there are none"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return dict((point, ordered[min(len(ordered) - 1, int(len(ordered) * point / 100.0))]) for point in points)
+
+
+def run(peer=None, pcap=None, rate=10000, duration=10.0, ues=100000, imsi_first='001010000000001', teid_first=0x10000000,
+        workers=None, local_address='0.0.0.0', timeout=3.0, loopback_port=GTPC_PORT):
+    """Generate Create Session / Modify Bearer / Delete Session load against 'peer', a loopback
+       responder ('loopback') or into a pcap file ('pcap'), across 'workers' processes (one per CPU by
+       default).  Each worker sends from its own port so that responses find their way back to it.
+       Return a report of requests sent, responses received, completed sessions, timeouts, the achieved
+       request rate and latency percentiles (in seconds)."""
+    if (peer is None) == (pcap is None):
+        raise ValueError('Exactly one of peer and pcap must be given')
+
+    settings = LoadSettings(peer, pcap, rate, duration, ues, imsi_first, teid_first, workers or os.cpu_count() or 1,
+                            local_address, timeout, loopback_port)
+
+    if settings.ues < settings.workers:
+        raise ValueError('Number of UEs ({}) is less than the number of workers ({})'.format(str(settings.ues), str(settings.workers)))
+
+    if len(str(int(imsi_first) + ues - 1)) > 15:
+        raise ValueError('Last IMSI ({}) is longer than 15 digits'.format(str(int(imsi_first) + ues - 1)))
+
+    responders = []
+    if peer == 'loopback':
+        for i in range(settings.workers):
+            responder = multiprocessing.Process(target=serve_loopback, args=(('127.0.0.1', loopback_port),), daemon=True)
+            responder.start()
+            responders.append(responder)
+        # let the responders bind before the first request goes out
+        time.sleep(0.2)
+
+    try:
+        if settings.workers == 1:
+            results = [run_worker(settings, 0)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(settings.workers) as pool:
+                results = list(pool.map(run_worker, [settings] * settings.workers, range(settings.workers)))
+    finally:
+        for responder in responders:
+            responder.terminate()
+            responder.join()
+
+    latencies = array.array('d')
+    for result in results:
+        latencies.extend(result['latencies'])
+
+    report = dict((key, sum(result[key] for result in results)) for key in ('sent', 'received', 'completed', 'timeouts'))
+    report['elapsed'] = max(result['elapsed'] for result in results)
+    report['rate'] = report['sent'] / report['elapsed'] if report['elapsed'] else 0.0
+    report['latency'] = percentiles(latencies)
+    return report
+
+
+
+class Test_LoopbackResponder(unittest.TestCase):
+    def test_respond(self):
+        responder = LoopbackResponder('10.0.0.2', teid_first=0x500)
+        worker = LoadWorker(LoadSettings(None, None, 100, 1.0, 2, '001010000000001', 0x100, 1, '10.0.0.1', 1.0, GTPC_PORT), 0)
+
+        request = bytes(worker._next_request(0.0))
+        self.assertEqual(gtpv2.v2message.decode(request).get_IE(1).decoded_value(), '001010000000001', "first UE IMSI")
+        response = gtpv2.v2message.decode(responder.respond(request))
+        self.assertEqual((response.type(), response.teid()), (CREATE_SESSION_RESPONSE, 0x100), "Create Session Response to MME TEID")
+        self.assertEqual(response.get_IE(87).decoded_value().teid(), 0x500, "SGW TEID allocated")
+
+        worker._handle_response(response.encode(), 0.25)
+        request = gtpv2.v2message.decode(bytes(worker._next_request(0.5)))
+        self.assertEqual((request.type(), request.teid()), (MODIFY_BEARER_REQUEST, 0x500), "Modify Bearer Request to SGW TEID")
+        self.assertEqual(gtpv2.v2message.decode(responder.respond(request.encode())).type(), MODIFY_BEARER_RESPONSE, "Modify Bearer Response")
+        self.assertIsNone(responder.respond(gtpv2.v2message(MODIFY_BEARER_REQUEST, 1, 0x999).encode()), "unknown session is not answered")
+        self.assertEqual(list(worker.latencies), [0.25], "latency recorded")
+
+
+class Test_run(unittest.TestCase):
+    def test_pcap(self):
+        import tempfile
+        import shutil
+        import gtpanalysis
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = directory + '/load.pcap'
+            report = run(pcap=path, rate=1000, duration=0.03, ues=5, workers=1)
+            self.assertEqual((report['sent'], report['received'], report['completed']), (30, 30, 10), "every request answered, sessions completed")
+
+            sessions = gtpanalysis.analyze(path, workers=1)['sessions']
+            self.assertEqual(len(sessions), 5, "one session per UE")
+            self.assertEqual([type for (t, type) in sessions['001010000000001']][:6], [32, 33, 34, 35, 36, 37], "scenario sequence in capture")
+        finally:
+            shutil.rmtree(directory)
+
+
+    def test_imsi_length(self):
+        with self.assertRaises(ValueError) as context:
+            run(pcap='unused.pcap', ues=2, imsi_first='999999999999999', workers=1)
+
+        with self.assertRaises(ValueError) as context:
+            LoadWorker(LoadSettings(None, 'unused.pcap', 1, 1, 2, '999999999999999', 1, 1, '0.0.0.0', 1, GTPC_PORT), 0)
+
+
+    def test_loopback(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+
+        report = run(peer='loopback', rate=2000, duration=0.3, ues=100, workers=2, local_address='127.0.0.1', loopback_port=port)
+        self.assertGreater(report['completed'], 0, "sessions completed against loopback responders")
+        self.assertGreaterEqual(report['sent'], report['received'], "responses never exceed requests")
+        self.assertIn(99, report['latency'], "latency percentiles reported")
+
+
+if __name__ == "__main__":
+    unittest.main()
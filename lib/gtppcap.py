@@ -0,0 +1,529 @@
+import unittest
+import collections
+import mmap
+import socket
+import struct
+import time
+
+import gtpv1
+import gtpv2
+from gtpcodec import u16_packer
+
+# pcap magic numbers, as read little-endian, with the timestamp fraction resolution they imply
+PCAP_MAGIC_MICROSECONDS = 0xa1b2c3d4
+PCAP_MAGIC_NANOSECONDS = 0xa1b23c4d
+PCAPNG_SECTION_HEADER = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+GTP_PORTS = (2123, 2152)
+
+udp_header_struct = struct.Struct('! H H H')
+ipv4_header_struct = struct.Struct('! B B H H H B B H 4s 4s')
+udp_header_full_struct = struct.Struct('! H H H H')
+
+pcap_record_header_structs = {'<': struct.Struct('< I I I I'), '>': struct.Struct('> I I I I')}
+pcapng_block_header_structs = {'<': struct.Struct('< I I'), '>': struct.Struct('> I I')}
+pcapng_enhanced_packet_structs = {'<': struct.Struct('< I I I I I'), '>': struct.Struct('> I I I I I')}
+pcapng_interface_structs = {'<': struct.Struct('< H H I'), '>': struct.Struct('> H H I')}
+pcapng_option_structs = {'<': struct.Struct('< H H'), '>': struct.Struct('> H H')}
+u32_structs = {'<': struct.Struct('< I'), '>': struct.Struct('> I')}
+
+
+# 'source' and 'destination' are (address, port), where the address is the packed IPv4 or IPv6 address
+GTPPacket = collections.namedtuple('GTPPacket', ('timestamp', 'source', 'destination', 'message'))
+
+# A byte range of a capture, from split().  For pcapng, 'section' is the state in effect at 'start' that
+# frames in the range depend on: (byte order, ((linktype, timestamp resolution) of each interface
+# described so far in the section, ...)); it is None for pcap.
+CaptureRange = collections.namedtuple('CaptureRange', ('start', 'end', 'section'))
+
+
+def locate_gtp(view, offset, end, linktype, ports=GTP_PORTS):
+    """Walk the link, IP and UDP layers of the captured frame view[offset:end] and, if it carries a UDP
+       datagram to or from one of 'ports', return (source, destination, GTP offset, GTP end), where the
+       UDP payload is view[GTP offset:GTP end].  Return None for any other frame, including IP
+       fragments."""
+    if linktype == LINKTYPE_ETHERNET:
+        if end - offset < 14:
+            return None
+        ethertype = u16_packer.unpack_from(view, offset + 12)[0]
+        offset += 14
+        # 802.1Q, 802.1ad and legacy QinQ tags
+        while ethertype == 0x8100 or ethertype == 0x88a8 or ethertype == 0x9100:
+            if end - offset < 4:
+                return None
+            ethertype = u16_packer.unpack_from(view, offset + 2)[0]
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if end - offset < 16:
+            return None
+        ethertype = u16_packer.unpack_from(view, offset + 14)[0]
+        offset += 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if end - offset < 20:
+            return None
+        ethertype = u16_packer.unpack_from(view, offset)[0]
+        offset += 20
+    elif linktype == LINKTYPE_RAW or linktype == LINKTYPE_IPV4 or linktype == LINKTYPE_IPV6:
+        if end - offset < 1:
+            return None
+        ethertype = 0x0800 if view[offset] >> 4 == 4 else 0x86dd
+    elif linktype == LINKTYPE_NULL:
+        if end - offset < 4:
+            return None
+        # the address family is in host byte order of the capturing machine
+        ethertype = 0x0800 if view[offset] == 2 or view[offset + 3] == 2 else 0x86dd
+        offset += 4
+    else:
+        return None
+
+    if ethertype == 0x0800:
+        if end - offset < 20 or view[offset] >> 4 != 4 or view[offset + 9] != 17:
+            return None
+        # more-fragments flag or a fragment offset
+        if u16_packer.unpack_from(view, offset + 6)[0] & 0x3fff:
+            return None
+        source_address = bytes(view[offset + 12:offset + 16])
+        destination_address = bytes(view[offset + 16:offset + 20])
+        offset += (view[offset] & 0x0f) * 4
+    elif ethertype == 0x86dd:
+        if end - offset < 40:
+            return None
+        next_header = view[offset + 6]
+        source_address = bytes(view[offset + 8:offset + 24])
+        destination_address = bytes(view[offset + 24:offset + 40])
+        offset += 40
+        # hop-by-hop, routing and destination options extension headers
+        while next_header == 0 or next_header == 43 or next_header == 60:
+            if end - offset < 8:
+                return None
+            next_header = view[offset]
+            offset += (view[offset + 1] + 1) * 8
+        if next_header != 17:
+            return None
+    else:
+        return None
+
+    if end - offset < 8:
+        return None
+
+    (source_port, destination_port, udp_length) = udp_header_struct.unpack_from(view, offset)
+
+    if source_port not in ports and destination_port not in ports:
+        return None
+
+    return ((source_address, source_port), (destination_address, destination_port), offset + 8, min(offset + udp_length, end))
+
+
+def decode_frame(view, offset, end, linktype, ports=GTP_PORTS, predicate=None):
+    """Locate the GTP message in the captured frame view[offset:end] as for locate_gtp() and return
+       (source, destination, GTP message) where the message is a lazily decoded gtpv1.v1message or
+       gtpv2.v2message over a view of the frame.  If 'predicate' (such as a gtpfilter.MessageFilter) is
+       given, it is called with the view and offset of the encoded GTP message and the message is
+       decoded only if it returns True.  Return None for any other frame, including IP fragments and
+       undecodable GTP."""
+    located = locate_gtp(view, offset, end, linktype, ports)
+
+    if located is None:
+        return None
+
+    (source, destination, offset, gtp_end) = located
+
+    try:
+        if gtp_end - offset < 1:
+            return None
+        if predicate is not None and not predicate(view[:gtp_end], offset):
+            return None
+        if view[offset] >> 5 == 2:
+            message = gtpv2.v2message.decode(view[offset:gtp_end])
+        else:
+            message = gtpv1.v1message.decode(view[offset:gtp_end])
+    except ValueError:
+        return None
+
+    return (source, destination, message)
+
+
+class CaptureReader(object):
+    """Reads GTP messages from a pcap or pcapng file without loading it: the file is memory-mapped and
+       every message yielded is a lazily decoded gtpv1.v1message or gtpv2.v2message over a view into the
+       mapping, so memory use does not grow with the size of the file.  Use as a context manager, or
+       call close() when done; the mapping stays alive while any yielded message is still referenced.
+       Messages can be selected with 'predicate', as for decode_frame()."""
+
+    def __init__(self, path, ports=GTP_PORTS, predicate=None):
+        self._ports = ports
+        self._predicate = predicate
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._map, 'madvise'):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+        self._view = memoryview(self._map)
+
+        if len(self._view) < 4:
+            raise ValueError('File is too short to be a pcap or pcapng capture')
+
+        magic = u32_structs['<'].unpack_from(self._view, 0)[0]
+
+        if magic == PCAPNG_SECTION_HEADER:
+            self._pcapng = True
+        elif magic in (PCAP_MAGIC_MICROSECONDS, PCAP_MAGIC_NANOSECONDS):
+            self._pcapng = False
+            self._byte_order = '<'
+        elif u32_structs['>'].unpack_from(self._view, 0)[0] in (PCAP_MAGIC_MICROSECONDS, PCAP_MAGIC_NANOSECONDS):
+            self._pcapng = False
+            self._byte_order = '>'
+        else:
+            raise ValueError('File is neither a pcap nor a pcapng capture')
+
+        if not self._pcapng:
+            if len(self._view) < 24:
+                raise ValueError('File is too short for a pcap file header')
+            magic = u32_structs[self._byte_order].unpack_from(self._view, 0)[0]
+            self._resolution = 1e-9 if magic == PCAP_MAGIC_NANOSECONDS else 1e-6
+            self._linktype = u32_structs[self._byte_order].unpack_from(self._view, 20)[0] & 0xffff
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def __iter__(self):
+        return self.messages()
+
+
+    def close(self):
+        """Release the file.  If yielded messages are still referenced, the mapping itself is released
+           once they are gone."""
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+
+    def frames(self, start=None, end=None, section=None):
+        """Yield (timestamp, linktype, offset, end) for every captured frame, where the frame is
+           view[offset:end] of the mapping returned by view().  If 'start' and 'end' are given, only
+           frames whose record begins at a file offset in [start, end) are yielded; 'start' must be a
+           record boundary as returned by split().  For pcapng, reading begins at 'start' when the
+           'section' of the CaptureRange is given; otherwise the blocks before 'start' are walked to
+           learn the interface descriptions."""
+        if end is None:
+            end = len(self._view)
+        if self._pcapng:
+            return self._pcapng_frames(start or 0, end, section)
+        return self._pcap_frames(start or 24, end)
+
+
+    def split(self, parts):
+        """Divide the file into at most 'parts' byte ranges of roughly equal size, aligned to record
+           boundaries, and return them as a list of CaptureRange, whose fields are the arguments of
+           frames() and messages() for the range.  Only the record headers, and pcapng interface
+           descriptions, are read."""
+        size = len(self._view)
+        ranges = []
+        start = None
+        target = 0
+
+        for (offset, state) in self._record_offsets():
+            if offset >= target:
+                if start is not None:
+                    ranges.append(CaptureRange(start, offset, section))
+                start = offset
+                section = None if state is None else (state[0], tuple(state[1]))
+                target = offset + max(1, size // parts)
+
+        if start is not None:
+            ranges.append(CaptureRange(start, size, section))
+
+        return ranges
+
+
+    def view(self):
+        """A memoryview of the whole mapped file"""
+        return self._view
+
+
+    def messages(self, start=None, end=None, section=None):
+        """Yield a GTPPacket for every GTP message carried over UDP to or from one of the reader's ports,
+           optionally limited to the byte range [start, end) as for frames()"""
+        view = self._view
+        ports = self._ports
+        predicate = self._predicate
+
+        for (timestamp, linktype, offset, end) in self.frames(start, end, section):
+            decoded = decode_frame(view, offset, end, linktype, ports, predicate)
+            if decoded is not None:
+                yield GTPPacket(timestamp, decoded[0], decoded[1], decoded[2])
+
+
+    def _record_offsets(self):
+        # yield (offset, state) for each record; for pcapng 'state' is [byte order, interfaces] as in
+        # effect before the record, a list updated in place as the walk goes on, and for pcap None
+        view = self._view
+        size = len(view)
+
+        if not self._pcapng:
+            record_header = pcap_record_header_structs[self._byte_order]
+            offset = 24
+            while offset + 16 <= size:
+                yield (offset, None)
+                offset += 16 + record_header.unpack_from(view, offset)[2]
+            return
+
+        offset = 0
+        state = ['<', []]
+        while offset + 12 <= size:
+            (block_type, block_length) = pcapng_block_header_structs[state[0]].unpack_from(view, offset)
+            if block_type == PCAPNG_SECTION_HEADER:
+                state[0] = '<' if u32_structs['<'].unpack_from(view, offset + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+                block_length = u32_structs[state[0]].unpack_from(view, offset + 4)[0]
+            yield (offset, state)
+            if block_length < 12 or offset + block_length > size:
+                return
+            if block_type == PCAPNG_SECTION_HEADER:
+                state[1] = []
+            elif block_type == 1:
+                state[1].append(self._interface_description(view, offset + 8, offset + block_length - 4, state[0]))
+            offset += block_length
+
+
+    def _pcap_frames(self, offset, stop):
+        view = self._view
+        size = len(view)
+        record_header = pcap_record_header_structs[self._byte_order]
+        resolution = self._resolution
+        linktype = self._linktype
+
+        while offset < stop and offset + 16 <= size:
+            (seconds, fraction, captured_length, original_length) = record_header.unpack_from(view, offset)
+            offset += 16
+            end = offset + captured_length
+            if end > size:
+                return
+            yield (seconds + fraction * resolution, linktype, offset, end)
+            offset = end
+
+
+    def _pcapng_frames(self, start, stop, section):
+        # packets refer to earlier interface descriptions: without the 'section' state in effect at
+        # 'start', the blocks before it are walked to collect them
+        view = self._view
+        size = len(view)
+
+        if section is None:
+            offset = 0
+            byte_order = '<'
+            interfaces = []
+        else:
+            offset = start
+            byte_order = section[0]
+            interfaces = list(section[1])
+
+        while offset < stop and offset + 12 <= size:
+            (block_type, block_length) = pcapng_block_header_structs[byte_order].unpack_from(view, offset)
+
+            if block_type == PCAPNG_SECTION_HEADER:
+                # the byte-order magic decides how this section, including its own length, is read
+                byte_order = '<' if u32_structs['<'].unpack_from(view, offset + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+                block_length = u32_structs[byte_order].unpack_from(view, offset + 4)[0]
+                interfaces = []
+
+            if block_length < 12 or offset + block_length > size:
+                return
+
+            body = offset + 8
+            block_end = offset + block_length - 4
+
+            if offset < start:
+                if block_type == 1:
+                    interfaces.append(self._interface_description(view, body, block_end, byte_order))
+            elif block_type == 6:
+                (interface, high, low, captured_length, original_length) = pcapng_enhanced_packet_structs[byte_order].unpack_from(view, body)
+                if interface < len(interfaces):
+                    (linktype, resolution) = interfaces[interface]
+                    yield (((high << 32) | low) * resolution, linktype, body + 20, min(body + 20 + captured_length, block_end))
+            elif block_type == 3:
+                if interfaces:
+                    original_length = u32_structs[byte_order].unpack_from(view, body)[0]
+                    yield (0.0, interfaces[0][0], body + 4, min(body + 4 + original_length, block_end))
+            elif block_type == 1:
+                interfaces.append(self._interface_description(view, body, block_end, byte_order))
+
+            offset += block_length
+
+
+    def _interface_description(self, view, offset, end, byte_order):
+        (linktype, reserved, snaplen) = pcapng_interface_structs[byte_order].unpack_from(view, offset)
+        resolution = 1e-6
+        offset += 8
+        option_header = pcapng_option_structs[byte_order]
+
+        while offset + 4 <= end:
+            (code, length) = option_header.unpack_from(view, offset)
+            if code == 0:
+                break
+            if code == 9 and length >= 1:
+                value = view[offset + 4]
+                resolution = 2.0 ** -(value & 0x7f) if value & 0x80 else 10.0 ** -value
+            offset += 4 + ((length + 3) & ~3)
+
+        return (linktype, resolution)
+
+
+class CaptureWriter(object):
+    """Writes GTP messages to a pcap file as Ethernet/IPv4/UDP frames.  Addresses are (address, port),
+       where the address is a dotted-quad string or a packed 4-octet IPv4 address."""
+
+    ethernet_header = b'\x00\x00\x00\x00\x00\x02\x00\x00\x00\x00\x00\x01\x08\x00'
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(struct.pack('< I H H i I I I', PCAP_MAGIC_MICROSECONDS, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+        self._record_header = pcap_record_header_structs['<']
+        self._headers = bytearray(16 + 14 + 20 + 8)
+        self._headers[16:30] = self.ethernet_header
+        self._packed_addresses = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        self._file.close()
+
+
+    def _packed(self, address):
+        if len(address) == 4 and not isinstance(address, str):
+            return bytes(address)
+        packed = self._packed_addresses.get(address)
+        if packed is None:
+            packed = self._packed_addresses[address] = socket.inet_aton(address)
+        return packed
+
+
+    def write(self, message, source, destination, timestamp=None):
+        """Write one frame carrying 'message' (encoded bytes, or an object with an encode() method)"""
+        if hasattr(message, 'encode'):
+            message = message.encode()
+        if timestamp is None:
+            timestamp = time.time()
+
+        headers = self._headers
+        frame_length = 14 + 20 + 8 + len(message)
+        seconds = int(timestamp)
+        self._record_header.pack_into(headers, 0, seconds, int((timestamp - seconds) * 1e6), frame_length, frame_length)
+
+        ipv4_header_struct.pack_into(headers, 30, 0x45, 0, 20 + 8 + len(message), 0, 0, 64, 17, 0, self._packed(source[0]), self._packed(destination[0]))
+        checksum = sum(u16_packer.unpack_from(headers, 30 + i)[0] for i in range(0, 20, 2))
+        checksum = (checksum & 0xffff) + (checksum >> 16)
+        checksum = (checksum & 0xffff) + (checksum >> 16)
+        u16_packer.pack_into(headers, 40, ~checksum & 0xffff)
+
+        udp_header_full_struct.pack_into(headers, 50, source[1], destination[1], 8 + len(message), 0)
+
+        self._file.write(headers)
+        self._file.write(message)
+
+
+
+class Test_CaptureReader(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self._directory = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self._directory)
+
+
+    def test_pcap(self):
+        path = self._directory + '/test.pcap'
+        request = gtpv2.v2message(32, 0x123456, teid=0, IEs=(gtpv2.IE(1, b'\x21\x43\x65\x87\x09\x21\x43\xf5'),))
+        response = gtpv1.v1message(17, 0xdeadbeef, 0x1234, IEs=(gtpv1.ie(1, 128),))
+
+        with CaptureWriter(path) as writer:
+            writer.write(request, ('10.0.0.1', 2123), ('10.0.0.2', 2123), 1000.5)
+            writer.write(b'not gtp', ('10.0.0.1', 5000), ('10.0.0.2', 5001), 1001.0)
+            writer.write(response, (b'\x0a\x00\x00\x02', 2123), ('10.0.0.1', 2123), 1002.25)
+
+        with CaptureReader(path) as reader:
+            packets = list(reader)
+            self.assertEqual(len(packets), 2, "non-GTP frames are skipped")
+            self.assertEqual(packets[0].timestamp, 1000.5, "pcap timestamp")
+            self.assertEqual(packets[0].source, (b'\x0a\x00\x00\x01', 2123), "pcap source")
+            self.assertEqual(packets[0].message.encode(), request.encode(), "GTPv2 message decoded from pcap")
+            self.assertEqual(packets[0].message.get_IE(1).decoded_value(), '123456789012345', "IEs decoded on demand")
+            self.assertEqual((packets[1].message.type(), packets[1].message.teid()), (17, 0xdeadbeef), "GTPv1 message decoded from pcap")
+            self.assertEqual(packets[1].destination, (b'\x0a\x00\x00\x01', 2123), "pcap destination")
+            del packets
+
+            ranges = reader.split(2)
+            self.assertEqual(len(ranges), 2, "split() into two ranges")
+            self.assertEqual((ranges[0][0], ranges[0][1], ranges[1][1]), (24, ranges[1][0], len(reader.view())), "split() ranges are contiguous")
+            self.assertEqual(sum(len(list(reader.frames(*part))) for part in ranges), 3, "split() ranges cover every frame once")
+            self.assertEqual(ranges[1].section, None, "no section state for pcap")
+            self.assertEqual(len(reader.split(10)), 3, "split() never divides a record")
+
+        with CaptureReader(path, predicate=lambda view, offset: view[offset] >> 5 == 1) as reader:
+            self.assertEqual([packet.message.type() for packet in reader], [17], "predicate selects messages before decoding")
+
+
+    def test_pcapng(self):
+        path = self._directory + '/test.pcapng'
+        message = gtpv2.v2message(1, 7).encode()
+
+        # IPv6 in 802.1Q-tagged Ethernet
+        ipv6 = b'\x60\x00\x00\x00' + struct.pack('!H', 8 + len(message)) + b'\x11\x40' + b'\x20\x01' + b'\x00' * 13 + b'\x01' + b'\x20\x01' + b'\x00' * 13 + b'\x02'
+        frame = b'\x00' * 12 + b'\x81\x00\x00\x05\x86\xdd' + ipv6 + struct.pack('!HHHH', 40000, 2123, 8 + len(message), 0) + message
+        padding = b'\x00' * (-len(frame) % 4)
+
+        section = struct.pack('<IIIHHq', PCAPNG_SECTION_HEADER, 28, PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1) + struct.pack('<I', 28)
+        # interface with if_tsresol of 10^-9
+        interface = struct.pack('<IIHHI', 1, 32, LINKTYPE_ETHERNET, 0, 65535) + struct.pack('<HHB3x', 9, 1, 9) + struct.pack('<HH', 0, 0) + struct.pack('<I', 32)
+        timestamp = 1500 * 1000000000 + 250000000
+        packet_length = 32 + len(frame) + len(padding)
+        packet = struct.pack('<IIIIIII', 6, packet_length, 0, timestamp >> 32, timestamp & 0xffffffff, len(frame), len(frame)) + frame + padding + struct.pack('<I', packet_length)
+
+        with open(path, 'wb') as f:
+            f.write(section + interface + packet + packet)
+
+        with CaptureReader(path) as reader:
+            packets = list(reader)
+            self.assertEqual(len(packets), 2, "GTP messages in pcapng")
+            self.assertAlmostEqual(packets[0].timestamp, 1500.25, 6, "pcapng timestamp with if_tsresol")
+            self.assertEqual(packets[0].source, (b'\x20\x01' + b'\x00' * 13 + b'\x01', 40000), "IPv6 source")
+            self.assertEqual((packets[0].message.type(), packets[0].message.sequence_number()), (1, 7), "GTPv2 message decoded from pcapng")
+            del packets
+
+            ranges = reader.split(2)
+            self.assertEqual([part.start for part in ranges], [0, len(section) + len(interface) + len(packet)], "split() at block boundaries")
+            self.assertEqual(ranges[1].section, ('<', ((LINKTYPE_ETHERNET, 1e-9),)), "interfaces in effect at range start")
+            for part in ranges:
+                # reading from the range start yields the same frames as walking from the file start
+                self.assertEqual(list(reader.frames(*part)), list(reader.frames(part.start, part.end)), "frames() from range start")
+            self.assertEqual(sum(len(list(reader.frames(*part))) for part in ranges), 2, "split() ranges cover every frame once")
+
+
+if __name__ == "__main__":
+    unittest.main()
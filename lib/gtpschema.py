@@ -0,0 +1,260 @@
+import unittest
+import collections
+import struct
+
+import gtpv2
+
+# Cause values (3GPP TS 29.274 8.4) for the ways a message can fail its schema
+INVALID_MESSAGE_FORMAT = 65
+INVALID_LENGTH = 67
+MANDATORY_IE_INCORRECT = 69
+MANDATORY_IE_MISSING = 70
+
+# flags, message type, length
+v2_header_struct = struct.Struct('! B B H')
+
+# Why a message failed its schema: the cause value to answer with, and the offending IE type and
+# instance (None where the message as a whole is at fault).  A fault inside a grouped IE is reported
+# against the top-level grouped IE.
+SchemaViolation = collections.namedtuple('SchemaViolation', ('cause', 'type', 'instance'))
+
+
+def _keys(ies):
+    # IEs given as a type (instance 0) or a (type, instance) pair, as keys into the presence table
+    for ie in ies:
+        (type, instance) = (ie, 0) if isinstance(ie, int) else ie
+        yield (type << 4) | instance
+
+
+class IESchema(object):
+    """The IEs expected in a message, or in the value of a grouped IE, compiled for checking during a
+       single walk over the encoded IEs.  Every (type, instance) in the schema is given one bit; a flat
+       4096-slot table indexed by (type << 4) | instance maps each IE header straight to its bit, so the
+       walk sets one bit per IE and afterwards all mandatory IEs are checked with a single AND and
+       compare.  IEs are given as a type (instance 0) or a (type, instance) pair:
+
+         mandatory      -- IEs that must be present
+         conditional    -- IEs that may be present, depending on conditions this schema does not check
+         optional       -- IEs that may be present
+         groups         -- dict of (type, instance) of a grouped IE in the schema to the IESchema its
+                           value must satisfy
+         strict         -- if True, an IE not in the schema is a violation; otherwise it is ignored, as
+                           TS 29.274 requires for unexpected IEs at the top level of a message
+
+       The masks of the three sets are available as mandatory_mask, conditional_mask and optional_mask,
+       with bit() giving the bit of a single IE."""
+
+    __slots__ = ('_table', '_keys', '_children', 'mandatory_mask', 'conditional_mask', 'optional_mask', '_grouped_mask', '_strict')
+
+    def __init__(self, mandatory=(), conditional=(), optional=(), groups=None, strict=False):
+        self._table = [0] * 4096
+        self._keys = []
+        self._children = {}
+        self._strict = strict
+
+        masks = []
+        for ies in (mandatory, conditional, optional):
+            mask = 0
+            for key in _keys(ies):
+                if self._table[key]:
+                    raise ValueError('IE type ({}) instance ({}) appears more than once in schema'.format(str(key >> 4), str(key & 0x0f)))
+                self._table[key] = 1 << len(self._keys)
+                self._keys.append(key)
+                mask |= self._table[key]
+            masks.append(mask)
+        (self.mandatory_mask, self.conditional_mask, self.optional_mask) = masks
+
+        self._grouped_mask = 0
+        for (key, schema) in zip(_keys((groups or {}).keys()), (groups or {}).values()):
+            if not self._table[key]:
+                raise ValueError('Grouped IE type ({}) instance ({}) is not in schema'.format(str(key >> 4), str(key & 0x0f)))
+            self._children[key] = schema
+            self._grouped_mask |= self._table[key]
+
+
+    def bit(self, type, instance=0):
+        """The bit of IE 'type' and 'instance' in this schema's masks, or 0 if it is not in the schema"""
+        return self._table[(type << 4) | instance]
+
+
+    def check_IEs(self, buffer, offset, end):
+        """Check the IEs encoded in 'buffer' from 'offset' to 'end' against the schema.  Return None if
+           they satisfy it, otherwise a SchemaViolation."""
+        table = self._table
+        header = gtpv2.ie_header_struct.unpack_from
+        seen = 0
+
+        while offset < end:
+            if end - offset < 4:
+                return SchemaViolation(INVALID_LENGTH, None, None)
+
+            (type, length, instance) = header(buffer, offset)
+            start = offset + 4
+            offset = start + length
+
+            if offset > end:
+                return SchemaViolation(INVALID_LENGTH, type, instance & 0x0f)
+
+            key = (type << 4) | (instance & 0x0f)
+            bit = table[key]
+
+            if bit:
+                seen |= bit
+                if bit & self._grouped_mask:
+                    violation = self._children[key].check_IEs(buffer, start, offset)
+                    if violation is not None:
+                        return SchemaViolation(violation.cause, type, instance & 0x0f)
+            elif self._strict:
+                return SchemaViolation(MANDATORY_IE_INCORRECT, type, instance & 0x0f)
+
+        if seen & self.mandatory_mask != self.mandatory_mask:
+            missing = self.mandatory_mask & ~seen
+            key = self._keys[(missing & -missing).bit_length() - 1]
+            return SchemaViolation(MANDATORY_IE_MISSING, key >> 4, key & 0x0f)
+
+        return None
+
+
+    def check(self, buffer, offset=0):
+        """Check the GTPv2 message encoded at 'offset' in 'buffer' against the schema.  Return None if it
+           satisfies it, otherwise a SchemaViolation."""
+        if len(buffer) - offset < 8 or buffer[offset] >> 5 != 2:
+            return SchemaViolation(INVALID_MESSAGE_FORMAT, None, None)
+
+        (flags, type, length) = v2_header_struct.unpack_from(buffer, offset)
+        end = offset + 4 + length
+
+        if end > len(buffer) or (flags & 0x08 and length < 8):
+            return SchemaViolation(INVALID_LENGTH, None, None)
+
+        return self.check_IEs(buffer, offset + (12 if flags & 0x08 else 8), end)
+
+
+
+# Schemas indexed by message type; None where a message type has no schema
+message_schemas = [None] * 256
+
+def register_schema(type, schema):
+    """Set the IESchema for GTPv2 message 'type' (a message type or name), or remove it if 'schema' is None"""
+    if isinstance(type, str):
+        type = gtpv2.message_name_to_type[type]
+    message_schemas[type] = schema
+
+
+def check(buffer, offset=0):
+    """Check the GTPv2 message encoded at 'offset' in 'buffer' against the schema registered for its
+       type.  Return None if it satisfies the schema, or if no schema is registered for the type,
+       otherwise a SchemaViolation."""
+    if len(buffer) - offset < 8:
+        return SchemaViolation(INVALID_MESSAGE_FORMAT, None, None)
+
+    schema = message_schemas[buffer[offset + 1]]
+
+    if schema is None:
+        return None
+
+    return schema.check(buffer, offset)
+
+
+def validate(buffer, offset=0):
+    """As check(), but raise ValueError on a violation"""
+    violation = check(buffer, offset)
+
+    if violation is not None:
+        raise ValueError('Message fails its schema: cause ({}), IE type ({}), instance ({})'.format(str(violation.cause), str(violation.type), str(violation.instance)))
+
+
+# Schemas for the S11 session messages and echo (3GPP TS 29.274 7.1 and 7.2).  Where the IE tables list
+# an IE as conditional or conditional-optional it is conditional here.
+
+# Bearer Context to be created: EBI, TFT, S1-U eNodeB, S4-U SGSN, S5/S8-U SGW and PGW, S12 RNC, S2b-U
+# ePDG, S2a-U TWAN and S11-U MME (CIoT) F-TEIDs, Bearer QoS
+bearer_context_to_be_created = IESchema(mandatory=(73, 80), conditional=(84, (87, 0), (87, 1), (87, 2), (87, 3), (87, 4), (87, 5), (87, 6), (87, 7)), strict=True)
+bearer_context_to_be_removed = IESchema(mandatory=(73,), conditional=((87, 0),), strict=True)
+# Bearer Context to be modified: EBI, S1-U eNodeB, S12 RNC and S4-U SGSN F-TEIDs
+bearer_context_to_be_modified = IESchema(mandatory=(73,), conditional=((87, 0), (87, 1), (87, 2)), strict=True)
+# Bearer Context created or modified: EBI, Cause and the F-TEIDs, Charging ID, Bearer QoS and flags
+bearer_context_created = IESchema(mandatory=(73, 2), conditional=((87, 0), (87, 1), (87, 2), (87, 3), (87, 4), (87, 5), (87, 6), 80, 94, 97), strict=True)
+bearer_context_marked_for_removal = IESchema(mandatory=(73, 2), strict=True)
+
+register_schema('Echo Request', IESchema(mandatory=(3,), optional=(152,)))
+register_schema('Echo Response', IESchema(mandatory=(3,), optional=(152,)))
+
+register_schema('Create Session Request', IESchema(
+    mandatory=((87, 0), 82, 71, (93, 0)),
+    conditional=(1, 76, 75, 86, 83, 77, (87, 1), 128, 99, 79, 127, 72, 73, 78, (93, 1), 95, 114, 3),
+    groups={(93, 0): bearer_context_to_be_created, (93, 1): bearer_context_to_be_removed}))
+
+register_schema('Create Session Response', IESchema(
+    mandatory=(2,),
+    conditional=(170, 72, 73, (87, 0), (87, 1), 79, 127, 78, (93, 0), (93, 1), 3),
+    groups={(93, 0): bearer_context_created, (93, 1): bearer_context_marked_for_removal}))
+
+register_schema('Modify Bearer Request', IESchema(
+    conditional=(75, 86, 83, 82, 77, (87, 0), 72, 92, (93, 0), (93, 1), 3, 114),
+    groups={(93, 0): bearer_context_to_be_modified, (93, 1): bearer_context_to_be_removed}))
+
+register_schema('Modify Bearer Response', IESchema(
+    mandatory=(2,),
+    conditional=(76, 73, 127, 78, (93, 0), (93, 1), 3),
+    groups={(93, 0): bearer_context_created, (93, 1): bearer_context_marked_for_removal}))
+
+register_schema('Delete Session Request', IESchema(conditional=(2, 73, 86, 77, 78, 3)))
+register_schema('Delete Session Response', IESchema(mandatory=(2,), conditional=(3, 78)))
+
+
+
+class Test_IESchema(unittest.TestCase):
+    def setUp(self):
+        self.bearer_qos = gtpv2.IE(80, gtpv2.BearerQoS(0, 9, 0, 9, 0, 0, 0, 0))
+        self.bearer_context = gtpv2.IE(93, (gtpv2.IE(73, b'\x05'), self.bearer_qos))
+        self.request_IEs = [
+            gtpv2.IE(1, '001010123456789'),
+            gtpv2.IE(82, b'\x06'),
+            gtpv2.IE(87, gtpv2.FTEID.create(10, 0x100, '10.0.0.1')),
+            gtpv2.IE(71, b'\x08internet'),
+            self.bearer_context,
+        ]
+
+
+    def test_check(self):
+        self.assertIsNone(check(gtpv2.v2message(32, 1, 0, self.request_IEs).encode()), "valid Create Session Request")
+        self.assertIsNone(check(gtpv2.v2message(32, 1, 0, self.request_IEs + [gtpv2.IE(255, b'x')]).encode()), "unexpected top-level IE ignored")
+        self.assertIsNone(check(gtpv2.v2message(200, 1, 0).encode()), "message type without schema")
+
+        without_apn = [ie for ie in self.request_IEs if ie.type() != 71]
+        self.assertEqual(check(gtpv2.v2message(32, 1, 0, without_apn).encode()), SchemaViolation(MANDATORY_IE_MISSING, 71, 0), "missing mandatory IE")
+
+        pgw_fteid_only = [ie for ie in self.request_IEs if ie.type() != 87] + [gtpv2.IE(87, gtpv2.FTEID.create(7, 0, '10.0.0.3'), instance=1)]
+        self.assertEqual(check(gtpv2.v2message(32, 1, 0, pgw_fteid_only).encode()), SchemaViolation(MANDATORY_IE_MISSING, 87, 0), "mandatory IE instance distinguished")
+
+        wrong_child = self.request_IEs[:4] + [gtpv2.IE(93, (gtpv2.IE(73, b'\x05'), self.bearer_qos, gtpv2.IE(2, b'\x10\x00')))]
+        self.assertEqual(check(gtpv2.v2message(32, 1, 0, wrong_child).encode()), SchemaViolation(MANDATORY_IE_INCORRECT, 93, 0), "wrong IE type in grouped IE")
+
+        s11u_fteid = self.request_IEs[:4] + [gtpv2.IE(93, (gtpv2.IE(73, b'\x05'), self.bearer_qos, gtpv2.IE(87, gtpv2.FTEID.create(38, 0x10000001, '10.0.0.1'), instance=7)))]
+        self.assertIsNone(check(gtpv2.v2message(32, 1, 0, s11u_fteid).encode()), "S11-U MME F-TEID in Bearer Context to be created")
+
+        missing_child = self.request_IEs[:4] + [gtpv2.IE(93, (gtpv2.IE(73, b'\x05'),))]
+        self.assertEqual(check(gtpv2.v2message(32, 1, 0, missing_child).encode()), SchemaViolation(MANDATORY_IE_MISSING, 93, 0), "missing IE in grouped IE")
+
+        encoded = gtpv2.v2message(32, 1, 0, self.request_IEs).encode()
+        self.assertEqual(check(encoded[:-1]).cause, INVALID_LENGTH, "truncated message")
+        self.assertEqual(check(b'\x32\x20\x00\x04\x00\x00\x00\x00').cause, INVALID_MESSAGE_FORMAT, "not GTPv2")
+
+        with self.assertRaises(ValueError):
+            validate(gtpv2.v2message(37, 1, 0).encode())
+
+
+    def test_masks(self):
+        schema = IESchema(mandatory=(1, (87, 1)), conditional=(2,), optional=(3,))
+        self.assertEqual((schema.mandatory_mask, schema.conditional_mask, schema.optional_mask), (0b11, 0b100, 0b1000), "bit assignment")
+        self.assertEqual((schema.bit(87, 1), schema.bit(87, 0)), (0b10, 0), "bit() by type and instance")
+
+        with self.assertRaises(ValueError):
+            IESchema(mandatory=(1,), optional=(1,))
+        with self.assertRaises(ValueError):
+            IESchema(mandatory=(1,), groups={(93, 0): schema})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,294 @@
+import unittest
+import array
+import time
+
+import gtpcodec
+import gtpv1
+import gtpv2
+
+# Codec instrumentation.  enable() replaces the message decode(), encode_into() and IEs() methods and the
+# IE decoded_value() methods of gtpv1 and gtpv2 with wrappers that count calls, octets and time into
+# preallocated arrays; disable() puts the original methods back, so that when instrumentation is off the
+# codec runs exactly the code it would without this module.  Code that saved a reference to one of
+# these methods before enable() (e.g. 'decode = gtpv2.v2message.decode') is not instrumented.
+#
+# Counters are updated without a lock; with several threads decoding at once an occasional increment
+# may be lost, which is acceptable for statistics.
+
+# message operations: decode() parses the header, walk is the first IEs() or get_IE() call on a decoded
+# message (which splits the IEs out of the buffer), encode is encode() or encode_into().  IE decoding,
+# likewise, is counted only on the first decoded_value() call, which decodes the value.
+DECODE = 0
+WALK = 1
+ENCODE = 2
+operation_names = ('decode', 'walk', 'encode')
+
+# Latency histograms have a bucket per power of two nanoseconds: bucket 0 holds durations under 1 ns and
+# bucket i those in [2**(i - 1), 2**i) ns, with the last bucket also taking everything longer
+histogram_buckets = 32
+
+
+class Counters(object):
+    """Call counts, octet totals, total nanoseconds and latency histograms for 'slots' slots, each a
+       flat preallocated array of unsigned 64-bit integers"""
+
+    __slots__ = ('slots', 'counts', 'octets', 'nanoseconds', 'histograms')
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.counts = array.array('Q', bytes(8 * slots))
+        self.octets = array.array('Q', bytes(8 * slots))
+        self.nanoseconds = array.array('Q', bytes(8 * slots))
+        self.histograms = array.array('Q', bytes(8 * slots * histogram_buckets))
+
+
+    def record(self, slot, octets, nanoseconds):
+        self.counts[slot] += 1
+        self.octets[slot] += octets
+        self.nanoseconds[slot] += nanoseconds
+        bucket = nanoseconds.bit_length()
+        self.histograms[slot * histogram_buckets + (bucket if bucket < histogram_buckets else histogram_buckets - 1)] += 1
+
+
+    def reset(self):
+        for counters in (self.counts, self.octets, self.nanoseconds, self.histograms):
+            counters[:] = array.array('Q', bytes(8 * len(counters)))
+
+
+    def slot_snapshot(self, slot):
+        return {
+            'count': self.counts[slot],
+            'octets': self.octets[slot],
+            'nanoseconds': self.nanoseconds[slot],
+            'histogram': self.histograms[slot * histogram_buckets:(slot + 1) * histogram_buckets].tolist(),
+        }
+
+
+# slot = ((version - 1) * len(operation_names) + operation) * 256 + message type
+message_counters = Counters(2 * len(operation_names) * 256)
+# slot = (version - 1) * 256 + IE type
+ie_counters = Counters(2 * 256)
+
+_codecs = {1: (gtpv1.v1message, gtpv1.ie), 2: (gtpv2.v2message, gtpv2.IE)}
+_originals = None
+
+
+def _message_slot(version, operation, type):
+    return ((version - 1) * len(operation_names) + operation) * 256 + type
+
+
+def _instrumented_decode(version, original):
+    base = _message_slot(version, DECODE, 0)
+    clock = time.perf_counter_ns
+    record = message_counters.record
+
+    def decode(cls, buffer, offset=0):
+        start = clock()
+        message = original(cls, buffer, offset)
+        record(base + message._type, message._encoded_length, clock() - start)
+        return message
+
+    return classmethod(decode)
+
+
+def _instrumented_walk(version, original):
+    base = _message_slot(version, WALK, 0)
+    clock = time.perf_counter_ns
+    record = message_counters.record
+
+    def IEs(self):
+        if self._ies is not None:
+            return self._ies
+        start = clock()
+        ies = original(self)
+        record(base + self._type, self._encoded_length, clock() - start)
+        return ies
+
+    return IEs
+
+
+def _instrumented_encode_into(version, original):
+    base = _message_slot(version, ENCODE, 0)
+    clock = time.perf_counter_ns
+    record = message_counters.record
+
+    def encode_into(self, buf, offset=0, *args):
+        start = clock()
+        end = original(self, buf, offset, *args)
+        record(base + self._type, self._encoded_length, clock() - start)
+        return end
+
+    return encode_into
+
+
+def _instrumented_decoded_value(version, original):
+    base = (version - 1) * 256
+    clock = time.perf_counter_ns
+    record = ie_counters.record
+    undecoded = gtpcodec.undecoded
+
+    def decoded_value(self):
+        if self._decoded_value is not undecoded:
+            return self._decoded_value
+        start = clock()
+        value = original(self)
+        record(base + self._type, self._length, clock() - start)
+        return value
+
+    return decoded_value
+
+
+def is_enabled():
+    """True if the codecs are currently instrumented"""
+    return _originals is not None
+
+
+def enable():
+    """Instrument message decode, IE walk and encode, and IE decoding, of both GTP versions.  Counters
+       keep their values from any earlier period of instrumentation; see reset()."""
+    global _originals
+
+    if _originals is not None:
+        return
+
+    originals = {}
+    for (version, (message_class, ie_class)) in _codecs.items():
+        originals[version] = (message_class.__dict__['decode'], message_class.IEs, message_class.encode_into, ie_class.decoded_value)
+        message_class.decode = _instrumented_decode(version, message_class.__dict__['decode'].__func__)
+        message_class.IEs = _instrumented_walk(version, message_class.IEs)
+        message_class.encode_into = _instrumented_encode_into(version, message_class.encode_into)
+        ie_class.decoded_value = _instrumented_decoded_value(version, ie_class.decoded_value)
+
+    _originals = originals
+
+
+def disable():
+    """Restore the uninstrumented codec methods.  Counters are kept."""
+    global _originals
+
+    if _originals is None:
+        return
+
+    for (version, (message_class, ie_class)) in _codecs.items():
+        (message_class.decode, message_class.IEs, message_class.encode_into, ie_class.decoded_value) = _originals[version]
+
+    _originals = None
+
+
+def reset():
+    """Zero every counter"""
+    message_counters.reset()
+    ie_counters.reset()
+
+
+def snapshot():
+    """Return the counters as {'messages': {(version, type, operation name): counts}, 'ies': {(version,
+       type): counts}}, counts being a dict of 'count', 'octets', 'nanoseconds' and 'histogram' (the
+       list of bucket counts).  Only slots that have been used are included."""
+    messages = {}
+    for version in (1, 2):
+        for operation in range(len(operation_names)):
+            base = _message_slot(version, operation, 0)
+            for type in range(256):
+                if message_counters.counts[base + type]:
+                    messages[(version, type, operation_names[operation])] = message_counters.slot_snapshot(base + type)
+
+    ies = {}
+    for version in (1, 2):
+        base = (version - 1) * 256
+        for type in range(256):
+            if ie_counters.counts[base + type]:
+                ies[(version, type)] = ie_counters.slot_snapshot(base + type)
+
+    return {'messages': messages, 'ies': ies}
+
+
+def _histogram_lines(name, labels, counts):
+    lines = []
+    cumulative = 0
+    for (bucket, count) in enumerate(counts['histogram']):
+        cumulative += count
+        # every bucket on every scrape, as histogram_quantile() needs the full cumulative series
+        if bucket < histogram_buckets - 1:
+            lines.append('{}_bucket{{{},le="{:.9f}"}} {}'.format(name, labels, (1 << bucket) / 1e9, cumulative))
+    lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, cumulative))
+    lines.append('{}_sum{{{}}} {:.9f}'.format(name, labels, counts['nanoseconds'] / 1e9))
+    lines.append('{}_count{{{}}} {}'.format(name, labels, counts['count']))
+    return lines
+
+
+def prometheus_text(stats=None):
+    """Format 'stats', a snapshot() (by default, a new one), in the Prometheus text exposition format,
+       for a scrape endpoint"""
+    if stats is None:
+        stats = snapshot()
+
+    lines = [
+        '# TYPE gtp_message_octets_total counter',
+    ]
+    for ((version, type, operation), counts) in sorted(stats['messages'].items()):
+        lines.append('gtp_message_octets_total{{version="{}",type="{}",operation="{}"}} {}'.format(version, type, operation, counts['octets']))
+
+    lines.append('# TYPE gtp_message_duration_seconds histogram')
+    for ((version, type, operation), counts) in sorted(stats['messages'].items()):
+        lines += _histogram_lines('gtp_message_duration_seconds', 'version="{}",type="{}",operation="{}"'.format(version, type, operation), counts)
+
+    lines.append('# TYPE gtp_ie_octets_total counter')
+    for ((version, type), counts) in sorted(stats['ies'].items()):
+        lines.append('gtp_ie_octets_total{{version="{}",type="{}"}} {}'.format(version, type, counts['octets']))
+
+    lines.append('# TYPE gtp_ie_decode_duration_seconds histogram')
+    for ((version, type), counts) in sorted(stats['ies'].items()):
+        lines += _histogram_lines('gtp_ie_decode_duration_seconds', 'version="{}",type="{}"'.format(version, type), counts)
+
+    return '\n'.join(lines) + '\n'
+
+
+
+class Test_gtpstats(unittest.TestCase):
+    def tearDown(self):
+        disable()
+        reset()
+
+
+    def test_counters(self):
+        reset()
+        encoded = gtpv2.v2message(32, 1, 0, (gtpv2.IE(1, '001010123456789'), gtpv2.IE(82, b'\x06'))).encode()
+
+        gtpv2.v2message.decode(encoded).IEs()
+        self.assertEqual(snapshot(), {'messages': {}, 'ies': {}}, "nothing counted while disabled")
+
+        enable()
+        self.assertTrue(is_enabled(), "is_enabled()")
+        message = gtpv2.v2message.decode(encoded)
+        message.get_IE(1).decoded_value()
+        message.get_IE(1).decoded_value()
+        message.IEs()
+        message.encode()
+        gtpv1.v1message.decode(gtpv1.v1message(1, 0, 1).encode())
+        disable()
+        self.assertFalse(is_enabled(), "disable()")
+        self.assertIs(gtpv2.IE.decoded_value, gtpv2.IE.__dict__['decoded_value'], "original method restored")
+        gtpv2.v2message.decode(encoded)
+
+        stats = snapshot()
+        self.assertEqual(sorted(stats['messages']), [(1, 1, 'decode'), (1, 1, 'encode'), (2, 32, 'decode'), (2, 32, 'encode'), (2, 32, 'walk')], "message slots used")
+        self.assertEqual(stats['messages'][(2, 32, 'decode')]['count'], 1, "decode counted once")
+        self.assertEqual(stats['messages'][(2, 32, 'walk')]['count'], 1, "only the first IE walk is counted")
+        self.assertEqual(stats['messages'][(2, 32, 'decode')]['octets'], len(encoded), "message octets")
+        self.assertEqual(sum(stats['messages'][(2, 32, 'decode')]['histogram']), 1, "latency histogram")
+        self.assertEqual(stats['ies'], {(2, 1): stats['ies'][(2, 1)]}, "IE decode counted by type")
+        self.assertEqual(stats['ies'][(2, 1)]['count'], 1, "only the decoding call to decoded_value() is counted")
+        self.assertEqual(stats['ies'][(2, 1)]['octets'], 8, "IE octets")
+
+        text = prometheus_text(stats)
+        self.assertIn('gtp_message_octets_total{version="2",type="32",operation="decode"} ' + str(len(encoded)), text, "Prometheus export")
+        self.assertIn('gtp_ie_decode_duration_seconds_count{version="2",type="1"} 1', text, "Prometheus histogram count")
+        self.assertEqual(text.count('gtp_ie_decode_duration_seconds_bucket{version="2",type="1",'), histogram_buckets, "every histogram bucket exported")
+
+        reset()
+        self.assertEqual(snapshot(), {'messages': {}, 'ies': {}}, "reset()")
+
+
+if __name__ == "__main__":
+    unittest.main()
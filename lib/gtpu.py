@@ -0,0 +1,184 @@
+import unittest
+import socket
+
+import gtpv1
+from gtpv1 import v1_header_struct, v1_optional_header_struct
+
+GTPU_PORT = 2152
+
+
+def decode_header(buffer, offset=0):
+    """Parse the GTP-U header at 'offset' in 'buffer' (bytes, bytearray or memoryview).  Return the tuple
+       (message type, TEID, sequence number or None, payload offset, payload end); the payload is
+       buffer[payload offset:payload end].  Extension headers are skipped; use gtpv1.v1message.decode() to
+       read them.  Raises ValueError on an invalid header."""
+    available = len(buffer) - offset
+
+    if available < 8:
+        raise ValueError('Length of encoded stream ({}) is less than a GTP-U header'.format(str(available)))
+
+    (flags, type, length, teid) = v1_header_struct.unpack_from(buffer, offset)
+
+    if flags & 0xf0 != 0x30:
+        raise ValueError('Encoded stream is not GTPv1 with protocol type GTP')
+
+    if length + 8 > available:
+        raise ValueError('Asserted length of message in encoded stream is ({}) but length of stream ({}) is insufficient'.format(str(length + 8), str(available)))
+
+    end = offset + length + 8
+
+    if not flags & 0x07:
+        return (type, teid, None, offset + 8, end)
+
+    if length < 4:
+        raise ValueError('E, S or PN flag is set but asserted message length ({}) is too short'.format(str(length + 8)))
+
+    (sequence_number, n_pdu_number, next_type) = v1_optional_header_struct.unpack_from(buffer, offset + 8)
+    payload_offset = offset + 12
+
+    if flags & 0x04:
+        payload_offset = gtpv1.skip_extension_headers(buffer, payload_offset, next_type, end)
+
+    return (type, teid, sequence_number if flags & 0x02 else None, payload_offset, end)
+
+
+def encode_header_into(buf, offset, teid, payload_length, type=255, sequence_number=None):
+    """Encode a GTP-U header (with no extension headers) for a payload of 'payload_length' octets into
+       the writable buffer 'buf' at 'offset'.  Return the length of the header: 8, or 12 if
+       'sequence_number' is not None."""
+    if sequence_number is None:
+        v1_header_struct.pack_into(buf, offset, 0x30, type, payload_length, teid)
+        return 8
+
+    v1_header_struct.pack_into(buf, offset, 0x32, type, payload_length + 4, teid)
+    v1_optional_header_struct.pack_into(buf, offset + 8, sequence_number, 0, 0)
+    return 12
+
+
+class GTPUEndpoint(object):
+    """A GTP-U endpoint over UDP.  Packets are received with recvmsg_into() into a ring of 'buffers'
+       preallocated buffers of 'buffer_size' octets each, and payloads are handed out as memoryviews into
+       those buffers, so a payload stays valid until the ring wraps around to its buffer.  Packets are
+       sent with sendmsg() from a reused header buffer and the caller's payload, so payloads are never
+       copied.  Echo Requests are answered automatically."""
+
+    def __init__(self, local_addr=('0.0.0.0', GTPU_PORT), buffers=64, buffer_size=2048, timeout=None):
+        family = socket.AF_INET6 if ':' in local_addr[0] else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self._socket.bind(local_addr)
+        self._socket.settimeout(timeout)
+
+        self._buffers = [memoryview(bytearray(buffer_size)) for i in range(buffers)]
+        self._next_buffer = 0
+        self._header = bytearray(12)
+        self._header_view = memoryview(self._header)
+        self._echo_responder = gtpv1.EchoResponder(0)
+
+
+    def socket(self):
+        """The underlying UDP socket"""
+        return self._socket
+
+
+    def close(self):
+        self._socket.close()
+
+
+    def send(self, teid, payload, peer, type=255, sequence_number=None):
+        """Send 'payload' (any bytes-like object) to 'peer' encapsulated in a GTP-U message with the given
+           TEID and type (G-PDU by default)"""
+        header_length = encode_header_into(self._header, 0, teid, len(payload), type, sequence_number)
+        return self._socket.sendmsg((self._header_view[:header_length], payload), (), 0, peer)
+
+
+    def receive(self, handler, limit=None):
+        """Receive packets, calling handler(type, TEID, payload, peer) for each valid GTP-U message other
+           than an Echo Request, where 'payload' is a memoryview into the receive buffer ring.  Malformed
+           packets are dropped.  Return the number of packets received, once 'limit' have been received
+           (never, if 'limit' is None) or as soon as no packet arrives within the endpoint's 'timeout'."""
+        buffers = self._buffers
+        count = len(buffers)
+        received = 0
+        recvmsg_into = self._socket.recvmsg_into
+        sendto = self._socket.sendto
+
+        while limit is None or received < limit:
+            view = buffers[self._next_buffer]
+            self._next_buffer = (self._next_buffer + 1) % count
+
+            try:
+                (length, ancillary, flags, peer) = recvmsg_into((view,))
+            except socket.timeout:
+                break
+            received += 1
+
+            if length > 1 and view[1] == 1:
+                response = self._echo_responder.respond(view[:length])
+                if response is not None:
+                    sendto(response, peer)
+                    continue
+
+            try:
+                (type, teid, sequence_number, start, end) = decode_header(view[:length])
+            except ValueError:
+                continue
+
+            handler(type, teid, view[start:end], peer)
+
+        return received
+
+
+
+class Test_gtpu_header(unittest.TestCase):
+    def test_header(self):
+        buf = bytearray(64)
+        self.assertEqual(encode_header_into(buf, 0, 0xdeadbeef, 4), 8, "header without sequence number is 8 octets")
+        buf[8:12] = b'\x45\x00\x00\x04'
+        self.assertEqual(decode_header(buf[:12]), (255, 0xdeadbeef, None, 8, 12), "decode_header() without sequence number")
+
+        self.assertEqual(encode_header_into(buf, 2, 7, 4, type=254, sequence_number=0x1234), 12, "header with sequence number is 12 octets")
+        self.assertEqual(decode_header(memoryview(buf)[:18], 2), (254, 7, 0x1234, 14, 18), "decode_header() at offset with sequence number")
+
+        # one 4-octet extension header (UDP Port) before the payload
+        encoded = b'\x34\xff\x00\x0a\x00\x00\x00\x01\x00\x00\x00\x40\x01\x08\x68\x00\x45\x00'
+        self.assertEqual(decode_header(encoded), (255, 1, None, 16, 18), "decode_header() skips extension headers")
+
+        with self.assertRaises(ValueError) as context:
+            decode_header(b'\x30\xff\x00\x08\x00\x00\x00\x01\x45')
+
+        with self.assertRaises(ValueError) as context:
+            decode_header(b'\x48\xff\x00\x00\x00\x00\x00\x01')
+
+
+class Test_GTPUEndpoint(unittest.TestCase):
+    def test_send_receive(self):
+        a = GTPUEndpoint(('127.0.0.1', 0), buffers=2, timeout=5)
+        b = GTPUEndpoint(('127.0.0.1', 0), buffers=2, timeout=5)
+        try:
+            received = []
+            def handler(type, teid, payload, peer):
+                received.append((type, teid, bytes(payload), peer))
+
+            payload = bytearray(b'\x45\x00\x00\x14' + b'\x00' * 16)
+            a.send(0x1234, memoryview(payload)[:8], b.socket().getsockname())
+            a.send(0x5678, b'', b.socket().getsockname(), type=254, sequence_number=3)
+            self.assertEqual(b.receive(handler, 2), 2, "receive() returns after limit")
+            self.assertEqual(received, [(255, 0x1234, bytes(payload[:8]), a.socket().getsockname()), (254, 0x5678, b'', a.socket().getsockname())], "receive() hands payloads to handler")
+
+            b.socket().sendto(gtpv1.v1message(1, 0, 42).encode(), a.socket().getsockname())
+            a.receive(handler, 1)
+            self.assertEqual(len(received), 2, "Echo Request does not reach handler")
+            response = gtpv1.v1message.decode(b.socket().recv(64))
+            self.assertEqual((response.type(), response.sequence_number()), (2, 42), "Echo Request is answered")
+
+            a.socket().settimeout(0.01)
+            b.send(0x9abc, b'\x45', a.socket().getsockname())
+            self.assertEqual(a.receive(handler), 1, "receive() returns the count on timeout")
+            self.assertEqual(received[-1][:3], (255, 0x9abc, b'\x45'), "packet before the timeout is handled")
+        finally:
+            a.close()
+            b.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,12 @@
 import unittest
+import collections
 import struct
 
+import gtpcodec
+import tbcd
+
+from gtpcodec import integer_types, u8_packer, u16_packer, u32_packer
+
 ie_type_length = {
     1: 1,
     2: 8,
@@ -32,135 +38,16 @@ ie_type_length = {
 }
 
 
-ie_name_to_type = {
-    'Cause':                                     1,
-    'IMSI':                                      2,
-    'RAI':                                       3,
-    'TLLI':                                      4,
-    'P-TMSI':                                    5,
-    'Reordering Required':                       8,
-    'Authentication Triplet':                    9,
-    'MAP Cause':                                 11,
-    'P-TMSI Signature':                          12,
-    'MS Validated':                              13,
-    'Recovery':                                  14,
-    'Selection Mode':                            15,
-    'TEID Data I':                               16,
-    'TEID Control Plane':                        17,
-    'TEID Data II':                              18,
-    'Teardown Ind':                              19,
-    'NSAPI':                                     20,
-    'RANAP Cause':                               21,
-    'RAB Context':                               22,
-    'Radio Priority SMS':                        23,
-    'Radio Priority':                            24,
-    'Packet Flow Id':                            25,
-    'Charging Characteristics':                  26,
-    'Trace Reference':                           27,
-    'Trace Type':                                28,
-    'MS Not Reachable Reason':                   29,
-    'Charging ID':                               127,
-    'End User Address':                          128,
-    'MM Context':                                129,
-    'PDP Context':                               130,
-    'APN':                                       131,
-    'Protocol Configuration Options':            132,
-    'GSN Address':                               133,
-    'MSISDN':                                    134,
-    'QoS Profile':                               135,
-    'Authentication Quintuplet':                 136,
-    'Traffic Flow Template':                     137,
-    'Target Identification':                     138,
-    'UTRAN Transparent Container':               139,
-    'RAB Setup Information':                     140,
-    'Extension Header Type List':                141,
-    'Trigger Id':                                142,
-    'OMC Identity':                              143,
-    'RAN Transparent Container':                 144,
-    'PDP Context Prioritization':                145,
-    'Additional RAB Setup Information':          146,
-    'SGSN Number':                               147,
-    'Common Flags':                              148,
-    'APN Restriction':                           149,
-    'Radio Priority LCS':                        150,
-    'RAT Type':                                  151,
-    'User Location Information':                 152,
-    'MS Time Zone':                              153,
-    'IMEI':                                      154,
-    'CAMEL Charging Information Container':      155,
-    'MBMS UE Context':                           156,
-    'TMGI':                                      157,
-    'RIM Routing Address':                       158,
-    'MBMS Protocol Configuration Options':       159,
-    'MBMS Service Area':                         160,
-    'Source RNC PDCP context info':              161,
-    'Additional Trace Info':                     162,
-    'Hop Counter':                               163,
-    'Selected PLMN ID':                          164,
-    'MBMS Session Identifier':                   165,
-    'MBMS 2G/3G Indicator':                      166,
-    'Enhanced NSAPI':                            167,
-    'MBMS Session Duration':                     168,
-    'Additional MBMS Trace Info':                169,
-    'MBMS Session Repetition Number':            170,
-    'MBMS Time To Data Transfer':                171,
-    'BSS Container':                             173,
-    'Cell Identification':                       174,
-    'PDU Numbers':                               175,
-    'BSSGP Cause':                               176,
-    'Required MBMS bearer capabilities':         177,
-    'RIM Routing Address Discriminator':         178,
-    'List of set-up PFCs':                       179,
-    'PS Handover XID Parameters':                180,
-    'MS Info Change Reporting Action':           181,
-    'Direct Tunnel Flags':                       182,
-    'Correlation-ID':                            183,
-    'Bearer Control Mode':                       184,
-    'MBMS Flow Identifier':                      185,
-    'MBMS IP Multicast Distribution':            186,
-    'MBMS Distribution Acknowledgement':         187,
-    'Reliable INTER RAT HANDOVER INFO ':         188,
-    'RFSP Index':                                189,
-    'FQDN':                                      190,
-    'Evolved Allocation/Retention Priority I':   191,
-    'Evolved Allocation/Retention Priority II':  192,
-    'Extended Common Flags':                     193,
-    'UCI':                                       194,
-    'CSG Information Reporting Action':          195,
-    'CSG ID':                                    196,
-    'CMI':                                       197,
-    'AMBR':                                      198,
-    'UE Network Capability':                     199,
-    'UE-AMBR':                                   200,
-    'APN-AMBR with NSAPI':                       201,
-    'GGSN Back-Off Time':                        202,
-    'Signalling Priority Indication':            203,
-    'Signalling Priority Indication with NSAPI': 204,
-    'Higher bitrates than 16 Mbps flag':         205,
-    'Additional MM context for SRVCC':           207,
-    'Additional flags for SRVCC':                208,
-    'STN-SR':                                    209,
-    'C-MSISDN':                                  210,
-    'Extended RANAP Cause':                      211,
-    'eNodeB ID':                                 212,
-    'Selection Mode with NSAPI':                 213,
-    'ULI Timestamp':                             214,
-    'Local Home Network ID (LHN-ID) with NSAPI': 215,
-    'CN Operator Selection Entity    ':          216,
-    'UE Usage Type':                             217,
-    'Extended Common Flags II':                  218,
-    'Node Identifier ':                          219,
-    'CIoT Optimizations Support Indication':     220,
-    'SCEF PDN Connection':                       221,
-    'IOV_updates counter':                       222,
-    'Special IE type for IE Type Extension':     238,
-    'Charging Gateway Address':                  251,
-}
+# Name tables, loaded from gtpv1spec on first use
+ie_name_to_type = gtpcodec.LazyTable('gtpv1spec', 'ie_name_to_type')
+ie_type_to_name = gtpcodec.LazyTable('gtpv1spec', 'ie_name_to_type', reverse=True)
+message_name_to_type = gtpcodec.LazyTable('gtpv1spec', 'message_name_to_type')
+message_type_to_name = gtpcodec.LazyTable('gtpv1spec', 'message_name_to_type', reverse=True)
 
 
 ie_types = {
     1: "u8",
-    2: "octetstring",
+    2: "tbcd",
     3: "octetstring",
     4: "u32",
     5: "u32",
@@ -212,7 +99,7 @@ ie_types = {
     151: "u8",
     152: "octetstring",
     153: "u8",
-    154: "octetstring",
+    154: "tbcd",
     155: "octetstring",
     156: "octetstring",
     157: "octetstring",
@@ -285,83 +172,103 @@ ie_types = {
 }
 
 
-u8_packer = struct.Struct('B')
-u16_packer = struct.Struct('!H')
-u32_packer = struct.Struct('!I')
+ie_decoders = dict(gtpcodec.ie_decoders)
+ie_decoders.update({
+    "tbcd":         tbcd.decode_tbcd,
+})
 
-def encode_u8(v): return u8_packer.pack(v)
-def encode_u16(v): return u16_packer.pack(v)
-def encode_u32(v): return u32_packer.pack(v)
-def encode_string(v): return bytes(v)
-def encode_octetstring(v): return v
 
+ie_encoders = dict(gtpcodec.ie_encoders)
+ie_encoders.update({
+    "tbcd":         tbcd.encode_tbcd,
+})
 
-def decode_u8(v): return u8_packer.unpack(v)[0]
-def decode_u16(v): return u16_packer.unpack(v)[0]
-def decode_u32(v): return u32_packer.unpack(v)[0]
-def decode_string(v): return v.decode("ascii")
-def decode_octetstring(v): return v
 
-ie_decoders = {
-    "u8":           decode_u8,
-    "u16":          decode_u16,
-    "u32":          decode_u32,
-    "string":       decode_string,
-    "octetstring":  decode_octetstring,
-}
+ie_codec_structs = dict(gtpcodec.ie_codec_structs)
 
 
-ie_encoders = {
-    "u8":           encode_u8,
-    "u16":          encode_u16,
-    "u32":          encode_u32,
-    "string":       encode_string,
-    "octetstring":  encode_octetstring,
-}
+# IE types whose decoded instances are handed out from a shared cache (see shared_ie()):
+# Cause, Recovery, Selection Mode and RAT Type
+shared_ie_types = frozenset((1, 14, 15, 151))
 
+# Flat per-type dispatch tables, indexed directly by IE type.  These are built from ie_types,
+# ie_type_length, ie_encoders and ie_decoders; call compile_ie_tables() again after changing those.
+ie_encoder_table = [None] * 256
+ie_decoder_table = [None] * 256
+ie_length_table  = [-1] * 256
+ie_struct_table  = [None] * 256
+ie_shared_table  = [False] * 256
 
+def compile_ie_tables():
+    """(Re)build ie_encoder_table, ie_decoder_table, ie_length_table (fixed value length for TV IEs,
+       or -1 for TLV IEs), ie_struct_table (the struct.Struct for fixed-size integer types, otherwise
+       None) and ie_shared_table (True for types in shared_ie_types)"""
+    gtpcodec.compile_ie_tables(ie_types, ie_encoders, ie_decoders, ie_codec_structs, shared_ie_types,
+                               ie_encoder_table, ie_decoder_table, ie_struct_table, ie_shared_table)
+    for type in range(256):
+        ie_length_table[type] = ie_type_length.get(type, -1)
 
-def decode_next_IE(stream):
-    """From an incoming stream, decode the next IE.  Return a gtp.IE object, or None if the 'stream' length is 0.
-       Raises an exception on an invalid IE."""
-    if len(stream) < 1:
-        return None
+compile_ie_tables()
 
-    type = struct.unpack('B', stream[0:1]) 
 
-    if type < 128:
-        if type not in ie_type_length:
-            raise ValueError('Type ({}) extracted from decode stream is not defined'.str(type))
-        length = ie_type_length[type]
 
-        if len(stream) < length + 1:
-            raise ValueError('Length of data for type ({}) should be ({}) but not enough bits left in encoded stream'.format(str(type), str(length)))
+ie_tv_header_packer  = struct.Struct('B')
+ie_tlv_header_packer = struct.Struct('! B H')
 
-        return IE(type, stream[1:length+2], raw=True)
-    else:
-        if len(stream) < 3:
-            raise ValueError('Type ({}) is TLV, but length of encoded stream is less than 3'.format(str(type)))
 
-        length = struct.unpack('!I', stream[1:3])
+def iter_IEs(buffer, offset=0):
+    """Walk the IEs encoded in 'buffer' (bytes, bytearray or memoryview), starting at 'offset', and yield
+       an ie object for each one.  The encoded value of each yielded ie is a memoryview into 'buffer', so
+       nothing is copied until the decoded value is requested.  IEs of a type in shared_ie_types are
+       instead shared instances from the flyweight cache.  Raises ValueError on an invalid IE."""
+    view = memoryview(buffer)
+    end = len(view)
 
-        if len(stream) < length + 3:
-            raise ValueError('Asserted length of next IE value in encoded stream is ({}) but length of stream ({}) is insufficient'.format(str(length), str(len(stream))))
+    while offset < end:
+        type = view[offset]
 
-        return IE(type, stream[3:length+4])
+        if type < 128:
+            length = ie_length_table[type]
+            if length < 0:
+                raise ValueError('Type ({}) extracted from decode stream is not defined'.format(str(type)))
+            start = offset + 1
+        else:
+            if end - offset < 3:
+                raise ValueError('Type ({}) is TLV, but length of encoded stream is less than 3'.format(str(type)))
+            length = u16_packer.unpack_from(view, offset + 1)[0]
+            start = offset + 3
 
+        offset = start + length
 
-ie_tv_header_packer  = struct.Struct('B')
-ie_tlv_header_packer = struct.Struct('! B H')
+        if offset > end:
+            raise ValueError('Asserted length of next IE value in encoded stream is ({}) but length of stream ({}) is insufficient'.format(str(length), str(end - start)))
+
+        if ie_shared_table[type]:
+            yield shared_ie(type, view[start:offset])
+        else:
+            yield ie(type, view[start:offset], raw=True)
+
+
+def decode_next_IE(stream):
+    """From an incoming stream, decode the next IE.  Return a gtp.IE object, or None if the 'stream' length is 0.
+       Raises an exception on an invalid IE."""
+    return gtpcodec.first_IE(iter_IEs(stream))
+
+
+_undecoded = gtpcodec.undecoded
 
-class ie:
+class ie(object):
     """GTP Information Element."""
 
+    __slots__ = ('_type', '_length', '_encoded_length', '_encoded_value', '_decoded_value')
+
     def __init__(self, type, value, **kwargs):
         """Set raw=True if passed 'value' is raw encoding.  Otherwise, an attempt
            is made to convert the provided value to the corresponding raw value (e.g., if value expected is
-           uint32, and value is 1234, that number will be encoded as a 4-byte unsigned integer)."""
+           uint32, and value is 1234, that number will be encoded as a 4-byte unsigned integer).  A raw
+           value is not decoded until decoded_value() is first called."""
 
-        if isinstance(type, (int, long)):
+        if isinstance(type, integer_types):
             if type < 0 or type > 255:
                 raise ValueError('IE type must be unsigned 8-bit integer')
             self._type = type
@@ -371,28 +278,29 @@ class ie:
             else:
                 raise ValueError('Provided IE type ({}) not understood'.format(type))
 
-        if 'raw' in kwargs and kwargs['raw']:
-            self._encoded_value = value
-            self._decoded_value = ie_decoders[ie_types[self._type]](value)
+        encoder = ie_encoder_table[self._type]
+
+        if encoder is None:
+            raise ValueError('IE type unknown')
+
+        if kwargs.get('raw'):
+            self._decoded_value = _undecoded
         else:
             self._decoded_value = value
-            self._encoded_value = ie_encoders[ie_types[self._type]](value)
-
-            if self._type in ie_types:
-                value = ie_encoders[ie_types[self._type]](value)
+            value = encoder(value)
 
         self._encoded_value = value
 
-        if self._type < 128:
-            if self._type in ie_type_length:
-                self._length = ie_type_length[self._type]
+        length = ie_length_table[self._type]
 
-                if len(value) != self._length:
-                    raise ValueError('IE length for type {} is {} but provided value length is {}'.format(str(self._type), str(self._length), str(len(value))))
+        if length >= 0:
+            if len(value) != length:
+                raise ValueError('IE length for type {} is {} but provided value length is {}'.format(str(self._type), str(length), str(len(value))))
 
-                self.encoded_length = self._length + 1
-            else:
-                raise ValueError('IE type unknown')
+            self._length = length
+            self._encoded_length = length + 1
+        elif self._type < 128:
+            raise ValueError('IE type unknown')
         else:
             self._length = len(value)
             self._encoded_length = self._length + 3
@@ -414,13 +322,20 @@ class ie:
 
 
     def encoded_value(self):
-        """The IE value when it is encoded"""
+        """The IE value when it is encoded.  For an IE produced by iter_IEs(), this is a memoryview
+           into the decoded buffer"""
         return self._encoded_value
 
 
     def decoded_value(self):
         """The decoded IE value.  Number types are represented as an integer.  String types are
            represented as an ASCII string.  Octetstrings are left undecoded."""
+        if self._decoded_value is _undecoded:
+            packer = ie_struct_table[self._type]
+            if packer is not None:
+                self._decoded_value = packer.unpack(self._encoded_value)[0]
+            else:
+                self._decoded_value = ie_decoder_table[self._type](self._encoded_value)
         return self._decoded_value
 
     # XXX: type 238 is extensible, and has a different format from TV and TLV IEs,
@@ -433,86 +348,466 @@ class ie:
             return ie_tlv_header_packer.pack(self._type, self._length) + self._encoded_value
 
 
-message_name_to_type = {
-    'Echo Request': 1,
-    'Echo Response': 2,
-    'Version Not Supported': 3,
-    'Node Alive Request': 4,
-    'Node Alive Response': 5,
-    'Redirection Request': 6,
-    'Redirection Response': 7,
-    'Create PDP Context Request': 16,
-    'Create PDP Context Response': 17,
-    'Update PDP Context Request': 18,
-    'Update PDP Context Response': 19,
-    'Delete PDP Context Request': 20,
-    'Delete PDP Context Response': 21,
-    'Initiate PDP Context Activation Request': 22,
-    'Initiate PDP Context Activation Response': 23,
-    'Error Indication': 26,
-    'PDU Notification Request': 27,
-    'PDU Notification Response': 28,
-    'PDU Notification Reject Request': 29,
-    'PDU Notification Reject Response': 30,
-    'Supported Extension Headers Notification': 31,
-    'Send Routeing Information for GPRS Request': 32,
-    'Send Routeing Information for GPRS Response': 33,
-    'Failure Report Request': 34,
-    'Failure Report Response': 35,
-    'Note MS GPRS Present Request': 36,
-    'Note MS GPRS Present Response': 37,
-    'Identification Request': 48,
-    'Identification Response': 49,
-    'SGSN Context Request': 50,
-    'SGSN Context Response': 51,
-    'SGSN Context Acknowledge': 52,
-    'Forward Relocation Request': 53,
-    'Forward Relocation Response': 54,
-    'Forward Relocation Complete': 55,
-    'Relocation Cancel Request': 56,
-    'Relocation Cancel Response': 57,
-    'Forward SRNS Context': 58,
-    'Forward Relocation Complete Acknowledge': 59,
-    'Forward SRNS Context Acknowledge': 60,
-    'UE Registration Query Request': 61,
-    'UE Registration Query Response': 62,
-    'RAN Information Relay': 70,
-    'MBMS Notification Request': 96,
-    'MBMS Notification Response': 97,
-    'MBMS Notification Reject Request': 98,
-    'MBMS Notification Reject Response': 99,
-    'Create MBMS Context Request': 100,
-    'Create MBMS Context Response': 101,
-    'Update MBMS Context Request': 102,
-    'Update MBMS Context Response': 103,
-    'Delete MBMS Context Request': 104,
-    'Delete MBMS Context Response': 105,
-    'MBMS Registration Request': 112,
-    'MBMS Registration Response': 113,
-    'MBMS De-Registration Request': 114,
-    'MBMS De-Registration Response': 115,
-    'MBMS Session Start Request': 116,
-    'MBMS Session Start Response': 117,
-    'MBMS Session Stop Request': 118,
-    'MBMS Session Stop Response': 119,
-    'MBMS Session Update Request': 120,
-    'MBMS Session Update Response': 121,
-    'MS Info Change Notification Request': 128,
-    'MS Info Change Notification Response': 129,
-    'Data Record Transfer Request': 240,
-    'Data Record Transfer Response': 241,
-    'End Marker': 254,
-    'G-PDU': 255,
-}
+    def encode_into(self, buf, offset=0):
+        """Encode the IE (header and value) into the writable buffer 'buf' starting at 'offset'.  Return
+           the offset immediately following the encoded IE."""
+        if self._type < 128:
+            buf[offset] = self._type
+            offset += 1
+        else:
+            ie_tlv_header_packer.pack_into(buf, offset, self._type, self._length)
+            offset += 3
+
+        end = offset + self._length
+        buf[offset:end] = self._encoded_value
+        return end
+
+
+# Cache of shared ie instances for types in shared_ie_types, keyed by (type, encoded value).  The
+# cache stops growing at shared_ie_cache_limit entries; past that, shared_ie() returns new instances.
+shared_ie_cache = {}
+shared_ie_cache_limit = 4096
+
+def shared_ie(type, value):
+    """Return a shared, immutable ie for the raw encoded 'value', creating it on first use.  Suitable for
+       IEs that repeat constantly with the same value, such as Recovery and Cause; the cached ie holds
+       its own copy of 'value', never a view into a caller's buffer."""
+    key = (type, bytes(value))
+    shared = shared_ie_cache.get(key)
+
+    if shared is None:
+        shared = ie(type, key[1], raw=True)
+        if len(shared_ie_cache) < shared_ie_cache_limit:
+            shared_ie_cache[key] = shared
+
+    return shared
+
+
+
+
+
+
+# flags, message type, length, TEID
+v1_header_struct = struct.Struct('! B B H I')
+# sequence number, N-PDU number, next extension header type
+v1_optional_header_struct = struct.Struct('! H B B')
+
+
+# Extension header types (3GPP TS 29.281 5.2.1)
+EXTENSION_SERVICE_CLASS_INDICATOR = 0x20
+EXTENSION_UDP_PORT = 0x40
+EXTENSION_RAN_CONTAINER = 0x81
+EXTENSION_LONG_PDCP_PDU_NUMBER = 0x82
+EXTENSION_XW_RAN_CONTAINER = 0x83
+EXTENSION_NR_RAN_CONTAINER = 0x84
+EXTENSION_PDU_SESSION_CONTAINER = 0x85
+EXTENSION_PDCP_PDU_NUMBER = 0xc0
+
+# PDU type (0 for downlink, 1 for uplink), QoS Flow Identifier, Reflective QoS Indicator and Paging
+# Policy Indicator; the last two are None where the PDU type or flags do not carry them
+PDUSessionContainer = collections.namedtuple('PDUSessionContainer', ('pdu_type', 'qfi', 'rqi', 'ppi'))
+
+def decode_u16_extension(v): return u16_packer.unpack_from(v, 0)[0]
+def decode_long_pdcp_pdu_number(v): return ((v[0] & 0x03) << 16) | u16_packer.unpack_from(v, 1)[0]
+
+def decode_pdu_session_container(v):
+    pdu_type = v[0] >> 4
+    if pdu_type == 0:
+        # the PPI follows the flags octet when the PPP flag is set
+        if v[1] & 0x80 and len(v) < 3:
+            raise ValueError('PDU Session Container with PPP flag set is too short ({})'.format(str(len(v))))
+        return PDUSessionContainer(0, v[1] & 0x3f, (v[1] >> 6) & 0x01, v[2] >> 5 if v[1] & 0x80 else None)
+    return PDUSessionContainer(pdu_type, v[1] & 0x3f, None, None)
+
+
+def encode_u16_extension(v): return u16_packer.pack(v)
+def encode_long_pdcp_pdu_number(v): return bytes(((v >> 16) & 0x03, (v >> 8) & 0xff, v & 0xff, 0, 0, 0))
+
+def encode_pdu_session_container(v):
+    if v.pdu_type == 0:
+        if v.ppi is not None:
+            return bytes((0, 0x80 | ((v.rqi or 0) << 6) | v.qfi, v.ppi << 5, 0, 0, 0))
+        return bytes((0, ((v.rqi or 0) << 6) | v.qfi))
+    return bytes((v.pdu_type << 4, v.qfi))
+
+
+# Flat per-type tables of extension header content codecs, indexed by extension header type.  A type
+# with no entry is handed back (and must be given) as its raw content.
+extension_header_decoders = [None] * 256
+extension_header_encoders = [None] * 256
+
+def register_extension_header(type, decoder, encoder):
+    """Set the codec for the content of extension headers of 'type'.  'decoder' takes a memoryview of
+       the content (without the length and next type octets); 'encoder' returns the encoded content,
+       whose length must be two less than a multiple of four."""
+    extension_header_decoders[type] = decoder
+    extension_header_encoders[type] = encoder
+
+register_extension_header(EXTENSION_UDP_PORT, decode_u16_extension, encode_u16_extension)
+register_extension_header(EXTENSION_PDCP_PDU_NUMBER, decode_u16_extension, encode_u16_extension)
+register_extension_header(EXTENSION_LONG_PDCP_PDU_NUMBER, decode_long_pdcp_pdu_number, encode_long_pdcp_pdu_number)
+register_extension_header(EXTENSION_PDU_SESSION_CONTAINER, decode_pdu_session_container, encode_pdu_session_container)
+
+
+def skip_extension_headers(buffer, offset, next_type, end):
+    """Walk the extension header chain starting at 'offset' in 'buffer', where 'next_type' is the
+       next extension header type from the optional header fields, and return the offset following the
+       last extension header.  Nothing is copied or allocated.  Raises ValueError if the chain is
+       malformed or runs past 'end'."""
+    # each extension header is a multiple of four octets, the first of which is its length in units
+    # of four octets and the last of which is the next type
+    while next_type:
+        if offset >= end or buffer[offset] == 0:
+            raise ValueError('Extension header chain in encoded stream is truncated or malformed')
+        offset += buffer[offset] * 4
+        if offset > end:
+            raise ValueError('Extension header chain in encoded stream runs past end of message')
+        next_type = buffer[offset - 1]
+    return offset
+
+
+def iter_extension_headers(chain, next_type):
+    """Yield (type, content) for each extension header in the encoded 'chain' (a memoryview), where
+       'next_type' is the type of the first header and 'content' is a memoryview of the header without
+       its length and next type octets"""
+    offset = 0
+    while next_type:
+        end = offset + chain[offset] * 4
+        yield (next_type, chain[offset + 1:end - 1])
+        next_type = chain[end - 1]
+        offset = end
+
+
+def encode_extension_headers(headers):
+    """Encode a sequence of (type, content) as an extension header chain.  'content' is encoded with
+       extension_header_encoders when the type has an encoder and 'content' is not already bytes-like.
+       Return (type of the first header, encoded chain)."""
+    chain = bytearray()
+    types = [type for (type, content) in headers] + [0]
+
+    for (i, (type, content)) in enumerate(headers):
+        encoder = extension_header_encoders[type]
+        if encoder is not None and not isinstance(content, (bytes, bytearray, memoryview)):
+            content = encoder(content)
+        if (len(content) + 2) % 4:
+            raise ValueError('Extension header type ({}) content length ({}) is not two less than a multiple of four'.format(str(type), str(len(content))))
+        chain.append((len(content) + 2) // 4)
+        chain += content
+        chain.append(types[i + 1])
+
+    return (types[0], bytes(chain))
+
+class v1message(object):
+    """GTPv1 message"""
+
+    __slots__ = ('_type', '_teid', '_sequence_number', '_n_pdu_number', '_next_extension_type', '_extension_headers',
+                 '_ies', '_ie_view', '_ie_index', '_encoded_length')
+
+    def __init__(self, type, teid=0, sequence_number=None, n_pdu_number=None, IEs=(), extension_headers=()):
+        """'extension_headers' is a sequence of (extension header type, content), encoded as for
+           encode_extension_headers()"""
+        if isinstance(type, integer_types):
+            if type < 0 or type > 255:
+                raise ValueError('GTP message type must be unsigned 8-bit integer')
+            self._type = type
+        else:
+            if type in message_name_to_type:
+                self._type = message_name_to_type[type]
+            else:
+                raise ValueError('Provided message type ({}) not understood'.format(type))
+
+        self._teid = teid
+        self._sequence_number = sequence_number
+        self._n_pdu_number = n_pdu_number
+        self._next_extension_type = 0
+        self._extension_headers = None
+        self._ies = IEs
+        self._ie_view = None
+        self._ie_index = None
+
+        self._encoded_length = 8
+
+        if extension_headers:
+            (self._next_extension_type, self._extension_headers) = encode_extension_headers(extension_headers)
+            self._encoded_length += 4 + len(self._extension_headers)
+        elif sequence_number is not None or n_pdu_number is not None:
+            self._extension_headers = b''
+            self._encoded_length += 4
+
+        for ie in IEs:
+            self._encoded_length += ie.encoded_length()
+
+
+    def type(self):
+        """The message type as an integer"""
+        return self._type
+
+
+    def teid(self):
+        """The TEID as an integer"""
+        return self._teid
+
+
+    def sequence_number(self):
+        """The message sequence number as an integer, or None if the message carries no sequence number"""
+        return self._sequence_number
+
+
+    def n_pdu_number(self):
+        """The N-PDU number as an integer, or None if the message carries no N-PDU number"""
+        return self._n_pdu_number
+
+
+    def next_extension_type(self):
+        """The type of the first extension header, or 0 if there are none"""
+        return self._next_extension_type
 
 
+    def extension_headers(self):
+        """Yield (type, content) for each extension header, in order, where 'content' is a memoryview
+           of the encoded header content.  The chain is walked as this is iterated."""
+        if self._next_extension_type:
+            return iter_extension_headers(memoryview(self._extension_headers), self._next_extension_type)
+        return iter(())
+
+
+    def get_extension_header(self, type):
+        """The content of the first extension header with the given type, decoded with
+           extension_header_decoders if the type has a decoder (e.g., the UDP port as an integer, or a
+           PDUSessionContainer), otherwise as a memoryview; or None if there is no such header"""
+        for (header_type, content) in self.extension_headers():
+            if header_type == type:
+                decoder = extension_header_decoders[type]
+                return decoder(content) if decoder is not None else content
+        return None
+
+
+    def IEs(self):
+        """A list of Information Elements attached to this message, in order.  For a decoded message,
+           the IEs are decoded the first time this (or get_IE()) is called"""
+        if self._ies is None:
+            self._ies = tuple(iter_IEs(self._ie_view))
+        return self._ies
+
+
+    def get_IE(self, type):
+        """The first IE attached to this message with the given type, or None if there is no such IE"""
+        if self._ie_index is None:
+            index = {}
+            for ie in self.IEs():
+                index.setdefault(ie.type(), ie)
+            self._ie_index = index
+        return self._ie_index.get(type)
+
+
+    def encoded_length(self):
+        """The total length (in octets) of this message when encoded"""
+        return self._encoded_length
+
+
+    def encode(self):
+        """Encode the message (header and all IEs) into a single newly allocated bytearray"""
+        buf = bytearray(self._encoded_length)
+        self.encode_into(buf, 0)
+        return buf
+
+
+    def encode_into(self, buf, offset=0):
+        """Encode the message (header and all IEs) into the writable buffer 'buf' (e.g., a reused
+           bytearray) starting at 'offset'.  Return the offset immediately following the encoded
+           message.  Raises ValueError if 'buf' is too short to hold the message."""
+        if len(buf) - offset < self._encoded_length:
+            raise ValueError('Buffer has ({}) octets available but encoded message length is ({})'.format(str(len(buf) - offset), str(self._encoded_length)))
+
+        flags = 0x30
+        if self._next_extension_type:
+            flags |= 0x04
+        if self._sequence_number is not None:
+            flags |= 0x02
+        if self._n_pdu_number is not None:
+            flags |= 0x01
+
+        # the header length field does not count the mandatory eight octets
+        v1_header_struct.pack_into(buf, offset, flags, self._type, self._encoded_length - 8, self._teid)
+        offset += 8
+
+        if self._extension_headers is not None:
+            v1_optional_header_struct.pack_into(buf, offset, self._sequence_number or 0, self._n_pdu_number or 0, self._next_extension_type)
+            offset += 4
+            end = offset + len(self._extension_headers)
+            buf[offset:end] = self._extension_headers
+            offset = end
+
+        if self._ies is None:
+            # decoded message whose IEs were never touched; copy them through as-is
+            end = offset + len(self._ie_view)
+            buf[offset:end] = self._ie_view
+            return end
+
+        for ie in self._ies:
+            offset = ie.encode_into(buf, offset)
+
+        return offset
+
+
+    @classmethod
+    def decode(cls, buffer, offset=0):
+        """Decode a GTPv1 message from 'buffer' (bytes, bytearray or memoryview) starting at 'offset'.
+           Only the header (including any extension headers) is parsed and validated here; IEs are left
+           as a view into 'buffer' and are decoded only when IEs() or get_IE() is first called.  Raises
+           ValueError on an invalid header."""
+        view = memoryview(buffer)
+        available = len(view) - offset
+
+        if available < 8:
+            raise ValueError('Length of encoded stream ({}) is less than a GTPv1 header'.format(str(available)))
+
+        (flags, type, length, teid) = v1_header_struct.unpack_from(view, offset)
+
+        if flags >> 5 != 1:
+            raise ValueError('GTP version ({}) in encoded stream is not 1'.format(str(flags >> 5)))
+
+        if not flags & 0x10:
+            raise ValueError('Protocol type in encoded stream is GTP\' rather than GTP')
+
+        if length + 8 > available:
+            raise ValueError('Asserted length of message in encoded stream is ({}) but length of stream ({}) is insufficient'.format(str(length + 8), str(available)))
+
+        end = offset + length + 8
+        ie_offset = offset + 8
+
+        message = cls.__new__(cls)
+        message._type = type
+        message._teid = teid
+        message._sequence_number = None
+        message._n_pdu_number = None
+        message._next_extension_type = 0
+        message._extension_headers = None
+        message._encoded_length = length + 8
+        message._ies = None
+        message._ie_index = None
+
+        if flags & 0x07:
+            if length < 4:
+                raise ValueError('E, S or PN flag is set but asserted message length ({}) is too short'.format(str(length + 8)))
+
+            (sequence_number, n_pdu_number, next_type) = v1_optional_header_struct.unpack_from(view, ie_offset)
+            ie_offset += 4
+
+            if flags & 0x02:
+                message._sequence_number = sequence_number
+            if flags & 0x01:
+                message._n_pdu_number = n_pdu_number
+
+            extension_offset = ie_offset
+
+            if flags & 0x04:
+                message._next_extension_type = next_type
+                ie_offset = skip_extension_headers(view, ie_offset, next_type, end)
+
+            message._extension_headers = view[extension_offset:ie_offset]
+
+        message._ie_view = view[ie_offset:end]
+
+        return message
+
+
+
+class v1template(object):
+    """A GTPv1 message encoded once, from which copies are stamped out by patching the TEID, the
+       sequence number and the values of selected IEs in place.  'fields' lists the IE types whose
+       values are patchable; the first IE of each type in the message is used."""
+
+    __slots__ = ('_buffer', '_has_sequence_number', '_fields')
+
+    def __init__(self, message, fields=()):
+        self._buffer = message.encode()
+        self._has_sequence_number = message.sequence_number() is not None
+        self._fields = tuple(self._locate(message, type) for type in fields)
+
+
+    def _locate(self, message, type):
+        offset = len(self._buffer) - sum(i.encoded_length() for i in message.IEs())
+        for i in message.IEs():
+            header_length = 1 if i.type() < 128 else 3
+            if i.type() == type:
+                return (offset + header_length, offset + header_length + i.value_length())
+            offset += i.encoded_length()
+        raise ValueError('Template message has no IE of type ({})'.format(str(type)))
+
+
+    def encoded_length(self):
+        """The length (in octets) of each stamped message"""
+        return len(self._buffer)
+
+
+    def stamp(self, teid, sequence_number=None, *values):
+        """Patch the TEID, the sequence number (if not None) and, in 'fields' order, the raw encoded values
+           of the patchable IEs into the template's own buffer and return that buffer.  A field whose value
+           is omitted or None keeps whatever was last stamped.  The same bytearray is returned (and
+           overwritten) on every call."""
+        self._patch(self._buffer, 0, teid, sequence_number, values)
+        return self._buffer
+
+
+    def stamp_into(self, buf, offset, teid, sequence_number=None, *values):
+        """As stamp(), but copy the message into the writable buffer 'buf' at 'offset' and patch it there.
+           Return the offset immediately following the stamped message."""
+        end = offset + len(self._buffer)
+        if end > len(buf):
+            raise ValueError('Buffer has ({}) octets available but template length is ({})'.format(str(len(buf) - offset), str(len(self._buffer))))
+        buf[offset:end] = self._buffer
+        self._patch(buf, offset, teid, sequence_number, values)
+        return end
+
+
+    def _patch(self, buf, base, teid, sequence_number, values):
+        u32_packer.pack_into(buf, base + 4, teid)
+
+        if sequence_number is not None:
+            if not self._has_sequence_number:
+                raise ValueError('Template message has no sequence number')
+            u16_packer.pack_into(buf, base + 8, sequence_number)
+
+        for ((start, end), value) in zip(self._fields, values):
+            if value is not None:
+                if len(value) != end - start:
+                    raise ValueError('Patched value length ({}) does not match template value length ({})'.format(str(len(value)), str(end - start)))
+                buf[base + start:base + end] = value
+
+
+
+class EchoResponder(object):
+    """Answers GTPv1 (GTP-C or GTP-U) Echo Requests straight from their header octets, without running
+       the general decoder.  The Echo Response, carrying a Recovery IE with 'restart_counter' (which
+       must be 0 for GTP-U), is encoded once and only its sequence number is rewritten per request."""
+
+    __slots__ = ('_response',)
+
+    def __init__(self, restart_counter):
+        self._response = v1message(2, 0, 0, IEs=(ie(14, restart_counter),)).encode()
+
+
+    def respond(self, request):
+        """If the encoded message 'request' is a GTPv1 Echo Request, return the encoded Echo Response
+           with the same sequence number, otherwise None.  The returned bytearray is reused (and
+           overwritten) by the next call."""
+        # version 1, protocol type GTP, sequence number present, message type 1
+        if len(request) < 12 or request[1] != 1 or request[0] & 0xf2 != 0x32:
+            return None
+
+        response = self._response
+        response[8] = request[8]
+        response[9] = request[9]
+        return response
+
 
 
 class v2message:
     """GTPv2 message"""
 
     def __init__(self, type, sequence_number=0, teid=None, IEs=()):
-        if isinstance(type, (int, long)):
+        if isinstance(type, integer_types):
             if type < 0 or type > 255:
                 raise ValueError('GTP message type must be unsigned 8-bit integer')
             self._type = type
@@ -563,43 +858,191 @@ class v2message:
 
 class Test_ie(unittest.TestCase):
     def test_ie_constructor(self):
-        gie = ie(1, '\x55', raw=True)
+        gie = ie(1, b'\x55', raw=True)
         self.assertEqual(gie.type(), 1, "ie constructor(1, \\x55) type == 1")
         self.assertEqual(gie.value_length(), 1, "ie constructor(1, \\x55) length == 1")
-        self.assertEqual(gie.encoded_value(), '\x55', "ie constructor(1, \\x55) enocded_value == \\x55")
+        self.assertEqual(gie.encoded_value(), b'\x55', "ie constructor(1, \\x55) enocded_value == \\x55")
         self.assertEqual(gie.decoded_value(), 85, "ie constructor(1, \\x55) decoded_value == 85")
 
         gie = ie(1, 55)
         self.assertEqual(gie.type(), 1, "ie constructor(1, 55) type == 1")
         self.assertEqual(gie.value_length(), 1, "ie constructor(1, 55) length == 1")
-        self.assertEqual(gie.encoded_value(), '\x37', "ie constructor(1, 55) enocded_value == \\x37")
+        self.assertEqual(gie.encoded_value(), b'\x37', "ie constructor(1, 55) enocded_value == \\x37")
         self.assertEqual(gie.decoded_value(), 55, "ie constructor(1, 55) decoded_value == 55")
 
         # ie type implicit len == 1, so value must also be length 1
         with self.assertRaises(Exception) as context:
-            gie = ie(1, '\x55\x56\x57')
+            gie = ie(1, b'\x55\x56\x57')
 
         # Unknown ie type
         with self.assertRaises(Exception) as context:
-            gie = ie(10, '\x55', raw=True)
+            gie = ie(10, b'\x55', raw=True)
 
-        gie = ie(128, '\x55\x56\x57')
+        gie = ie('IMSI', '123456789012345')
+        self.assertEqual(gie.encoded_value(), b'\x21\x43\x65\x87\x09\x21\x43\xf5', "ie constructor('IMSI', digits) encodes TBCD")
+        self.assertEqual(ie(2, gie.encoded_value(), raw=True).decoded_value(), '123456789012345', "ie(2, raw=True) decoded_value is IMSI digits")
+
+        gie = ie(128, b'\x55\x56\x57')
         self.assertEqual(gie.type(), 128, "ie constructor(128, \\x55\\x56\\x57) type == 128")
         self.assertEqual(gie.value_length(), 3, "ie constructor(128, \\x55\\x56\\x57) length == 3")
-        self.assertEqual(gie.encoded_value(), '\x55\x56\x57', "ie constructor(128, \\x55\\x56\\x57) encoded_value == \\x55\\x56\\x57")
-        self.assertEqual(gie.decoded_value(), '\x55\x56\x57', "ie constructor(128, \\x55\\x56\\x57) decoded_value == \\x55\\x56\\x57")
+        self.assertEqual(gie.encoded_value(), b'\x55\x56\x57', "ie constructor(128, \\x55\\x56\\x57) encoded_value == \\x55\\x56\\x57")
+        self.assertEqual(gie.decoded_value(), b'\x55\x56\x57', "ie constructor(128, \\x55\\x56\\x57) decoded_value == \\x55\\x56\\x57")
 
-        gie = ie('IMSI', '12345678')
+        gie = ie('IMSI', b'12345678')
         self.assertEqual(gie.type(), 2, "ie constructor(ie_name_to_type('IMSI'), '12345678') type == 2")
         self.assertEqual(gie.value_length(), 8, "ie constructor(ie_name_to_type('IMSI'), '12345678') length == 8")
-        self.assertEqual(gie.encoded_value(), '12345678', "ie constructor(ie_name_to_type('IMSI'), '12345678') encoded_value == 12345678")
-        self.assertEqual(gie.decoded_value(), '12345678', "ie constructor(ie_name_to_type('IMSI'), '12345678') decoded_value == 12345678")
+        self.assertEqual(gie.encoded_value(), b'12345678', "ie constructor(ie_name_to_type('IMSI'), '12345678') encoded_value == 12345678")
+        self.assertEqual(gie.decoded_value(), b'12345678', "ie constructor(ie_name_to_type('IMSI'), '12345678') decoded_value == 12345678")
 
 
     def test_ie_encode(self):
         e = ie(1, 5).encode()
-        self.assertEqual(e, '\x01\x05', "ie(1, 5) encode is two bytes (0x02 0x05)")
-        self.assertEqual(ie(251, '\x7f\x00\x00\x01', raw=True).encode(), '\xfb\x00\x04\x7f\x00\x00\x01', "ie(251, 127.0.0.1) encode is 7 bytes (0xfb 0x00 0x04 0x7f 0x00 0x00 0x01)")
+        self.assertEqual(e, b'\x01\x05', "ie(1, 5) encode is two bytes (0x02 0x05)")
+        self.assertEqual(ie(251, b'\x7f\x00\x00\x01', raw=True).encode(), b'\xfb\x00\x04\x7f\x00\x00\x01', "ie(251, 127.0.0.1) encode is 7 bytes (0xfb 0x00 0x04 0x7f 0x00 0x00 0x01)")
+
+
+    def test_ie_tables(self):
+        self.assertEqual(ie_length_table[14], 1, "Recovery is TV with length 1")
+        self.assertEqual(ie_length_table[251], -1, "Charging Gateway Address is TLV")
+        self.assertIs(ie_struct_table[17], u32_packer, "TEID Control Plane is u32")
+        self.assertIsNone(ie_encoder_table[10], "type 10 has no encoder")
+
+        ie_types[10] = "u8"
+        ie_type_length[10] = 1
+        try:
+            compile_ie_tables()
+            self.assertEqual(ie(10, 3).encode(), b'\x0a\x03', "compile_ie_tables() picks up a new type")
+        finally:
+            del ie_types[10]
+            del ie_type_length[10]
+            compile_ie_tables()
+
+
+    def test_shared_ie(self):
+        recovery = shared_ie(14, b'\x07')
+        self.assertIs(shared_ie(14, bytearray(b'\x07')), recovery, "shared_ie(14, \x07) is a shared instance")
+        self.assertIs(decode_next_IE(b'\x0e\x07'), recovery, "decoded Recovery is the shared instance")
+        self.assertIsNot(decode_next_IE(b'\x14\x07'), shared_ie(20, b'\x07'), "decoded NSAPI is not shared")
+
+
+    def test_iter_IEs(self):
+        stream = bytearray(b'\x00\x00' + ie(1, 5).encode() + ie(14, 7).encode() + ie(251, b'\x7f\x00\x00\x01', raw=True).encode())
+
+        ies = list(iter_IEs(stream, 2))
+        self.assertEqual([i.type() for i in ies], [1, 14, 251], "iter_IEs() yields IE types in order")
+        self.assertEqual([i.decoded_value() for i in ies], [5, 7, b'\x7f\x00\x00\x01'], "iter_IEs() yields decoded values")
+        self.assertEqual(ies[2].encoded_length(), 7, "iter_IEs() TLV encoded_length == 7")
+
+        # values are views into the original buffer, not copies
+        self.assertIsInstance(ies[2].encoded_value(), memoryview, "iter_IEs() value is a memoryview")
+        stream[-1] = 2
+        self.assertEqual(bytes(ies[2].encoded_value()), b'\x7f\x00\x00\x02', "iter_IEs() value tracks the underlying buffer")
+
+        self.assertEqual(decode_next_IE(b'\x0e\x07').decoded_value(), 7, "decode_next_IE(\\x0e\\x07) is Recovery 7")
+        self.assertIsNone(decode_next_IE(b''), "decode_next_IE('') is None")
+
+        # TLV length runs past the end of the stream
+        with self.assertRaises(ValueError) as context:
+            list(iter_IEs(b'\xfb\x00\x04\x7f\x00'))
+
+        # TV type that is not defined
+        with self.assertRaises(ValueError) as context:
+            list(iter_IEs(b'\x0a\x00'))
+
+class Test_v1message(unittest.TestCase):
+    def test_decode(self):
+        ies = ie(1, 128).encode() + ie(14, 7).encode()
+        encoded = b'\x32\x11' + u16_packer.pack(4 + len(ies)) + b'\xde\xad\xbe\xef\x12\x34\x00\x00' + ies
+
+        m = v1message.decode(encoded)
+        self.assertEqual(m.type(), 17, "decode() type == 17")
+        self.assertEqual(m.teid(), 0xdeadbeef, "decode() teid == 0xdeadbeef")
+        self.assertEqual(m.sequence_number(), 0x1234, "decode() sequence_number == 0x1234")
+        self.assertIsNone(m.n_pdu_number(), "decode() n_pdu_number == None")
+        self.assertEqual(m.encoded_length(), len(encoded), "decode() encoded_length == length of stream")
+        self.assertIsNone(m._ies, "decode() does not decode IEs up front")
+
+        self.assertEqual(m.get_IE(14).decoded_value(), 7, "decode() get_IE(14) is Recovery 7")
+        self.assertEqual([i.type() for i in m.IEs()], [1, 14], "decode() IEs() in order")
+
+        # one 4-octet extension header (UDP Port) before the IEs
+        encoded = b'\x36\x11' + u16_packer.pack(8 + len(ies)) + b'\xde\xad\xbe\xef\x12\x34\x00\x40\x01\x08\x68\x00' + ies
+        self.assertEqual([i.type() for i in v1message.decode(encoded).IEs()], [1, 14], "decode() skips extension headers")
+
+        # re-encoding copies the extension headers and untouched IEs through
+        self.assertEqual(v1message.decode(encoded).encode(), encoded, "decode() then encode() round trips")
+        self.assertEqual(v1message.decode(v1message(16, 0xdeadbeef, 0x1234, IEs=(ie(1, 128), ie(14, 7))).encode()).IEs()[1].decoded_value(), 7, "encode() then decode() round trips")
+
+        # wrong version
+        with self.assertRaises(ValueError) as context:
+            v1message.decode(b'\x52\x01\x00\x04\x00\x00\x00\x00\x00\x01\x00\x00')
+
+        # asserted length runs past the end of the stream
+        with self.assertRaises(ValueError) as context:
+            v1message.decode(encoded[:-1])
+
+
+    def test_extension_headers(self):
+        qfi = PDUSessionContainer(0, 9, 1, 3)
+        m = v1message(255, 0x1234, extension_headers=((EXTENSION_UDP_PORT, 2152), (EXTENSION_PDU_SESSION_CONTAINER, qfi), (0x20, b'\x05\x00')))
+        encoded = m.encode()
+        self.assertEqual(encoded[:16], b'\x34\xff\x00\x14\x00\x00\x12\x34\x00\x00\x00\x40\x01\x08\x68\x85', "encode() with extension headers")
+        self.assertEqual(len(encoded), 8 + 4 + 4 + 8 + 4, "encode() length with extension headers")
+
+        m = v1message.decode(encoded)
+        self.assertEqual(m.next_extension_type(), EXTENSION_UDP_PORT, "decode() next_extension_type")
+        self.assertEqual([type for (type, content) in m.extension_headers()], [0x40, 0x85, 0x20], "extension_headers() walks the chain")
+        self.assertEqual(m.get_extension_header(EXTENSION_UDP_PORT), 2152, "UDP Port extension header")
+        self.assertEqual(m.get_extension_header(EXTENSION_PDU_SESSION_CONTAINER), qfi, "PDU Session Container extension header")
+        self.assertEqual(bytes(m.get_extension_header(0x20)), b'\x05\x00', "extension header without decoder is raw")
+        self.assertIsNone(m.get_extension_header(EXTENSION_PDCP_PDU_NUMBER), "absent extension header")
+        self.assertEqual(v1message.decode(v1message(255, 1, extension_headers=((EXTENSION_LONG_PDCP_PDU_NUMBER, 0x3abcd),)).encode()).get_extension_header(EXTENSION_LONG_PDCP_PDU_NUMBER), 0x3abcd, "Long PDCP PDU Number round trip")
+        self.assertEqual(v1message(255, 1, extension_headers=((EXTENSION_PDU_SESSION_CONTAINER, PDUSessionContainer(1, 5, None, None)),)).encode()[12:16], b'\x01\x10\x05\x00', "uplink PDU Session Container")
+
+        with self.assertRaises(ValueError) as context:
+            v1message(255, 1, extension_headers=((0x20, b'\x05'),))
+
+        # PPP flag set but no room for the PPI
+        m = v1message.decode(v1message(255, 1, extension_headers=((EXTENSION_PDU_SESSION_CONTAINER, b'\x00\x89'),)).encode())
+        with self.assertRaises(ValueError) as context:
+            m.get_extension_header(EXTENSION_PDU_SESSION_CONTAINER)
+
+
+class Test_v1template(unittest.TestCase):
+    def test_stamp(self):
+        teid_c = ie(17, 0x1111)
+        t = v1template(v1message(17, 0, 0, IEs=(ie(1, 128), teid_c, ie(14, 7))), fields=(1, 17))
+        self.assertEqual(t.encoded_length(), 12 + 2 + 5 + 2, "v1template encoded_length")
+
+        expected = v1message(17, 0xdeadbeef, 0x1234, IEs=(ie(1, 192), ie(17, 0x2222), ie(14, 7))).encode()
+        self.assertEqual(t.stamp(0xdeadbeef, 0x1234, b'\xc0', b'\x00\x00\x22\x22'), expected, "stamp() patches TEID, sequence number and IEs")
+        self.assertEqual(t.stamp(0xdeadbeef, 0x1234), expected, "stamp() without values keeps the last values")
+
+        buf = bytearray(64)
+        self.assertEqual(t.stamp_into(buf, 3, 1, 2, None, b'\x00\x00\x33\x33'), 3 + t.encoded_length(), "stamp_into() returns following offset")
+        self.assertEqual(buf[3:3 + t.encoded_length()], v1message(17, 1, 2, IEs=(ie(1, 192), ie(17, 0x3333), ie(14, 7))).encode(), "stamp_into() copies then patches")
+
+        # patched value must keep the template length
+        with self.assertRaises(ValueError) as context:
+            t.stamp(1, 2, b'\xc0\x00')
+
+        # no such IE in template
+        with self.assertRaises(ValueError) as context:
+            v1template(v1message(1, 0, 0), fields=(14,))
+
+
+class Test_EchoResponder(unittest.TestCase):
+    def test_respond(self):
+        responder = EchoResponder(0)
+        response = responder.respond(v1message(1, 0, 0x1234).encode())
+        self.assertEqual(response, v1message(2, 0, 0x1234, IEs=(ie(14, 0),)).encode(), "respond() to Echo Request")
+        self.assertIs(responder.respond(v1message(1, 0, 7).encode()), response, "respond() reuses its buffer")
+        self.assertEqual(v1message.decode(response).sequence_number(), 7, "respond() copies the sequence number")
+
+        self.assertIsNone(responder.respond(v1message(2, 0, 7).encode()), "respond() ignores Echo Response")
+        self.assertIsNone(responder.respond(b'\x30\x01\x00\x04\x00\x00\x00\x00\x00\x00\x00\x00'), "respond() ignores request without sequence number")
+        self.assertIsNone(responder.respond(b'\x40\x01\x00\x04\x00\x00\x01\x00\x00\x00\x00\x00'), "respond() ignores GTPv2")
+
 
 class Test_v2message(unittest.TestCase):
     def test_constructor(self):
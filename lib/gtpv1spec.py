@@ -0,0 +1,200 @@
+# Human-readable names from 3GPP TS 29.060 for GTPv1 IE and message types.  gtpv1 exposes these
+# through gtpcodec.LazyTable, so this module is imported only when a name is first looked up.
+
+ie_name_to_type = {
+    'Cause':                                     1,
+    'IMSI':                                      2,
+    'RAI':                                       3,
+    'TLLI':                                      4,
+    'P-TMSI':                                    5,
+    'Reordering Required':                       8,
+    'Authentication Triplet':                    9,
+    'MAP Cause':                                 11,
+    'P-TMSI Signature':                          12,
+    'MS Validated':                              13,
+    'Recovery':                                  14,
+    'Selection Mode':                            15,
+    'TEID Data I':                               16,
+    'TEID Control Plane':                        17,
+    'TEID Data II':                              18,
+    'Teardown Ind':                              19,
+    'NSAPI':                                     20,
+    'RANAP Cause':                               21,
+    'RAB Context':                               22,
+    'Radio Priority SMS':                        23,
+    'Radio Priority':                            24,
+    'Packet Flow Id':                            25,
+    'Charging Characteristics':                  26,
+    'Trace Reference':                           27,
+    'Trace Type':                                28,
+    'MS Not Reachable Reason':                   29,
+    'Charging ID':                               127,
+    'End User Address':                          128,
+    'MM Context':                                129,
+    'PDP Context':                               130,
+    'APN':                                       131,
+    'Protocol Configuration Options':            132,
+    'GSN Address':                               133,
+    'MSISDN':                                    134,
+    'QoS Profile':                               135,
+    'Authentication Quintuplet':                 136,
+    'Traffic Flow Template':                     137,
+    'Target Identification':                     138,
+    'UTRAN Transparent Container':               139,
+    'RAB Setup Information':                     140,
+    'Extension Header Type List':                141,
+    'Trigger Id':                                142,
+    'OMC Identity':                              143,
+    'RAN Transparent Container':                 144,
+    'PDP Context Prioritization':                145,
+    'Additional RAB Setup Information':          146,
+    'SGSN Number':                               147,
+    'Common Flags':                              148,
+    'APN Restriction':                           149,
+    'Radio Priority LCS':                        150,
+    'RAT Type':                                  151,
+    'User Location Information':                 152,
+    'MS Time Zone':                              153,
+    'IMEI':                                      154,
+    'CAMEL Charging Information Container':      155,
+    'MBMS UE Context':                           156,
+    'TMGI':                                      157,
+    'RIM Routing Address':                       158,
+    'MBMS Protocol Configuration Options':       159,
+    'MBMS Service Area':                         160,
+    'Source RNC PDCP context info':              161,
+    'Additional Trace Info':                     162,
+    'Hop Counter':                               163,
+    'Selected PLMN ID':                          164,
+    'MBMS Session Identifier':                   165,
+    'MBMS 2G/3G Indicator':                      166,
+    'Enhanced NSAPI':                            167,
+    'MBMS Session Duration':                     168,
+    'Additional MBMS Trace Info':                169,
+    'MBMS Session Repetition Number':            170,
+    'MBMS Time To Data Transfer':                171,
+    'BSS Container':                             173,
+    'Cell Identification':                       174,
+    'PDU Numbers':                               175,
+    'BSSGP Cause':                               176,
+    'Required MBMS bearer capabilities':         177,
+    'RIM Routing Address Discriminator':         178,
+    'List of set-up PFCs':                       179,
+    'PS Handover XID Parameters':                180,
+    'MS Info Change Reporting Action':           181,
+    'Direct Tunnel Flags':                       182,
+    'Correlation-ID':                            183,
+    'Bearer Control Mode':                       184,
+    'MBMS Flow Identifier':                      185,
+    'MBMS IP Multicast Distribution':            186,
+    'MBMS Distribution Acknowledgement':         187,
+    'Reliable INTER RAT HANDOVER INFO ':         188,
+    'RFSP Index':                                189,
+    'FQDN':                                      190,
+    'Evolved Allocation/Retention Priority I':   191,
+    'Evolved Allocation/Retention Priority II':  192,
+    'Extended Common Flags':                     193,
+    'UCI':                                       194,
+    'CSG Information Reporting Action':          195,
+    'CSG ID':                                    196,
+    'CMI':                                       197,
+    'AMBR':                                      198,
+    'UE Network Capability':                     199,
+    'UE-AMBR':                                   200,
+    'APN-AMBR with NSAPI':                       201,
+    'GGSN Back-Off Time':                        202,
+    'Signalling Priority Indication':            203,
+    'Signalling Priority Indication with NSAPI': 204,
+    'Higher bitrates than 16 Mbps flag':         205,
+    'Additional MM context for SRVCC':           207,
+    'Additional flags for SRVCC':                208,
+    'STN-SR':                                    209,
+    'C-MSISDN':                                  210,
+    'Extended RANAP Cause':                      211,
+    'eNodeB ID':                                 212,
+    'Selection Mode with NSAPI':                 213,
+    'ULI Timestamp':                             214,
+    'Local Home Network ID (LHN-ID) with NSAPI': 215,
+    'CN Operator Selection Entity    ':          216,
+    'UE Usage Type':                             217,
+    'Extended Common Flags II':                  218,
+    'Node Identifier ':                          219,
+    'CIoT Optimizations Support Indication':     220,
+    'SCEF PDN Connection':                       221,
+    'IOV_updates counter':                       222,
+    'Special IE type for IE Type Extension':     238,
+    'Charging Gateway Address':                  251,
+}
+
+
+message_name_to_type = {
+    'Echo Request': 1,
+    'Echo Response': 2,
+    'Version Not Supported': 3,
+    'Node Alive Request': 4,
+    'Node Alive Response': 5,
+    'Redirection Request': 6,
+    'Redirection Response': 7,
+    'Create PDP Context Request': 16,
+    'Create PDP Context Response': 17,
+    'Update PDP Context Request': 18,
+    'Update PDP Context Response': 19,
+    'Delete PDP Context Request': 20,
+    'Delete PDP Context Response': 21,
+    'Initiate PDP Context Activation Request': 22,
+    'Initiate PDP Context Activation Response': 23,
+    'Error Indication': 26,
+    'PDU Notification Request': 27,
+    'PDU Notification Response': 28,
+    'PDU Notification Reject Request': 29,
+    'PDU Notification Reject Response': 30,
+    'Supported Extension Headers Notification': 31,
+    'Send Routeing Information for GPRS Request': 32,
+    'Send Routeing Information for GPRS Response': 33,
+    'Failure Report Request': 34,
+    'Failure Report Response': 35,
+    'Note MS GPRS Present Request': 36,
+    'Note MS GPRS Present Response': 37,
+    'Identification Request': 48,
+    'Identification Response': 49,
+    'SGSN Context Request': 50,
+    'SGSN Context Response': 51,
+    'SGSN Context Acknowledge': 52,
+    'Forward Relocation Request': 53,
+    'Forward Relocation Response': 54,
+    'Forward Relocation Complete': 55,
+    'Relocation Cancel Request': 56,
+    'Relocation Cancel Response': 57,
+    'Forward SRNS Context': 58,
+    'Forward Relocation Complete Acknowledge': 59,
+    'Forward SRNS Context Acknowledge': 60,
+    'UE Registration Query Request': 61,
+    'UE Registration Query Response': 62,
+    'RAN Information Relay': 70,
+    'MBMS Notification Request': 96,
+    'MBMS Notification Response': 97,
+    'MBMS Notification Reject Request': 98,
+    'MBMS Notification Reject Response': 99,
+    'Create MBMS Context Request': 100,
+    'Create MBMS Context Response': 101,
+    'Update MBMS Context Request': 102,
+    'Update MBMS Context Response': 103,
+    'Delete MBMS Context Request': 104,
+    'Delete MBMS Context Response': 105,
+    'MBMS Registration Request': 112,
+    'MBMS Registration Response': 113,
+    'MBMS De-Registration Request': 114,
+    'MBMS De-Registration Response': 115,
+    'MBMS Session Start Request': 116,
+    'MBMS Session Start Response': 117,
+    'MBMS Session Stop Request': 118,
+    'MBMS Session Stop Response': 119,
+    'MBMS Session Update Request': 120,
+    'MBMS Session Update Response': 121,
+    'MS Info Change Notification Request': 128,
+    'MS Info Change Notification Response': 129,
+    'Data Record Transfer Request': 240,
+    'Data Record Transfer Response': 241,
+    'End Marker': 254,
+    'G-PDU': 255,
+}
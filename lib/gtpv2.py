@@ -1,197 +1,82 @@
 import unittest
+import collections
+import socket
 import struct
 
-ie_name_to_type = {
-    'International Mobile Subscriber Identity (IMSI)': 1,
-    'IMSI': 1,
-    'Cause': 2,
-    'Recovery (Restart Counter)': 3,
-    'Recovery': 3,
-    'STN-SR': 51,
-    'Access Point Name (APN)': 71,
-    'APN': 71,
-    'Aggregate Maximum Bit Rate (AMBR)': 72,
-    'AMBR': 72,
-    'EPS Bearer ID (EBI)': 73,
-    'EBI': 73,
-    'IP Address': 74,
-    'Mobile Equipment Identity (MEI)': 75,
-    'MEI': 75,
-    'MSISDN': 76,
-    'Indication': 77,
-    'Protocol Configuration Options (PCO)': 78,
-    'PCO': 78,
-    'PDN Address Allocation (PAA)': 79,
-    'PAA': 79,
-    'Bearer Level Quality of Service (Bearer QoS)': 80,
-    'Bearer QoS': 80,
-    'Flow Quality of Service (Flow QoS)': 81,
-    'Flow QoS': 81,
-    'RAT Type': 82,
-    'Serving Network': 83,
-    'EPS Bearer Level Traffic Flow Template (Bearer TFT)': 84,
-    'Bearer TFT': 84,
-    'Traffic Aggregation Description (TAD)': 85,
-    'TAD': 85,
-    'User Location Information (ULI)': 86,
-    'ULI': 86,
-    'Fully Qualified Tunnel Endpoint Identifier (F-TEID)': 87,
-    'F-TEID': 87,
-    'TMSI': 88,
-    'Global CN-Id': 89,
-    'S103 PDN Data Forwarding Info (S103PDF)': 90,
-    'S103PDF': 90,
-    'S1-U Data Forwarding Info (S1UDF)': 91,
-    'S1UDF': 91,
-    'Delay Value': 92,
-    'Bearer Context ': 93,
-    'Charging ID': 94,
-    'Charging Characteristics': 95,
-    'Trace Information': 96,
-    'Bearer Flags': 97,
-    'PDN Type': 99,
-    'Procedure Transaction ID': 100,
-    'MM Context (GSM Key and Triplets)': 103,
-    'MM Context (UMTS Key, Used Cipher and Quintuplets)': 104,
-    'MM Context (GSM Key, Used Cipher and Quintuplets)': 105,
-    'MM Context (UMTS Key and Quintuplets)': 106,
-    'MM Context (EPS Security Context, Quadruplets and Quintuplets)': 107,
-    'MM Context (UMTS Key, Quadruplets and Quintuplets)': 108,
-    'PDN Connection': 109,
-    'PDU Numbers': 110,
-    'P-TMSI': 111,
-    'P-TMSI Signature': 112,
-    'Hop Counter': 113,
-    'UE Time Zone': 114,
-    'Trace Reference': 115,
-    'Complete Request Message': 116,
-    'GUTI': 117,
-    'F-Container': 118,
-    'F-Cause': 119,
-    'PLMN ID': 120,
-    'Target Identification': 121,
-    'Packet Flow ID ': 123,
-    'RAB Context ': 124,
-    'Source RNC PDCP Context Info': 125,
-    'Port Number': 126,
-    'APN Restriction': 127,
-    'Selection Mode': 128,
-    'Source Identification': 129,
-    'Change Reporting Action': 131,
-    'Fully Qualified PDN Connection Set Identifier (FQ-CSID)': 132,
-    'FQ-CSID': 132,
-    'Channel needed': 133,
-    'eMLPP Priority': 134,
-    'Node Type': 135,
-    'Fully Qualified Domain Name (FQDN)': 136,
-    'FQDN': 136,
-    'Transaction Identifier (TI)': 137,
-    'TI': 137,
-    'MBMS Session Duration': 138,
-    'MBMS Service Area': 139,
-    'MBMS Session Identifier': 140,
-    'MBMS Flow Identifier': 141,
-    'MBMS IP Multicast Distribution': 142,
-    'MBMS Distribution Acknowledge': 143,
-    'RFSP Index': 144,
-    'User CSG Information (UCI)': 145,
-    'UCI': 145,
-    'CSG Information Reporting Action': 146,
-    'CSG ID': 147,
-    'CSG Membership Indication (CMI)': 148,
-    'CMI': 148,
-    'Service indicator': 149,
-    'Detach Type': 150,
-    'Local Distiguished Name (LDN)': 151,
-    'LDN': 151,
-    'Node Features': 152,
-    'MBMS Time to Data Transfer': 153,
-    'Throttling': 154,
-    'Allocation/Retention Priority (ARP)': 155,
-    'ARP': 155,
-    'EPC Timer': 156,
-    'Signalling Priority Indication': 157,
-    'Temporary Mobile Group Identity (TMGI)': 158,
-    'TMGI': 158,
-    'Additional MM context for SRVCC': 159,
-    'Additional flags for SRVCC': 160,
-    'MDT Configuration': 162,
-    'Additional Protocol Configuration Options (APCO)': 163,
-    'APCO': 163,
-    'Absolute Time of MBMS Data Transfer': 164,
-    'H(e)NB Information Reporting ': 165,
-    'IPv4 Configuration Parameters (IP4CP)': 166,
-    'IP4CP': 166,
-    'Change to Report Flags ': 167,
-    'Action Indication': 168,
-    'TWAN Identifier': 169,
-    'ULI Timestamp': 170,
-    'MBMS Flags': 171,
-    'RAN/NAS Cause': 172,
-    'CN Operator Selection Entity': 173,
-    'Trusted WLAN Mode Indication': 174,
-    'Node Number': 175,
-    'Node Identifier': 176,
-    'Presence Reporting Area Action': 177,
-    'Presence Reporting Area Information': 178,
-    'TWAN Identifier Timestamp': 179,
-    'Overload Control Information': 180,
-    'Load Control Information': 181,
-    'Metric': 182,
-    'Sequence Number': 183,
-    'APN and Relative Capacity': 184,
-    'WLAN Offloadability Indication': 185,
-    'Paging and Service Information': 186,
-    'Integer Number': 187,
-    'Millisecond Time Stamp': 188,
-    'Monitoring Event Information': 189,
-    'ECGI List': 190,
-    'Remote UE Context': 191,
-    'Remote User ID': 192,
-    'Remote UE IP information': 193,
-    'CIoT Optimizations Support Indication': 194,
-    'SCEF PDN Connection': 195,
-    'Header Compression Configuration': 196,
-    'Extended Protocol Configuration Options (ePCO)': 197,
-    'ePCO': 197,
-    'Serving PLMN Rate Control': 198,
-    'Counter': 199,
-    'Private Extension': 255,
-}
+import gtpcodec
+import tbcd
+
+from gtpcodec import integer_types, u8_packer, u16_packer, u32_packer
+
+# Name tables, loaded from gtpv2spec on first use
+ie_name_to_type = gtpcodec.LazyTable('gtpv2spec', 'ie_name_to_type')
+ie_type_to_name = gtpcodec.LazyTable('gtpv2spec', 'ie_name_to_type', reverse=True)
+message_name_to_type = gtpcodec.LazyTable('gtpv2spec', 'message_name_to_type')
+message_type_to_name = gtpcodec.LazyTable('gtpv2spec', 'message_name_to_type', reverse=True)
+
 
 
 
 ie_types = {
-    1: "octetstring",
+    1: "tbcd",
     2: "octetstring",
     3: "octetstring",
-    4: "octetstring",
-    5: "octetstring",
-    8: "octetstring",
-    9: "octetstring",
-    11: "octetstring",
-    12: "octetstring",
-    13: "octetstring",
-    14: "octetstring",
-    15: "octetstring",
-    16: "octetstring",
-    17: "octetstring",
-    18: "octetstring",
-    19: "octetstring",
-    20: "octetstring",
-    21: "octetstring",
-    22: "octetstring",
-    23: "octetstring",
-    24: "octetstring",
-    25: "octetstring",
-    26: "octetstring",
-    27: "octetstring",
-    28: "octetstring",
-    29: "octetstring",
+    51: "octetstring",
+    71: "octetstring",
+    72: "ambr",
+    73: "octetstring",
+    74: "octetstring",
+    75: "tbcd",
+    76: "tbcd",
+    77: "octetstring",
+    78: "octetstring",
+    79: "paa",
+    80: "bearer_qos",
+    81: "octetstring",
+    82: "octetstring",
+    83: "plmn",
+    84: "octetstring",
+    85: "octetstring",
+    86: "uli",
+    87: "fteid",
+    88: "octetstring",
+    89: "octetstring",
+    90: "octetstring",
+    91: "octetstring",
+    92: "octetstring",
+    93: "grouped",
+    94: "octetstring",
+    95: "octetstring",
+    96: "octetstring",
+    97: "octetstring",
+    99: "octetstring",
+    100: "octetstring",
+    103: "octetstring",
+    104: "octetstring",
+    105: "octetstring",
+    106: "octetstring",
+    107: "octetstring",
+    108: "octetstring",
+    109: "grouped",
+    110: "octetstring",
+    111: "octetstring",
+    112: "octetstring",
+    113: "octetstring",
+    114: "octetstring",
+    115: "octetstring",
+    116: "octetstring",
+    117: "octetstring",
+    118: "octetstring",
+    119: "octetstring",
+    120: "octetstring",
+    121: "octetstring",
+    123: "octetstring",
+    124: "octetstring",
+    125: "octetstring",
+    126: "octetstring",
     127: "octetstring",
     128: "octetstring",
     129: "octetstring",
-    130: "octetstring",
     131: "octetstring",
     132: "octetstring",
     133: "octetstring",
@@ -216,13 +101,12 @@ ie_types = {
     152: "octetstring",
     153: "octetstring",
     154: "octetstring",
-    155: "octetstring",
+    155: "arp",
     156: "octetstring",
     157: "octetstring",
     158: "octetstring",
     159: "octetstring",
     160: "octetstring",
-    161: "octetstring",
     162: "octetstring",
     163: "octetstring",
     164: "octetstring",
@@ -233,6 +117,7 @@ ie_types = {
     169: "octetstring",
     170: "octetstring",
     171: "octetstring",
+    172: "octetstring",
     173: "octetstring",
     174: "octetstring",
     175: "octetstring",
@@ -240,8 +125,8 @@ ie_types = {
     177: "octetstring",
     178: "octetstring",
     179: "octetstring",
-    180: "octetstring",
-    181: "octetstring",
+    180: "grouped",
+    181: "grouped",
     182: "octetstring",
     183: "octetstring",
     184: "octetstring",
@@ -251,119 +136,432 @@ ie_types = {
     188: "octetstring",
     189: "octetstring",
     190: "octetstring",
-    191: "octetstring",
+    191: "grouped",
     192: "octetstring",
     193: "octetstring",
     194: "octetstring",
-    195: "octetstring",
+    195: "grouped",
     196: "octetstring",
     197: "octetstring",
     198: "octetstring",
     199: "octetstring",
-    200: "octetstring",
-    201: "octetstring",
-    202: "octetstring",
-    203: "octetstring",
-    204: "octetstring",
-    205: "octetstring",
-    207: "octetstring",
-    208: "octetstring",
-    209: "octetstring",
-    210: "octetstring",
-    211: "octetstring",
-    212: "octetstring",
-    213: "octetstring",
-    214: "octetstring",
-    215: "octetstring",
-    216: "octetstring",
-    217: "octetstring",
-    218: "octetstring",
-    219: "octetstring",
-    220: "octetstring",
-    221: "octetstring",
-    222: "octetstring",
-    238: "octetstring",
-    251: "octetstring",
     255: "octetstring",
 }
 
 
-u8_packer = struct.Struct('B')
-u16_packer = struct.Struct('!H')
-u32_packer = struct.Struct('!I')
+# Composite IEs.  Each decodes from a view of the IE value: fixed fields are unpacked with the
+# precompiled structs below as soon as the IE is decoded, and optional parts are decoded only when
+# asked for.  Addresses are packed (4 octets for IPv4, 16 for IPv6); create() also takes strings.
 
-def encode_u8(v): return u8_packer.pack(v)
-def encode_u16(v): return u16_packer.pack(v)
-def encode_u32(v): return u32_packer.pack(v)
-def encode_string(v): return bytes(v)
-def encode_octetstring(v): return v
+# F-TEID: V4, V6 and interface type; TEID or GRE key
+fteid_header_struct = struct.Struct('! B I')
+# AMBR: uplink and downlink, in kbps
+ambr_struct = struct.Struct('! I I')
+# Bearer QoS: PCI, PL and PVI; QCI; then the uplink and downlink MBR and GBR as 40-bit values, each
+# split into its high octet and low four octets
+bearer_qos_struct = struct.Struct('! B B B I B I B I B I')
+# ULI field bodies following the PLMN identity
+lac_ci_struct = struct.Struct('! H H')
+lac_rac_struct = struct.Struct('! H B')
+u8_u16_struct = struct.Struct('! B H')
 
 
-def decode_u8(v): return u8_packer.unpack(v)[0]
-def decode_u16(v): return u16_packer.unpack(v)[0]
-def decode_u32(v): return u32_packer.unpack(v)[0]
-def decode_string(v): return v.decode("ascii")
-def decode_octetstring(v): return v
+def _packed_address(address, family):
+    if address is None or not isinstance(address, str):
+        return address
+    return socket.inet_pton(family, address)
 
-ie_decoders = {
-    "u8":           decode_u8,
-    "u16":          decode_u16,
-    "u32":          decode_u32,
-    "string":       decode_string,
-    "octetstring":  decode_octetstring,
-}
 
+class FTEID(object):
+    """Decoded Fully Qualified TEID (type 87)"""
 
-ie_encoders = {
-    "u8":           encode_u8,
-    "u16":          encode_u16,
-    "u32":          encode_u32,
-    "string":       encode_string,
-    "octetstring":  encode_octetstring,
-}
+    __slots__ = ('_view', '_flags', '_teid')
 
+    def __init__(self, value):
+        self._view = memoryview(value)
+        if len(self._view) < 5:
+            raise ValueError('F-TEID length ({}) is less than 5'.format(str(len(self._view))))
+        (self._flags, self._teid) = fteid_header_struct.unpack_from(self._view, 0)
+        if len(self._view) < 5 + (4 if self._flags & 0x80 else 0) + (16 if self._flags & 0x40 else 0):
+            raise ValueError('F-TEID length ({}) is too short for its V4 and V6 flags'.format(str(len(self._view))))
 
 
-def decode_next_IE(stream):
-    """From an incoming stream, decode the next IE.  Return a gtp.IE object, or None if the 'stream' length is 0.
-       Raises an exception on an invalid IE."""
-    if len(stream) < 1:
+    @classmethod
+    def create(cls, interface_type, teid, ipv4=None, ipv6=None):
+        ipv4 = _packed_address(ipv4, socket.AF_INET)
+        ipv6 = _packed_address(ipv6, socket.AF_INET6)
+        flags = (interface_type & 0x3f) | (0x80 if ipv4 is not None else 0) | (0x40 if ipv6 is not None else 0)
+        return cls(fteid_header_struct.pack(flags, teid) + (ipv4 or b'') + (ipv6 or b''))
+
+
+    def encoded_value(self):
+        return self._view
+
+
+    def interface_type(self):
+        return self._flags & 0x3f
+
+
+    def teid(self):
+        return self._teid
+
+
+    def ipv4(self):
+        """The IPv4 address, or None"""
+        if not self._flags & 0x80:
+            return None
+        return bytes(self._view[5:9])
+
+
+    def ipv6(self):
+        """The IPv6 address, or None"""
+        if not self._flags & 0x40:
+            return None
+        offset = 9 if self._flags & 0x80 else 5
+        return bytes(self._view[offset:offset + 16])
+
+
+class PAA(object):
+    """Decoded PDN Address Allocation (type 79)"""
+
+    __slots__ = ('_view', '_pdn_type')
+
+    # value length for each PDN type: IPv4, IPv6, IPv4v6
+    lengths = (None, 5, 18, 22)
+
+    def __init__(self, value):
+        self._view = memoryview(value)
+        if len(self._view) < 1:
+            raise ValueError('PAA is empty')
+        self._pdn_type = self._view[0] & 0x07
+        if self._pdn_type < 4 and len(self._view) < (self.lengths[self._pdn_type] or 1):
+            raise ValueError('PAA length ({}) is too short for PDN type {}'.format(str(len(self._view)), str(self._pdn_type)))
+
+
+    @classmethod
+    def create(cls, ipv4=None, ipv6=None, ipv6_prefix_length=64):
+        ipv4 = _packed_address(ipv4, socket.AF_INET)
+        ipv6 = _packed_address(ipv6, socket.AF_INET6)
+        if ipv6 is None:
+            return cls(b'\x01' + ipv4)
+        if ipv4 is None:
+            return cls(bytes((2, ipv6_prefix_length)) + ipv6)
+        return cls(bytes((3, ipv6_prefix_length)) + ipv6 + ipv4)
+
+
+    def encoded_value(self):
+        return self._view
+
+
+    def pdn_type(self):
+        """1 (IPv4), 2 (IPv6), 3 (IPv4v6) or 4 (Non-IP)"""
+        return self._pdn_type
+
+
+    def ipv4(self):
+        """The IPv4 address, or None"""
+        if self._pdn_type == 1:
+            return bytes(self._view[1:5])
+        if self._pdn_type == 3:
+            return bytes(self._view[18:22])
         return None
 
-    type = struct.unpack('B', stream[0:1]) 
 
-    if type < 128:
-        if type not in ie_type_length:
-            raise ValueError('Type ({}) extracted from decode stream is not defined'.str(type))
-        length = ie_type_length[type]
+    def ipv6(self):
+        """The IPv6 prefix and interface identifier, or None"""
+        if self._pdn_type == 2 or self._pdn_type == 3:
+            return bytes(self._view[2:18])
+        return None
+
+
+    def ipv6_prefix_length(self):
+        if self._pdn_type == 2 or self._pdn_type == 3:
+            return self._view[1]
+        return None
+
+
+CGI = collections.namedtuple('CGI', ('mcc', 'mnc', 'lac', 'ci'))
+SAI = collections.namedtuple('SAI', ('mcc', 'mnc', 'lac', 'sac'))
+RAI = collections.namedtuple('RAI', ('mcc', 'mnc', 'lac', 'rac'))
+TAI = collections.namedtuple('TAI', ('mcc', 'mnc', 'tac'))
+ECGI = collections.namedtuple('ECGI', ('mcc', 'mnc', 'eci'))
+LAI = collections.namedtuple('LAI', ('mcc', 'mnc', 'lac'))
+MacroENodeBID = collections.namedtuple('MacroENodeBID', ('mcc', 'mnc', 'enodeb_id'))
+ExtendedMacroENodeBID = collections.namedtuple('ExtendedMacroENodeBID', ('mcc', 'mnc', 'smenb', 'enodeb_id'))
+
+def _decode_cgi(v, o): return CGI(*(tbcd.decode_plmn(v[o:o + 3]) + lac_ci_struct.unpack_from(v, o + 3)))
+def _decode_sai(v, o): return SAI(*(tbcd.decode_plmn(v[o:o + 3]) + lac_ci_struct.unpack_from(v, o + 3)))
+def _decode_rai(v, o): return RAI(*(tbcd.decode_plmn(v[o:o + 3]) + lac_rac_struct.unpack_from(v, o + 3)))
+def _decode_tai(v, o): return TAI(*(tbcd.decode_plmn(v[o:o + 3]) + u16_packer.unpack_from(v, o + 3)))
+def _decode_ecgi(v, o): return ECGI(*(tbcd.decode_plmn(v[o:o + 3]) + (u32_packer.unpack_from(v, o + 3)[0] & 0x0fffffff,)))
+def _decode_lai(v, o): return LAI(*(tbcd.decode_plmn(v[o:o + 3]) + u16_packer.unpack_from(v, o + 3)))
+
+def _decode_macro_enodeb_id(v, o):
+    (high, low) = u8_u16_struct.unpack_from(v, o + 3)
+    return MacroENodeBID(*(tbcd.decode_plmn(v[o:o + 3]) + (((high & 0x0f) << 16) | low,)))
+
+def _decode_extended_macro_enodeb_id(v, o):
+    (high, low) = u8_u16_struct.unpack_from(v, o + 3)
+    return ExtendedMacroENodeBID(*(tbcd.decode_plmn(v[o:o + 3]) + (high >> 7, ((high & 0x1f) << 16) | low)))
+
+def _encode_cgi(f): return lac_ci_struct.pack(f.lac, f.ci)
+def _encode_sai(f): return lac_ci_struct.pack(f.lac, f.sac)
+def _encode_rai(f): return lac_rac_struct.pack(f.lac, f.rac) + b'\xff'
+def _encode_tai(f): return u16_packer.pack(f.tac)
+def _encode_ecgi(f): return u32_packer.pack(f.eci & 0x0fffffff)
+def _encode_lai(f): return u16_packer.pack(f.lac)
+def _encode_macro_enodeb_id(f): return u8_u16_struct.pack((f.enodeb_id >> 16) & 0x0f, f.enodeb_id & 0xffff)
+def _encode_extended_macro_enodeb_id(f): return u8_u16_struct.pack((f.smenb << 7) | ((f.enodeb_id >> 16) & 0x1f), f.enodeb_id & 0xffff)
+
+# ULI fields, in the order of their flag bits (CGI is bit 0) and of their appearance in the IE:
+# (name, length, decoder, encoder)
+uli_fields = (
+    ('cgi',                      7, _decode_cgi,                      _encode_cgi),
+    ('sai',                      7, _decode_sai,                      _encode_sai),
+    ('rai',                      7, _decode_rai,                      _encode_rai),
+    ('tai',                      5, _decode_tai,                      _encode_tai),
+    ('ecgi',                     7, _decode_ecgi,                     _encode_ecgi),
+    ('lai',                      5, _decode_lai,                      _encode_lai),
+    ('macro_enodeb_id',          6, _decode_macro_enodeb_id,          _encode_macro_enodeb_id),
+    ('extended_macro_enodeb_id', 6, _decode_extended_macro_enodeb_id, _encode_extended_macro_enodeb_id),
+)
+
+def _uli_layout(flags):
+    offsets = []
+    offset = 1
+    for (bit, field) in enumerate(uli_fields):
+        if flags & (1 << bit):
+            offsets.append(offset)
+            offset += field[1]
+        else:
+            offsets.append(-1)
+    return (tuple(offsets), offset)
+
+# flags octet -> (offset of each field or -1, total value length)
+uli_layouts = tuple(_uli_layout(flags) for flags in range(256))
+
+
+class ULI(object):
+    """Decoded User Location Information (type 86).  Each location field is decoded when its accessor
+       is called, and the accessor returns None if the field is absent."""
+
+    __slots__ = ('_view', '_offsets')
+
+    def __init__(self, value):
+        self._view = memoryview(value)
+        if len(self._view) < 1:
+            raise ValueError('ULI is empty')
+        (self._offsets, length) = uli_layouts[self._view[0]]
+        if len(self._view) < length:
+            raise ValueError('ULI length ({}) is less than its flags require ({})'.format(str(len(self._view)), str(length)))
+
+
+    @classmethod
+    def create(cls, **fields):
+        """Create from keyword arguments named as the accessors, e.g. ULI.create(tai=TAI('001', '01', 1),
+           ecgi=ECGI('001', '01', 0x1234567))"""
+        flags = 0
+        encoded = bytearray(1)
+        for (bit, (name, length, decoder, encoder)) in enumerate(uli_fields):
+            field = fields.pop(name, None)
+            if field is not None:
+                flags |= 1 << bit
+                encoded += tbcd.encode_plmn((field.mcc, field.mnc)) + encoder(field)
+        if fields:
+            raise ValueError('ULI fields ({}) not understood'.format(', '.join(fields)))
+        encoded[0] = flags
+        return cls(bytes(encoded))
+
+
+    def encoded_value(self):
+        return self._view
+
+
+    def flags(self):
+        return self._view[0]
+
+
+    def _field(self, index):
+        offset = self._offsets[index]
+        if offset < 0:
+            return None
+        return uli_fields[index][2](self._view, offset)
+
+
+    def cgi(self): return self._field(0)
+    def sai(self): return self._field(1)
+    def rai(self): return self._field(2)
+    def tai(self): return self._field(3)
+    def ecgi(self): return self._field(4)
+    def lai(self): return self._field(5)
+    def macro_enodeb_id(self): return self._field(6)
+    def extended_macro_enodeb_id(self): return self._field(7)
+
+
+AMBR = collections.namedtuple('AMBR', ('uplink', 'downlink'))
+ARP = collections.namedtuple('ARP', ('pci', 'pl', 'pvi'))
+BearerQoS = collections.namedtuple('BearerQoS', ('pci', 'pl', 'pvi', 'qci', 'mbr_uplink', 'mbr_downlink', 'gbr_uplink', 'gbr_downlink'))
+
+
+def decode_ambr(v): return AMBR(*ambr_struct.unpack(v))
+def encode_ambr(v): return ambr_struct.pack(*v) if isinstance(v, tuple) else v
+
+
+def decode_arp(v):
+    b = v[0]
+    return ARP((b >> 6) & 0x01, (b >> 2) & 0x0f, b & 0x01)
+
+def encode_arp(v): return bytes((((v.pci & 0x01) << 6) | ((v.pl & 0x0f) << 2) | (v.pvi & 0x01),)) if isinstance(v, tuple) else v
+
+
+def decode_bearer_qos(v):
+    (arp, qci, mu_h, mu_l, md_h, md_l, gu_h, gu_l, gd_h, gd_l) = bearer_qos_struct.unpack(v)
+    return BearerQoS((arp >> 6) & 0x01, (arp >> 2) & 0x0f, arp & 0x01, qci, (mu_h << 32) | mu_l, (md_h << 32) | md_l, (gu_h << 32) | gu_l, (gd_h << 32) | gd_l)
+
+def encode_bearer_qos(v):
+    if not isinstance(v, tuple):
+        return v
+    rates = []
+    for rate in v[4:8]:
+        rates += (rate >> 32, rate & 0xffffffff)
+    return bearer_qos_struct.pack(((v.pci & 0x01) << 6) | ((v.pl & 0x0f) << 2) | (v.pvi & 0x01), v.qci, *rates)
+
+
+def encode_grouped(v): return v.encoded_value() if isinstance(v, IEGroup) else encode_IEs(v)
+def encode_composite(v): return v.encoded_value() if hasattr(v, 'encoded_value') else v
+
 
-        if len(stream) < length + 1:
-            raise ValueError('Length of data for type ({}) should be ({}) but not enough bits left in encoded stream'.format(str(type), str(length)))
+def decode_grouped(v): return IEGroup(v)
+def decode_fteid(v): return FTEID(v)
+def decode_paa(v): return PAA(v)
+def decode_uli(v): return ULI(v)
 
-        return IE(type, stream[1:length+2], raw=True)
-    else:
-        if len(stream) < 3:
-            raise ValueError('Type ({}) is TLV, but length of encoded stream is less than 3'.format(str(type)))
+ie_decoders = dict(gtpcodec.ie_decoders)
+ie_decoders.update({
+    "grouped":      decode_grouped,
+    "tbcd":         tbcd.decode_tbcd,
+    "plmn":         tbcd.decode_plmn,
+    "fteid":        decode_fteid,
+    "paa":          decode_paa,
+    "uli":          decode_uli,
+    "ambr":         decode_ambr,
+    "arp":          decode_arp,
+    "bearer_qos":   decode_bearer_qos,
+})
 
-        length = struct.unpack('!I', stream[1:3])
 
-        if len(stream) < length + 3:
-            raise ValueError('Asserted length of next IE value in encoded stream is ({}) but length of stream ({}) is insufficient'.format(str(length), str(len(stream))))
+ie_encoders = dict(gtpcodec.ie_encoders)
+ie_encoders.update({
+    "grouped":      encode_grouped,
+    "tbcd":         tbcd.encode_tbcd,
+    "plmn":         tbcd.encode_plmn,
+    "fteid":        encode_composite,
+    "paa":          encode_composite,
+    "uli":          encode_composite,
+    "ambr":         encode_ambr,
+    "arp":          encode_arp,
+    "bearer_qos":   encode_bearer_qos,
+})
+
+
+ie_codec_structs = dict(gtpcodec.ie_codec_structs)
+
+
+# IE types whose decoded instances are handed out from a shared cache (see shared_IE()):
+# Cause, Recovery, RAT Type, PDN Type and Selection Mode
+shared_ie_types = frozenset((2, 3, 82, 99, 128))
+
+# Flat per-type dispatch tables, indexed directly by IE type.  These are built from ie_types,
+# ie_encoders and ie_decoders; call compile_ie_tables() again after changing those.  Every GTPv2 IE
+# carries an explicit length, so unlike GTPv1 there is no fixed length table.
+ie_encoder_table = [None] * 256
+ie_decoder_table = [None] * 256
+ie_struct_table  = [None] * 256
+ie_shared_table  = [False] * 256
+
+def compile_ie_tables():
+    """(Re)build ie_encoder_table, ie_decoder_table, ie_struct_table (the struct.Struct for
+       fixed-size integer types, otherwise None) and ie_shared_table (True for types in
+       shared_ie_types)"""
+    gtpcodec.compile_ie_tables(ie_types, ie_encoders, ie_decoders, ie_codec_structs, shared_ie_types,
+                               ie_encoder_table, ie_decoder_table, ie_struct_table, ie_shared_table)
+
+compile_ie_tables()
 
-        return IE(type, stream[3:length+4])
 
 
 ie_header_struct = struct.Struct('! B H B')
 
-class IE:
+
+def iter_IEs(buffer, offset=0):
+    """Walk the IEs encoded in 'buffer' (bytes, bytearray or memoryview), starting at 'offset', and yield
+       an IE object for each one.  The encoded value of each yielded IE is a memoryview into 'buffer', so
+       nothing is copied until the decoded value is requested.  IEs of a type in shared_ie_types are
+       instead shared instances from the flyweight cache.  Raises ValueError on an invalid IE."""
+    view = memoryview(buffer)
+    end = len(view)
+    unpack_header = ie_header_struct.unpack_from
+
+    while offset < end:
+        if end - offset < 4:
+            raise ValueError('Length of encoded stream remaining ({}) is less than an IE header'.format(str(end - offset)))
+
+        (type, length, instance) = unpack_header(view, offset)
+        start = offset + 4
+        offset = start + length
+
+        if offset > end:
+            raise ValueError('Asserted length of next IE value in encoded stream is ({}) but length of stream ({}) is insufficient'.format(str(length), str(end - start)))
+
+        if ie_shared_table[type]:
+            yield shared_IE(type, view[start:offset], instance & 0x0f)
+        else:
+            yield IE(type, view[start:offset], raw=True, instance=instance & 0x0f)
+
+
+def encode_IEs(ies):
+    """Encode a sequence of IEs back to back into a single newly allocated bytearray"""
+    buf = bytearray(sum(ie.encoded_length() for ie in ies))
+    offset = 0
+    for ie in ies:
+        offset = ie.encode_into(buf, offset)
+    return buf
+
+
+def index_IEs(ies):
+    """Build a dict mapping (type, instance) to the list of IEs in 'ies' with that type and instance,
+       in order"""
+    index = {}
+    for ie in ies:
+        key = (ie.type(), ie.instance())
+        if key in index:
+            index[key].append(ie)
+        else:
+            index[key] = [ie]
+    return index
+
+
+def decode_next_IE(stream):
+    """From an incoming stream, decode the next IE.  Return a gtp.IE object, or None if the 'stream' length is 0.
+       Raises an exception on an invalid IE."""
+    return gtpcodec.first_IE(iter_IEs(stream))
+
+
+_undecoded = gtpcodec.undecoded
+
+class IE(object):
     """GTPv2 Information Element."""
 
+    __slots__ = ('_type', '_instance', '_length', '_encoded_length', '_encoded_value', '_decoded_value')
+
     def __init__(self, type, value, **kwargs):
         """Set raw=True if passed 'value' is raw encoding.  Otherwise, an attempt
            is made to convert the provided value to the corresponding raw value (e.g., if value expected is
-           uint32, and value is 1234, that number will be encoded as a 4-byte unsigned integer)."""
+           uint32, and value is 1234, that number will be encoded as a 4-byte unsigned integer).  A raw
+           value is not decoded until decoded_value() is first called.  Set instance=<n> to give the IE
+           an instance id other than 0."""
 
-        if isinstance(type, (int, long)):
+        if isinstance(type, integer_types):
             if type < 0 or type > 255:
                 raise ValueError('IE type must be unsigned 8-bit integer')
             self._type = type
@@ -373,17 +571,19 @@ class IE:
             else:
                 raise ValueError('Provided IE type ({}) not understood'.format(type))
 
-        if 'raw' in kwargs and kwargs['raw']:
-            self._encoded_value = value
-            self._decoded_value = ie_decoders[ie_types[self._type]](value)
+        encoder = ie_encoder_table[self._type]
+
+        if encoder is None:
+            raise ValueError('IE type unknown')
+
+        if kwargs.get('raw'):
+            self._decoded_value = _undecoded
         else:
             self._decoded_value = value
-            self._encoded_value = ie_encoders[ie_types[self._type]](value)
-
-            if self._type in ie_types:
-                value = ie_encoders[ie_types[self._type]](value)
+            value = encoder(value)
 
         self._encoded_value = value
+        self._instance = kwargs.get('instance', 0)
 
         self._length = len(value)
         self._encoded_length = self._length + 4
@@ -394,6 +594,11 @@ class IE:
         return self._type
 
 
+    def instance(self):
+        """The IE instance id as an integer"""
+        return self._instance
+
+
     def value_length(self):
         """The length of the IE value when it is encoded"""
         return self._length
@@ -405,114 +610,154 @@ class IE:
 
 
     def encoded_value(self):
-        """The IE value when it is encoded"""
+        """The IE value when it is encoded.  For an IE produced by iter_IEs(), this is a memoryview
+           into the decoded buffer"""
         return self._encoded_value
 
 
     def decoded_value(self):
         """The decoded IE value.  Number types are represented as an integer.  String types are
            represented as an ASCII string.  Octetstrings are left undecoded."""
+        if self._decoded_value is _undecoded:
+            packer = ie_struct_table[self._type]
+            if packer is not None:
+                self._decoded_value = packer.unpack(self._encoded_value)[0]
+            else:
+                self._decoded_value = ie_decoder_table[self._type](self._encoded_value)
         return self._decoded_value
 
     # XXX: type 254 is extensible, and has a different format from other IEs
     #      but we don't account for that.  The caller must, in that case, encode
     #      the IE Extension Field as part of the value
     def encode(self, generator=None):
-        if self._type < 128:
-            return ie_tv_header_packer.pack(self._type) + self._encoded_value
+        """Encode the IE (header and value), returning a bytearray.  If an IEInstanceGenerator is
+           provided, the encoded instance id comes from it rather than from instance()."""
+        buf = bytearray(self._encoded_length)
+        self.encode_into(buf, 0, generator)
+        return buf
+
+
+    def encode_into(self, buf, offset=0, generator=None):
+        """Encode the IE (header and value) into the writable buffer 'buf' starting at 'offset'.  Return
+           the offset immediately following the encoded IE.  If an IEInstanceGenerator is provided, the
+           encoded instance id comes from it rather than from instance()."""
+        if generator is None:
+            instance = self._instance
         else:
-            return ie_tlv_header_packer.pack(self._type, self._length) + self._encoded_value
+            instance = generator.next_instance(self._type)
+
+        ie_header_struct.pack_into(buf, offset, self._type, self._length, instance)
+        offset += 4
+        end = offset + self._length
+        buf[offset:end] = self._encoded_value
+        return end
+
+
+# Cache of shared IE instances for types in shared_ie_types, keyed by (type, instance, encoded value).
+# The cache stops growing at shared_ie_cache_limit entries; past that, shared_IE() returns new instances.
+shared_ie_cache = {}
+shared_ie_cache_limit = 4096
+
+def shared_IE(type, value, instance=0):
+    """Return a shared, immutable IE for the raw encoded 'value', creating it on first use.  Suitable for
+       IEs that repeat constantly with the same value, such as Recovery and Cause; the cached IE holds
+       its own copy of 'value', never a view into a caller's buffer."""
+    key = (type, instance, bytes(value))
+    shared = shared_ie_cache.get(key)
+
+    if shared is None:
+        shared = IE(type, key[2], raw=True, instance=instance)
+        if len(shared_ie_cache) < shared_ie_cache_limit:
+            shared_ie_cache[key] = shared
+
+    return shared
+
 
+class IEGroup(object):
+    """The decoded value of a grouped IE (e.g., Bearer Context or PDN Connection).  The child IEs are
+       walked only when IEs(), get_IE() or get_IEs() is first called, and the value of each child is a
+       memoryview into the parent buffer.  A child that is itself grouped decodes the same way."""
 
-class IEInstanceGenerator:
+    __slots__ = ('_view', '_ies', '_ie_index')
+
+    def __init__(self, value):
+        self._view = memoryview(value)
+        self._ies = None
+        self._ie_index = None
+
+
+    def encoded_value(self):
+        """The encoded child IEs, as a memoryview into the parent buffer"""
+        return self._view
+
+
+    def IEs(self):
+        """The child IEs, in order"""
+        if self._ies is None:
+            self._ies = tuple(iter_IEs(self._view))
+        return self._ies
+
+
+    def get_IE(self, type, instance=0):
+        """The first child IE with the given type and instance, or None if there is no such IE"""
+        ies = self.get_IEs(type, instance)
+        return ies[0] if ies else None
+
+
+    def get_IEs(self, type, instance=0):
+        """A list of the child IEs with the given type and instance, in order"""
+        if self._ie_index is None:
+            self._ie_index = index_IEs(self.IEs())
+        return self._ie_index.get((type, instance), [])
+
+
+_zero_instance_counts = bytes(bytearray(256))
+
+class IEInstanceGenerator(object):
     """When GTPv2 IEs are encoded, they include an instance id for the IE.  If more than one
        IE of the same type appears, then they will differ by instance id.  An IEInstanceGenerator
-       tracks encoded IEs in a set and produces an appropriate instance id as IEs are encoded."""
+       keeps a per-type counter and produces an appropriate instance id as IEs are encoded.  Call
+       reset() between messages to reuse the same generator."""
+
+    __slots__ = ('_counts',)
+
     def __init__(self):
-        pass
-
-
-
-message_name_to_type = {
-    'Echo Request': 1,
-    'Echo Response': 2,
-    'Version Not Supported': 3,
-    'Node Alive Request': 4,
-    'Node Alive Response': 5,
-    'Redirection Request': 6,
-    'Redirection Response': 7,
-    'Create PDP Context Request': 16,
-    'Create PDP Context Response': 17,
-    'Update PDP Context Request': 18,
-    'Update PDP Context Response': 19,
-    'Delete PDP Context Request': 20,
-    'Delete PDP Context Response': 21,
-    'Initiate PDP Context Activation Request': 22,
-    'Initiate PDP Context Activation Response': 23,
-    'Error Indication': 26,
-    'PDU Notification Request': 27,
-    'PDU Notification Response': 28,
-    'PDU Notification Reject Request': 29,
-    'PDU Notification Reject Response': 30,
-    'Supported Extension Headers Notification': 31,
-    'Send Routeing Information for GPRS Request': 32,
-    'Send Routeing Information for GPRS Response': 33,
-    'Failure Report Request': 34,
-    'Failure Report Response': 35,
-    'Note MS GPRS Present Request': 36,
-    'Note MS GPRS Present Response': 37,
-    'Identification Request': 48,
-    'Identification Response': 49,
-    'SGSN Context Request': 50,
-    'SGSN Context Response': 51,
-    'SGSN Context Acknowledge': 52,
-    'Forward Relocation Request': 53,
-    'Forward Relocation Response': 54,
-    'Forward Relocation Complete': 55,
-    'Relocation Cancel Request': 56,
-    'Relocation Cancel Response': 57,
-    'Forward SRNS Context': 58,
-    'Forward Relocation Complete Acknowledge': 59,
-    'Forward SRNS Context Acknowledge': 60,
-    'UE Registration Query Request': 61,
-    'UE Registration Query Response': 62,
-    'RAN Information Relay': 70,
-    'MBMS Notification Request': 96,
-    'MBMS Notification Response': 97,
-    'MBMS Notification Reject Request': 98,
-    'MBMS Notification Reject Response': 99,
-    'Create MBMS Context Request': 100,
-    'Create MBMS Context Response': 101,
-    'Update MBMS Context Request': 102,
-    'Update MBMS Context Response': 103,
-    'Delete MBMS Context Request': 104,
-    'Delete MBMS Context Response': 105,
-    'MBMS Registration Request': 112,
-    'MBMS Registration Response': 113,
-    'MBMS De-Registration Request': 114,
-    'MBMS De-Registration Response': 115,
-    'MBMS Session Start Request': 116,
-    'MBMS Session Start Response': 117,
-    'MBMS Session Stop Request': 118,
-    'MBMS Session Stop Response': 119,
-    'MBMS Session Update Request': 120,
-    'MBMS Session Update Response': 121,
-    'MS Info Change Notification Request': 128,
-    'MS Info Change Notification Response': 129,
-    'Data Record Transfer Request': 240,
-    'Data Record Transfer Response': 241,
-    'End Marker': 254,
-    'G-PDU': 255,
-}
+        self._counts = bytearray(256)
 
 
+    def next_instance(self, type):
+        """The instance id for the next IE of the given type.  Raises ValueError if more than 16 IEs
+           of that type have been encoded since the last reset()"""
+        instance = self._counts[type]
+        if instance > 15:
+            raise ValueError('More than 16 instances of IE type ({}) in one message'.format(str(type)))
+        self._counts[type] = instance + 1
+        return instance
 
 
-class v2message:
+    def reset(self):
+        """Start over from instance 0 for every type"""
+        self._counts[:] = _zero_instance_counts
+
+
+
+
+
+
+# flags, message type, length, sequence number (upper 24 bits) and spare
+v2_header_struct = struct.Struct('! B B H I')
+# flags, message type, length, TEID, sequence number (upper 24 bits) and spare
+v2_header_with_teid_struct = struct.Struct('! B B H I I')
+# TEID, sequence number (upper 24 bits) and spare
+teid_and_sequence_struct = struct.Struct('! I I')
+
+class v2message(object):
     """GTPv2 message"""
 
+    __slots__ = ('_type', '_sequence_number', '_teid', '_ies', '_ie_view', '_ie_index', '_encoded_length')
+
     def __init__(self, type, sequence_number=0, teid=None, IEs=()):
-        if isinstance(type, (int, long)):
+        if isinstance(type, integer_types):
             if type < 0 or type > 255:
                 raise ValueError('GTP message type must be unsigned 8-bit integer')
             self._type = type
@@ -522,9 +767,14 @@ class v2message:
             else:
                 raise ValueError('Provided message type ({}) not understood'.format(type))
 
+        if sequence_number < 0 or sequence_number > 0xffffff:
+            raise ValueError('GTPv2 sequence number must be unsigned 24-bit integer')
+
         self._sequence_number = sequence_number
         self._teid = teid
         self._ies = IEs
+        self._ie_view = None
+        self._ie_index = None
 
         self._encoded_length = 8
 
@@ -551,55 +801,570 @@ class v2message:
 
 
     def IEs(self):
-        """A list of Information Elements attached to this message, in order"""
+        """A list of Information Elements attached to this message, in order.  For a decoded message,
+           the IEs are decoded the first time this (or get_IE()) is called"""
+        if self._ies is None:
+            self._ies = tuple(iter_IEs(self._ie_view))
         return self._ies
 
 
+    def get_IE(self, type, instance=0):
+        """The first IE attached to this message with the given type and instance, or None if there is
+           no such IE"""
+        ies = self.get_IEs(type, instance)
+        return ies[0] if ies else None
+
+
+    def get_IEs(self, type, instance=0):
+        """A list of the IEs attached to this message with the given type and instance, in order"""
+        if self._ie_index is None:
+            self._ie_index = index_IEs(self.IEs())
+        return self._ie_index.get((type, instance), [])
+
+
     def encoded_length(self):
         """The total length (in octets) of this message when encoded"""
         return self._encoded_length
 
 
+    def encode(self, generator=None):
+        """Encode the message (header and all IEs) into a single newly allocated bytearray.  If an
+           IEInstanceGenerator is provided, it is reset and then assigns the IE instance ids."""
+        buf = bytearray(self._encoded_length)
+        self.encode_into(buf, 0, generator)
+        return buf
+
+
+    def encode_into(self, buf, offset=0, generator=None):
+        """Encode the message (header and all IEs) into the writable buffer 'buf' (e.g., a reused
+           bytearray) starting at 'offset'.  Return the offset immediately following the encoded
+           message.  If an IEInstanceGenerator is provided, it is reset and then assigns the IE
+           instance ids.  Raises ValueError if 'buf' is too short to hold the message, or if the
+           message is too long for the 16-bit length field of the header."""
+        # the header length field does not count the first four octets
+        if self._encoded_length - 4 > 0xffff:
+            raise ValueError('Encoded message length ({}) exceeds the maximum of ({})'.format(str(self._encoded_length), str(0xffff + 4)))
+
+        if len(buf) - offset < self._encoded_length:
+            raise ValueError('Buffer has ({}) octets available but encoded message length is ({})'.format(str(len(buf) - offset), str(self._encoded_length)))
+
+        if self._teid is None:
+            v2_header_struct.pack_into(buf, offset, 0x40, self._type, self._encoded_length - 4, self._sequence_number << 8)
+            offset += 8
+        else:
+            v2_header_with_teid_struct.pack_into(buf, offset, 0x48, self._type, self._encoded_length - 4, self._teid, self._sequence_number << 8)
+            offset += 12
+
+        if self._ies is None:
+            # decoded message whose IEs were never touched; copy them through as-is
+            end = offset + len(self._ie_view)
+            buf[offset:end] = self._ie_view
+            return end
+
+        if generator is not None:
+            generator.reset()
+
+        for ie in self._ies:
+            offset = ie.encode_into(buf, offset, generator)
+
+        return offset
+
+
+    @classmethod
+    def decode(cls, buffer, offset=0):
+        """Decode a GTPv2 message from 'buffer' (bytes, bytearray or memoryview) starting at 'offset'.
+           Only the header is parsed and validated here; IEs are left as a view into 'buffer' and are
+           decoded only when IEs() or get_IE() is first called.  Octets following the message (e.g.,
+           a piggybacked message) are ignored.  Raises ValueError on an invalid header."""
+        view = memoryview(buffer)
+        available = len(view) - offset
+
+        if available < 8:
+            raise ValueError('Length of encoded stream ({}) is less than a GTPv2 header'.format(str(available)))
+
+        (flags, type, length, sequence_field) = v2_header_struct.unpack_from(view, offset)
+
+        if flags >> 5 != 2:
+            raise ValueError('GTP version ({}) in encoded stream is not 2'.format(str(flags >> 5)))
+
+        end = offset + length + 4
+
+        if length + 4 > available:
+            raise ValueError('Asserted length of message in encoded stream is ({}) but length of stream ({}) is insufficient'.format(str(length + 4), str(available)))
+
+        message = cls.__new__(cls)
+        message._type = type
+        message._encoded_length = length + 4
+        message._ies = None
+        message._ie_index = None
+
+        if flags & 0x08:
+            if length < 8:
+                raise ValueError('TEID flag is set but asserted message length ({}) is too short'.format(str(length + 4)))
+            (message._teid, sequence_field) = teid_and_sequence_struct.unpack_from(view, offset + 4)
+            message._ie_view = view[offset + 12:end]
+        else:
+            message._teid = None
+            message._ie_view = view[offset + 8:end]
+
+        message._sequence_number = sequence_field >> 8
+
+        return message
+
+
+
+# sequence number (upper 24 bits) and spare
+sequence_struct = struct.Struct('!I')
+
+class v2template(object):
+    """A GTPv2 message encoded once, from which copies are stamped out by patching the sequence number,
+       the TEID and the values of selected IEs in place.  'fields' lists the patchable IEs, each given
+       as an IE type, a (type, instance) pair or, for an IE nested in grouped IEs, a sequence of
+       (type, instance) pairs from the outermost IE inwards.  The first matching IE is used."""
+
+    __slots__ = ('_buffer', '_has_teid', '_fields')
+
+    def __init__(self, message, fields=()):
+        self._buffer = message.encode()
+        self._has_teid = message.teid() is not None
+        self._fields = tuple(self._locate(field) for field in fields)
+
+
+    def _locate(self, field):
+        if isinstance(field, integer_types):
+            path = ((field, 0),)
+        elif isinstance(field[0], integer_types):
+            path = (field,)
+        else:
+            path = field
+
+        start = 12 if self._has_teid else 8
+        end = len(self._buffer)
+
+        for (type, instance) in path:
+            while True:
+                if start >= end:
+                    raise ValueError('Template message has no IE with type ({}) and instance ({})'.format(str(type), str(instance)))
+                (ie_type, length, ie_instance) = ie_header_struct.unpack_from(self._buffer, start)
+                start += 4
+                if ie_type == type and ie_instance & 0x0f == instance:
+                    end = start + length
+                    break
+                start += length
+
+        return (start, end)
+
+
+    def encoded_length(self):
+        """The length (in octets) of each stamped message"""
+        return len(self._buffer)
+
+
+    def stamp(self, sequence_number, teid=None, *values):
+        """Patch the sequence number, the TEID (if not None) and, in 'fields' order, the raw encoded values
+           of the patchable IEs into the template's own buffer and return that buffer.  A field whose value
+           is omitted or None keeps whatever was last stamped.  The same bytearray is returned (and
+           overwritten) on every call."""
+        self._patch(self._buffer, 0, sequence_number, teid, values)
+        return self._buffer
+
+
+    def stamp_into(self, buf, offset, sequence_number, teid=None, *values):
+        """As stamp(), but copy the message into the writable buffer 'buf' at 'offset' and patch it there.
+           Return the offset immediately following the stamped message."""
+        end = offset + len(self._buffer)
+        if end > len(buf):
+            raise ValueError('Buffer has ({}) octets available but template length is ({})'.format(str(len(buf) - offset), str(len(self._buffer))))
+        buf[offset:end] = self._buffer
+        self._patch(buf, offset, sequence_number, teid, values)
+        return end
+
+
+    def _patch(self, buf, base, sequence_number, teid, values):
+        if self._has_teid:
+            sequence_struct.pack_into(buf, base + 8, sequence_number << 8)
+            if teid is not None:
+                u32_packer.pack_into(buf, base + 4, teid)
+        else:
+            sequence_struct.pack_into(buf, base + 4, sequence_number << 8)
+            if teid is not None:
+                raise ValueError('Template message has no TEID')
+
+        for ((start, end), value) in zip(self._fields, values):
+            if value is not None:
+                if len(value) != end - start:
+                    raise ValueError('Patched value length ({}) does not match template value length ({})'.format(str(len(value)), str(end - start)))
+                buf[base + start:base + end] = value
+
+
+
+class EchoResponder(object):
+    """Answers GTPv2 Echo Requests straight from their header octets, without running the general
+       decoder.  The Echo Response, carrying a Recovery IE with 'restart_counter', is encoded once and
+       only its sequence number is rewritten per request."""
+
+    __slots__ = ('_response',)
+
+    def __init__(self, restart_counter):
+        self._response = v2message(2, 0, IEs=(IE(3, bytes(bytearray([restart_counter]))),)).encode()
+
+
+    def respond(self, request):
+        """If the encoded message 'request' is a GTPv2 Echo Request, return the encoded Echo Response
+           with the same sequence number, otherwise None.  The returned bytearray is reused (and
+           overwritten) by the next call."""
+        # version 2 with no TEID, message type 1
+        if len(request) < 8 or request[1] != 1 or request[0] & 0xe8 != 0x40:
+            return None
+
+        response = self._response
+        response[4] = request[4]
+        response[5] = request[5]
+        response[6] = request[6]
+        return response
+
+
+
+def _drop(message, *args):
+    return None
+
+
+class MessageDispatcher(object):
+    """Routes GTPv2 messages to the handler registered for their message type.  Handlers are kept in a
+       256-slot list indexed by message type, so routing costs a single index operation once the header
+       is decoded.  A message whose type has no handler (or a buffer that is not a GTPv2 message) takes
+       the reject path straight from its header octets, before anything is decoded."""
+
+    __slots__ = ('_handlers', '_reject')
+
+    def __init__(self, reject=None):
+        """'reject', if given, is called in place of a handler for each message turned away, with the
+           buffer (or message) and other arguments passed to dispatch() (or dispatch_message()), and its
+           result is returned.  By default rejected messages are dropped and None is returned."""
+        self._handlers = [None] * 256
+        self._reject = reject if reject is not None else _drop
+
+
+    def register(self, type, handler):
+        """Route messages of 'type' (a message type or name) to 'handler', called as handler(message,
+           *args) with the decoded v2message and the extra arguments given to dispatch().  Replaces any
+           handler already registered for the type."""
+        if not isinstance(type, integer_types):
+            if type not in message_name_to_type:
+                raise ValueError('Provided message type ({}) not understood'.format(type))
+            type = message_name_to_type[type]
+        elif type < 0 or type > 255:
+            raise ValueError('GTP message type must be unsigned 8-bit integer')
+
+        self._handlers[type] = handler
+
+
+    def unregister(self, type):
+        """Reject messages of 'type' (a message type or name) from now on"""
+        self.register(type, None)
+
+
+    def handler(self, type):
+        """The handler registered for message type 'type', or None"""
+        return self._handlers[type]
+
+
+    def dispatch(self, buffer, *args):
+        """Decode the GTPv2 message in 'buffer' and return the result of its handler.  Raises ValueError
+           if a message of a handled type has an invalid header."""
+        if len(buffer) < 8 or buffer[0] & 0xe0 != 0x40:
+            return self._reject(buffer, *args)
+
+        handler = self._handlers[buffer[1]]
+
+        if handler is None:
+            return self._reject(buffer, *args)
+
+        return handler(v2message.decode(buffer), *args)
+
+
+    def dispatch_message(self, message, *args):
+        """Route an already decoded v2message and return the result of its handler"""
+        handler = self._handlers[message._type]
+
+        if handler is None:
+            return self._reject(message, *args)
+
+        return handler(message, *args)
+
+
 
 class Test_ie(unittest.TestCase):
     def test_ie_constructor(self):
-        gie = ie(1, '\x55', raw=True)
-        self.assertEqual(gie.type(), 1, "ie constructor(1, \\x55) type == 1")
-        self.assertEqual(gie.value_length(), 1, "ie constructor(1, \\x55) length == 1")
-        self.assertEqual(gie.encoded_value(), '\x55', "ie constructor(1, \\x55) enocded_value == \\x55")
-        self.assertEqual(gie.decoded_value(), 85, "ie constructor(1, \\x55) decoded_value == 85")
-
-        gie = ie(1, 55)
-        self.assertEqual(gie.type(), 1, "ie constructor(1, 55) type == 1")
-        self.assertEqual(gie.value_length(), 1, "ie constructor(1, 55) length == 1")
-        self.assertEqual(gie.encoded_value(), '\x37', "ie constructor(1, 55) enocded_value == \\x37")
-        self.assertEqual(gie.decoded_value(), 55, "ie constructor(1, 55) decoded_value == 55")
-
-        # ie type implicit len == 1, so value must also be length 1
+        gie = IE(3, b'\x55', raw=True)
+        self.assertEqual(gie.type(), 3, "IE constructor(3, \\x55) type == 3")
+        self.assertEqual(gie.instance(), 0, "IE constructor(3, \\x55) instance == 0")
+        self.assertEqual(gie.value_length(), 1, "IE constructor(3, \\x55) length == 1")
+        self.assertEqual(gie.encoded_length(), 5, "IE constructor(3, \\x55) encoded_length == 5")
+        self.assertEqual(gie.encoded_value(), b'\x55', "IE constructor(3, \\x55) encoded_value == \\x55")
+        self.assertEqual(gie.decoded_value(), b'\x55', "IE constructor(3, \\x55) decoded_value == \\x55")
+
+        # Unknown IE type
         with self.assertRaises(Exception) as context:
-            gie = ie(1, '\x55\x56\x57')
+            gie = IE(10, b'\x55', raw=True)
 
-        # Unknown ie type
-        with self.assertRaises(Exception) as context:
-            gie = ie(10, '\x55', raw=True)
+        gie = IE('IMSI', b'\x21\x43\x65\x87', instance=1)
+        self.assertEqual(gie.type(), 1, "IE constructor(ie_name_to_type('IMSI'), \\x21\\x43\\x65\\x87) type == 1")
+        self.assertEqual(gie.instance(), 1, "IE constructor(ie_name_to_type('IMSI'), \\x21\\x43\\x65\\x87, instance=1) instance == 1")
+        self.assertEqual(gie.value_length(), 4, "IE constructor(ie_name_to_type('IMSI'), \\x21\\x43\\x65\\x87) length == 4")
 
-        gie = ie(128, '\x55\x56\x57')
-        self.assertEqual(gie.type(), 128, "ie constructor(128, \\x55\\x56\\x57) type == 128")
-        self.assertEqual(gie.value_length(), 3, "ie constructor(128, \\x55\\x56\\x57) length == 3")
-        self.assertEqual(gie.encoded_value(), '\x55\x56\x57', "ie constructor(128, \\x55\\x56\\x57) encoded_value == \\x55\\x56\\x57")
-        self.assertEqual(gie.decoded_value(), '\x55\x56\x57', "ie constructor(128, \\x55\\x56\\x57) decoded_value == \\x55\\x56\\x57")
 
-        gie = ie('IMSI', '12345678')
-        self.assertEqual(gie.type(), 2, "ie constructor(ie_name_to_type('IMSI'), '12345678') type == 2")
-        self.assertEqual(gie.value_length(), 8, "ie constructor(ie_name_to_type('IMSI'), '12345678') length == 8")
-        self.assertEqual(gie.encoded_value(), '12345678', "ie constructor(ie_name_to_type('IMSI'), '12345678') encoded_value == 12345678")
-        self.assertEqual(gie.decoded_value(), '12345678', "ie constructor(ie_name_to_type('IMSI'), '12345678') decoded_value == 12345678")
+        self.assertEqual(IE(1, b'\x21\x43\x65\x87\x09\x21\x43\xf5', raw=True).decoded_value(), '123456789012345', "IE(1, raw=True) decoded_value is IMSI digits")
+        self.assertEqual(IE('MSISDN', '447700900123').encoded_value(), b'\x44\x77\x00\x09\x10\x32', "IE('MSISDN', digits) encodes TBCD")
+        self.assertEqual(IE(83, b'\x21\xf3\x54', raw=True).decoded_value(), ('123', '45'), "IE(83, raw=True) decoded_value is (MCC, MNC)")
+        self.assertEqual(IE('Serving Network', ('310', '260')).encoded_value(), b'\x13\x00\x62', "IE('Serving Network', (MCC, MNC)) encodes PLMN")
 
 
     def test_ie_encode(self):
-        e = ie(1, 5).encode()
-        self.assertEqual(e, '\x01\x05', "ie(1, 5) encode is two bytes (0x02 0x05)")
-        self.assertEqual(ie(251, '\x7f\x00\x00\x01', raw=True).encode(), '\xfb\x00\x04\x7f\x00\x00\x01', "ie(251, 127.0.0.1) encode is 7 bytes (0xfb 0x00 0x04 0x7f 0x00 0x00 0x01)")
+        self.assertEqual(IE(3, b'\x05').encode(), b'\x03\x00\x01\x00\x05', "IE(3, \\x05) encode is five bytes (0x03 0x00 0x01 0x00 0x05)")
+        self.assertEqual(IE(87, b'\x8a\x00\x00\x00\x01\x7f\x00\x00\x01', instance=1).encode(), b'\x57\x00\x09\x01\x8a\x00\x00\x00\x01\x7f\x00\x00\x01', "IE(87, ..., instance=1) encode carries the instance")
+
+
+    def test_iter_IEs(self):
+        stream = bytearray(b'\x00\x00' + IE(3, b'\x05').encode() + IE(87, b'\x8a\x00\x00\x00\x01\x7f\x00\x00\x01', instance=1).encode())
+
+        ies = list(iter_IEs(stream, 2))
+        self.assertEqual([(i.type(), i.instance()) for i in ies], [(3, 0), (87, 1)], "iter_IEs() yields (type, instance) in order")
+        self.assertEqual(ies[1].encoded_length(), 13, "iter_IEs() F-TEID encoded_length == 13")
+
+        # values are views into the original buffer, not copies
+        self.assertIsInstance(ies[1].encoded_value(), memoryview, "iter_IEs() value is a memoryview")
+        stream[-1] = 2
+        self.assertEqual(ies[1].decoded_value().ipv4(), b'\x7f\x00\x00\x02', "iter_IEs() value tracks the underlying buffer")
+
+        self.assertEqual(decode_next_IE(b'\x03\x00\x01\x00\x07').decoded_value(), b'\x07', "decode_next_IE() is Recovery 7")
+        self.assertIsNone(decode_next_IE(b''), "decode_next_IE('') is None")
+
+        # length runs past the end of the stream
+        with self.assertRaises(ValueError) as context:
+            list(iter_IEs(b'\x03\x00\x02\x00\x07'))
+
+        # truncated IE header
+        with self.assertRaises(ValueError) as context:
+            list(iter_IEs(b'\x03\x00'))
+
+class Test_shared_IE(unittest.TestCase):
+    def test_shared_IE(self):
+        recovery = shared_IE(3, b'\x05')
+        self.assertIs(shared_IE(3, bytearray(b'\x05')), recovery, "shared_IE(3, \x05) is a shared instance")
+        self.assertIsNot(shared_IE(3, b'\x05', 1), recovery, "shared_IE() is keyed by instance")
+        self.assertIsInstance(recovery.encoded_value(), bytes, "shared_IE() holds its own copy of the value")
+
+        m = v2message.decode(v2message(1, 1, IEs=[IE(3, b'\x05'), IE(73, b'\x05')]).encode())
+        self.assertIs(m.get_IE(3), recovery, "decoded Recovery is the shared instance")
+        self.assertIsNot(m.get_IE(73), shared_IE(73, b'\x05'), "decoded EBI is not shared")
+
+
+    def test_memory_per_IE(self):
+        import tracemalloc
+
+        def bytes_per_IE(build):
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                held = build()
+                used = tracemalloc.get_traced_memory()[0] - before
+            finally:
+                tracemalloc.stop()
+            return float(used) / len(held)
+
+        # the same class without __slots__, i.e., backed by a per-instance dict
+        DictIE = type('DictIE', (object,), dict((k, v) for (k, v) in vars(IE).items() if k != '__slots__' and k not in IE.__slots__))
+
+        value = b'\x8a\x00\x00\x00\x01\x7f\x00\x00\x01'
+        slotted = bytes_per_IE(lambda: [IE(87, value, raw=True) for i in range(1000)])
+        dict_backed = bytes_per_IE(lambda: [DictIE(87, value, raw=True) for i in range(1000)])
+        self.assertLess(slotted, dict_backed, "IE with __slots__ ({:.0f} B) is smaller than dict-backed IE ({:.0f} B)".format(slotted, dict_backed))
+
+        shared_IE(3, b'\x05')
+        shared = bytes_per_IE(lambda: list(iter_IEs(IE(3, b'\x05').encode() * 1000)))
+        unshared = bytes_per_IE(lambda: list(iter_IEs(IE(73, b'\x05').encode() * 1000)))
+        self.assertLess(shared * 4, unshared, "shared Recovery IEs ({:.0f} B) cost a fraction of unshared EBI IEs ({:.0f} B)".format(shared, unshared))
+
+
+class Test_composite_IEs(unittest.TestCase):
+    def test_fteid(self):
+        fteid = IE(87, b'\xca\x00\x00\x01\x00\x0a\x00\x00\x01' + b'\x20\x01' + b'\x00' * 13 + b'\x01', raw=True).decoded_value()
+        self.assertEqual((fteid.interface_type(), fteid.teid()), (10, 0x100), "F-TEID interface type and TEID")
+        self.assertEqual(fteid.ipv4(), b'\x0a\x00\x00\x01', "F-TEID IPv4 address")
+        self.assertEqual(fteid.ipv6(), b'\x20\x01' + b'\x00' * 13 + b'\x01', "F-TEID IPv6 address follows IPv4")
+        self.assertEqual(bytes(IE(87, FTEID.create(11, 7, '10.0.0.2')).encoded_value()), b'\x8b\x00\x00\x00\x07\x0a\x00\x00\x02', "FTEID.create()")
+        self.assertEqual(FTEID.create(11, 7).ipv4(), None, "F-TEID without address")
+
+        with self.assertRaises(ValueError) as context:
+            IE(87, b'\x8a\x00\x00\x00\x01\x0a', raw=True).decoded_value()
+
+
+    def test_paa(self):
+        paa = IE(79, b'\x01\x0a\x00\x00\x05', raw=True).decoded_value()
+        self.assertEqual((paa.pdn_type(), paa.ipv4(), paa.ipv6()), (1, b'\x0a\x00\x00\x05', None), "IPv4 PAA")
+        paa = PAA.create('10.0.0.5', '2001:db8::', 56)
+        self.assertEqual((paa.pdn_type(), paa.ipv4(), paa.ipv6_prefix_length()), (3, b'\x0a\x00\x00\x05', 56), "IPv4v6 PAA")
+        self.assertEqual(paa.ipv6(), b'\x20\x01\x0d\xb8' + b'\x00' * 12, "IPv4v6 PAA IPv6 prefix")
+
+
+    def test_uli(self):
+        uli = IE(86, ULI.create(tai=TAI('123', '45', 0x0102), ecgi=ECGI('123', '45', 0x1234567))).encoded_value()
+        self.assertEqual(bytes(uli), b'\x18\x21\xf3\x54\x01\x02\x21\xf3\x54\x01\x23\x45\x67', "ULI.create() with TAI and ECGI")
+
+        uli = IE(86, uli, raw=True).decoded_value()
+        self.assertEqual(uli.tai(), TAI('123', '45', 0x0102), "ULI TAI")
+        self.assertEqual(uli.ecgi(), ECGI('123', '45', 0x1234567), "ULI ECGI")
+        self.assertEqual((uli.cgi(), uli.lai()), (None, None), "ULI absent fields")
+
+        uli = ULI.create(rai=RAI('310', '260', 1, 2), extended_macro_enodeb_id=ExtendedMacroENodeBID('310', '260', 1, 0x1fffff))
+        self.assertEqual((uli.rai(), uli.extended_macro_enodeb_id()), (RAI('310', '260', 1, 2), ExtendedMacroENodeBID('310', '260', 1, 0x1fffff)), "ULI RAI and Extended Macro eNodeB ID")
+
+        with self.assertRaises(ValueError) as context:
+            ULI(b'\x08\x21\xf3\x54')
+
+
+    def test_qos(self):
+        self.assertEqual(IE(72, AMBR(1000, 2000)).encoded_value(), b'\x00\x00\x03\xe8\x00\x00\x07\xd0', "AMBR encode")
+        self.assertEqual(IE(72, b'\x00\x00\x03\xe8\x00\x00\x07\xd0', raw=True).decoded_value(), AMBR(1000, 2000), "AMBR decode")
+        self.assertEqual(IE(155, b'\x49', raw=True).decoded_value(), ARP(1, 2, 1), "ARP decode")
+        self.assertEqual(IE(155, ARP(1, 2, 1)).encoded_value(), b'\x49', "ARP encode")
+
+        qos = BearerQoS(0, 9, 1, 9, 1 << 33, 5, 0, 0)
+        encoded = IE(80, qos).encoded_value()
+        self.assertEqual(len(encoded), 22, "Bearer QoS length")
+        self.assertEqual(IE(80, encoded, raw=True).decoded_value(), qos, "Bearer QoS round trip with 40-bit rates")
+
+
+class Test_IEGroup(unittest.TestCase):
+    def test_grouped_IE(self):
+        bearer_contexts = [IE(93, [IE(73, b'\x05'), IE(87, b'\x8a\x00\x00\x00\x01\x7f\x00\x00\x01', instance=2)]),
+                           IE(93, [IE(73, b'\x06'), IE(87, b'\x8a\x00\x00\x00\x02\x7f\x00\x00\x02', instance=2)])]
+        self.assertEqual(bearer_contexts[0].value_length(), 18, "IE(93, [EBI, F-TEID]) length == 18")
+
+        m = v2message.decode(v2message(34, 1, teid=1, IEs=[IE(3, b'\x05')] + bearer_contexts).encode())
+        self.assertEqual(len(m.get_IEs(93)), 2, "get_IEs(93) finds both Bearer Contexts")
+
+        group = m.get_IEs(93)[1].decoded_value()
+        self.assertIsInstance(group, IEGroup, "Bearer Context decodes to IEGroup")
+        self.assertIsNone(group._ies, "IEGroup does not walk children up front")
+        self.assertEqual(group.get_IE(73).decoded_value(), b'\x06', "IEGroup get_IE(73) is EBI 6")
+        self.assertEqual((group.get_IE(87, 2).decoded_value().teid(), group.get_IE(87, 2).decoded_value().ipv4()), (2, b'\x7f\x00\x00\x02'), "IEGroup get_IE(87, 2)")
+        self.assertIsNone(group.get_IE(87), "IEGroup get_IE(87, 0) is None")
+        self.assertIsInstance(group.get_IE(87, 2).encoded_value(), memoryview, "IEGroup child value is a view")
+
+        # the first Bearer Context was never walked
+        self.assertIs(m.get_IEs(93)[0]._decoded_value, _undecoded, "untouched Bearer Context is not decoded")
+
+        # a decoded group can be used as the value of a new grouped IE
+        self.assertEqual(IE(93, group).encode(), bearer_contexts[1].encode(), "IE(93, IEGroup) re-encodes the group")
+
+
+class Test_IEInstanceGenerator(unittest.TestCase):
+    def test_generator(self):
+        generator = IEInstanceGenerator()
+        self.assertEqual([generator.next_instance(t) for t in (87, 87, 3, 87)], [0, 1, 0, 2], "next_instance() counts per type")
+
+        generator.reset()
+        self.assertEqual(generator.next_instance(87), 0, "reset() starts over at 0")
+
+        for i in range(15):
+            generator.next_instance(87)
+        with self.assertRaises(ValueError) as context:
+            generator.next_instance(87)
+
+
+    def test_encode_with_generator(self):
+        fteid = IE(87, b'\x8a\x00\x00\x00\x01\x7f\x00\x00\x01')
+        m = v2message(32, 1, teid=0, IEs=(fteid, IE(3, b'\x05'), fteid))
+        generator = IEInstanceGenerator()
+
+        for i in range(2):
+            encoded = m.encode(generator)
+            self.assertEqual([(e.type(), e.instance()) for e in iter_IEs(encoded, 12)], [(87, 0), (3, 0), (87, 1)], "encode(generator) assigns instances, pass {}".format(i))
+
+        self.assertEqual([e.instance() for e in iter_IEs(m.encode(), 12)], [0, 0, 0], "encode() without generator uses IE instances")
+
+
+class Test_v2template(unittest.TestCase):
+    def test_stamp(self):
+        def create_session_response(sequence_number, teid, cause, control_fteid, user_fteid):
+            return v2message(33, sequence_number, teid=teid, IEs=(IE(2, cause), IE(87, control_fteid, instance=1), IE(3, b'\x05'),
+                                                 IE(93, [IE(73, b'\x05'), IE(2, b'\x10\x00'), IE(87, user_fteid, instance=2)])))
+
+        t = v2template(create_session_response(0, 0, b'\x10\x00', b'\x8b' + b'\x00' * 8, b'\x81' + b'\x00' * 8), fields=(2, (87, 1), ((93, 0), (87, 2))))
+
+        control_fteid = b'\x8b\x00\x00\x00\x07\x0a\x00\x00\x01'
+        user_fteid = b'\x81\x00\x00\x00\x09\x0a\x00\x00\x02'
+        expected = create_session_response(0x123456, 0xdeadbeef, b'\x40\x00', control_fteid, user_fteid).encode()
+
+        self.assertEqual(t.encoded_length(), len(expected), "v2template encoded_length")
+        self.assertEqual(t.stamp(0x123456, 0xdeadbeef, b'\x40\x00', control_fteid, user_fteid), expected, "stamp() patches header and IEs, including nested")
+        self.assertEqual(t.stamp(0x123456, None), expected, "stamp() without values keeps the last values")
+
+        buf = bytearray(128)
+        end = t.stamp_into(buf, 5, 0x123456, 0xdeadbeef)
+        self.assertEqual(buf[5:end], expected, "stamp_into() copies then patches")
+
+        echo = v2template(v2message(2, 0, IEs=(IE(3, b'\x05'),)))
+        self.assertEqual(echo.stamp(77), v2message(2, 77, IEs=(IE(3, b'\x05'),)).encode(), "stamp() without TEID")
+
+        with self.assertRaises(ValueError) as context:
+            echo.stamp(77, 1)
+
+        with self.assertRaises(ValueError) as context:
+            t.stamp(1, 1, b'\x40')
+
+        with self.assertRaises(ValueError) as context:
+            v2template(v2message(2, 0), fields=(3,))
+
+
+class Test_EchoResponder(unittest.TestCase):
+    def test_respond(self):
+        responder = EchoResponder(5)
+        response = responder.respond(v2message(1, 0x123456, IEs=(IE(3, b'\x09'),)).encode())
+        self.assertEqual(response, v2message(2, 0x123456, IEs=(IE(3, b'\x05'),)).encode(), "respond() to Echo Request")
+        self.assertIs(responder.respond(v2message(1, 7).encode()), response, "respond() reuses its buffer")
+        self.assertEqual(v2message.decode(response).sequence_number(), 7, "respond() copies the sequence number")
+
+        self.assertIsNone(responder.respond(v2message(2, 7).encode()), "respond() ignores Echo Response")
+        self.assertIsNone(responder.respond(v2message(1, 7, teid=0).encode()), "respond() ignores message with TEID")
+        self.assertIsNone(responder.respond(b'\x32\x01\x00\x04\x00\x00\x00\x00\x00\x01\x00\x00'), "respond() ignores GTPv1")
+        self.assertIsNone(responder.respond(b'\x40\x01'), "respond() ignores truncated message")
+
+
+class Test_MessageDispatcher(unittest.TestCase):
+    def test_dispatch(self):
+        rejected = []
+        dispatcher = MessageDispatcher(reject=lambda buffer, peer: rejected.append((bytes(buffer), peer)))
+        dispatcher.register('Create Session Request', lambda message, peer: ('create', message.sequence_number(), peer))
+        dispatcher.register(36, lambda message, peer: ('delete', message.teid(), peer))
+
+        self.assertEqual(dispatcher.dispatch(v2message(32, 9, 0).encode(), 'mme'), ('create', 9, 'mme'), "dispatch() by name-registered type")
+        self.assertEqual(dispatcher.dispatch(v2message(36, 1, 0x100).encode(), 'mme'), ('delete', 0x100, 'mme'), "dispatch() by type")
+        self.assertEqual(dispatcher.dispatch_message(v2message(32, 4, 0), 'sgw'), ('create', 4, 'sgw'), "dispatch_message()")
+
+        unknown = v2message(34, 2, 0x100).encode()
+        self.assertIsNone(dispatcher.dispatch(unknown, 'mme'), "unknown type rejected")
+        self.assertIsNone(dispatcher.dispatch(b'\x32\x20\x00\x04\x00\x00\x00\x00', 'mme'), "GTPv1 rejected")
+        self.assertIsNone(dispatcher.dispatch(b'\x48\x20\x00', 'mme'), "truncated message rejected")
+        self.assertEqual(rejected[0], (bytes(unknown), 'mme'), "reject() gets the undecoded buffer")
+        self.assertEqual(len(rejected), 3, "every rejection reported")
+
+        dispatcher.unregister(36)
+        self.assertIsNone(dispatcher.handler(36), "unregister()")
+        self.assertIsNone(MessageDispatcher().dispatch(unknown), "default reject drops")
+
+        with self.assertRaises(ValueError):
+            dispatcher.register('Create PDP Context Request', None)
+
+
+    def test_message_names(self):
+        self.assertEqual(message_name_to_type['Create Session Request'], 32, "Create Session Request")
+        self.assertEqual(message_name_to_type['Delete Session Response'], 37, "Delete Session Response")
+        self.assertEqual(message_type_to_name[34], 'Modify Bearer Request', "Modify Bearer Request")
+        self.assertEqual(v2message('Modify Bearer Response', 1, 0).type(), 35, "v2message() by name")
+
 
 class Test_v2message(unittest.TestCase):
     def test_constructor(self):
@@ -610,6 +1375,67 @@ class Test_v2message(unittest.TestCase):
         self.assertEqual(m.IEs(), (), "v2message(1, 10) IEs == ()")
         self.assertEqual(m.encoded_length(), 8, "v2message(1, 10) encoded_length == 8")
 
+        # sequence number is 24 bits
+        with self.assertRaises(ValueError) as context:
+            m = v2message(1, 0x1000000)
+
+
+    def test_encode(self):
+        m = v2message(1, 10, IEs=(IE(3, b'\x05'),))
+        self.assertEqual(m.encode(), b'\x40\x01\x00\x09\x00\x00\x0a\x00\x03\x00\x01\x00\x05', "v2message(1, 10, [Recovery]) encode")
+
+        m = v2message(32, 0x123456, teid=0xdeadbeef, IEs=(IE(3, b'\x05'), IE(87, b'\x8a\x00\x00\x00\x01\x7f\x00\x00\x01', instance=1)))
+        encoded = m.encode()
+        self.assertEqual(len(encoded), m.encoded_length(), "v2message(32, ...) encode length == encoded_length()")
+        self.assertEqual(encoded[:12], b'\x48\x20\x00\x1a\xde\xad\xbe\xef\x12\x34\x56\x00', "v2message(32, ...) header with TEID")
+        self.assertEqual(encoded[12:], IE(3, b'\x05').encode() + IE(87, b'\x8a\x00\x00\x00\x01\x7f\x00\x00\x01', instance=1).encode(), "v2message(32, ...) IEs follow header")
+
+        # encode into a reused buffer at an offset
+        buf = bytearray(64)
+        self.assertEqual(m.encode_into(buf, 4), 4 + m.encoded_length(), "encode_into() returns offset following message")
+        self.assertEqual(buf[4:4 + m.encoded_length()], encoded, "encode_into() matches encode()")
+
+        with self.assertRaises(ValueError) as context:
+            m.encode_into(bytearray(10))
+
+        # the length field counts the sequence number octets and the IEs: 4 + 0x8004 + 0x7ff7 is 0xffff
+        largest = v2message(32, 1, IEs=(IE(255, bytes(0x8000)), IE(255, bytes(0x7ff3), instance=1)))
+        self.assertEqual(largest.encode()[2:4], b'\xff\xff', "largest message encodes")
+        oversized = v2message(32, 1, IEs=(IE(255, bytes(0x8000)), IE(255, bytes(0x7ff4), instance=1)))
+        with self.assertRaises(ValueError) as context:
+            oversized.encode()
+        with self.assertRaises(ValueError) as context:
+            oversized.encode_into(bytearray(0x20000))
+
+
+    def test_decode(self):
+        encoded = v2message(32, 0x123456, teid=0xdeadbeef, IEs=(IE(3, b'\x05'), IE(87, b'\x8a\x00\x00\x00\x01\x7f\x00\x00\x01', instance=1))).encode()
+
+        m = v2message.decode(encoded)
+        self.assertEqual(m.type(), 32, "decode() type == 32")
+        self.assertEqual(m.teid(), 0xdeadbeef, "decode() teid == 0xdeadbeef")
+        self.assertEqual(m.sequence_number(), 0x123456, "decode() sequence_number == 0x123456")
+        self.assertEqual(m.encoded_length(), len(encoded), "decode() encoded_length == length of stream")
+        self.assertIsNone(m._ies, "decode() does not decode IEs up front")
+
+        # untouched IEs are copied through on re-encode
+        self.assertEqual(m.encode(), encoded, "decode() then encode() round trips")
+
+        self.assertEqual(bytes(m.get_IE(87, 1).decoded_value().encoded_value()), b'\x8a\x00\x00\x00\x01\x7f\x00\x00\x01', "decode() get_IE(87, 1)")
+        self.assertIsNone(m.get_IE(87), "decode() get_IE(87, 0) is None")
+        self.assertEqual([i.type() for i in m.IEs()], [3, 87], "decode() IEs() in order")
+
+        m = v2message.decode(b'\x00\x00' + v2message(1, 10).encode(), 2)
+        self.assertEqual((m.type(), m.teid(), m.sequence_number(), m.IEs()), (1, None, 10, ()), "decode() at offset without TEID")
+
+        # wrong version
+        with self.assertRaises(ValueError) as context:
+            v2message.decode(b'\x20\x01\x00\x04\x00\x00\x0a\x00')
+
+        # asserted length runs past the end of the stream
+        with self.assertRaises(ValueError) as context:
+            v2message.decode(encoded[:-1])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,249 @@
+# Human-readable names from 3GPP TS 29.274 for GTPv2 IE and message types.  gtpv2 exposes these
+# through gtpcodec.LazyTable, so this module is imported only when a name is first looked up.
+
+ie_name_to_type = {
+    'International Mobile Subscriber Identity (IMSI)': 1,
+    'IMSI': 1,
+    'Cause': 2,
+    'Recovery (Restart Counter)': 3,
+    'Recovery': 3,
+    'STN-SR': 51,
+    'Access Point Name (APN)': 71,
+    'APN': 71,
+    'Aggregate Maximum Bit Rate (AMBR)': 72,
+    'AMBR': 72,
+    'EPS Bearer ID (EBI)': 73,
+    'EBI': 73,
+    'IP Address': 74,
+    'Mobile Equipment Identity (MEI)': 75,
+    'MEI': 75,
+    'MSISDN': 76,
+    'Indication': 77,
+    'Protocol Configuration Options (PCO)': 78,
+    'PCO': 78,
+    'PDN Address Allocation (PAA)': 79,
+    'PAA': 79,
+    'Bearer Level Quality of Service (Bearer QoS)': 80,
+    'Bearer QoS': 80,
+    'Flow Quality of Service (Flow QoS)': 81,
+    'Flow QoS': 81,
+    'RAT Type': 82,
+    'Serving Network': 83,
+    'EPS Bearer Level Traffic Flow Template (Bearer TFT)': 84,
+    'Bearer TFT': 84,
+    'Traffic Aggregation Description (TAD)': 85,
+    'TAD': 85,
+    'User Location Information (ULI)': 86,
+    'ULI': 86,
+    'Fully Qualified Tunnel Endpoint Identifier (F-TEID)': 87,
+    'F-TEID': 87,
+    'TMSI': 88,
+    'Global CN-Id': 89,
+    'S103 PDN Data Forwarding Info (S103PDF)': 90,
+    'S103PDF': 90,
+    'S1-U Data Forwarding Info (S1UDF)': 91,
+    'S1UDF': 91,
+    'Delay Value': 92,
+    'Bearer Context ': 93,
+    'Charging ID': 94,
+    'Charging Characteristics': 95,
+    'Trace Information': 96,
+    'Bearer Flags': 97,
+    'PDN Type': 99,
+    'Procedure Transaction ID': 100,
+    'MM Context (GSM Key and Triplets)': 103,
+    'MM Context (UMTS Key, Used Cipher and Quintuplets)': 104,
+    'MM Context (GSM Key, Used Cipher and Quintuplets)': 105,
+    'MM Context (UMTS Key and Quintuplets)': 106,
+    'MM Context (EPS Security Context, Quadruplets and Quintuplets)': 107,
+    'MM Context (UMTS Key, Quadruplets and Quintuplets)': 108,
+    'PDN Connection': 109,
+    'PDU Numbers': 110,
+    'P-TMSI': 111,
+    'P-TMSI Signature': 112,
+    'Hop Counter': 113,
+    'UE Time Zone': 114,
+    'Trace Reference': 115,
+    'Complete Request Message': 116,
+    'GUTI': 117,
+    'F-Container': 118,
+    'F-Cause': 119,
+    'PLMN ID': 120,
+    'Target Identification': 121,
+    'Packet Flow ID ': 123,
+    'RAB Context ': 124,
+    'Source RNC PDCP Context Info': 125,
+    'Port Number': 126,
+    'APN Restriction': 127,
+    'Selection Mode': 128,
+    'Source Identification': 129,
+    'Change Reporting Action': 131,
+    'Fully Qualified PDN Connection Set Identifier (FQ-CSID)': 132,
+    'FQ-CSID': 132,
+    'Channel needed': 133,
+    'eMLPP Priority': 134,
+    'Node Type': 135,
+    'Fully Qualified Domain Name (FQDN)': 136,
+    'FQDN': 136,
+    'Transaction Identifier (TI)': 137,
+    'TI': 137,
+    'MBMS Session Duration': 138,
+    'MBMS Service Area': 139,
+    'MBMS Session Identifier': 140,
+    'MBMS Flow Identifier': 141,
+    'MBMS IP Multicast Distribution': 142,
+    'MBMS Distribution Acknowledge': 143,
+    'RFSP Index': 144,
+    'User CSG Information (UCI)': 145,
+    'UCI': 145,
+    'CSG Information Reporting Action': 146,
+    'CSG ID': 147,
+    'CSG Membership Indication (CMI)': 148,
+    'CMI': 148,
+    'Service indicator': 149,
+    'Detach Type': 150,
+    'Local Distiguished Name (LDN)': 151,
+    'LDN': 151,
+    'Node Features': 152,
+    'MBMS Time to Data Transfer': 153,
+    'Throttling': 154,
+    'Allocation/Retention Priority (ARP)': 155,
+    'ARP': 155,
+    'EPC Timer': 156,
+    'Signalling Priority Indication': 157,
+    'Temporary Mobile Group Identity (TMGI)': 158,
+    'TMGI': 158,
+    'Additional MM context for SRVCC': 159,
+    'Additional flags for SRVCC': 160,
+    'MDT Configuration': 162,
+    'Additional Protocol Configuration Options (APCO)': 163,
+    'APCO': 163,
+    'Absolute Time of MBMS Data Transfer': 164,
+    'H(e)NB Information Reporting ': 165,
+    'IPv4 Configuration Parameters (IP4CP)': 166,
+    'IP4CP': 166,
+    'Change to Report Flags ': 167,
+    'Action Indication': 168,
+    'TWAN Identifier': 169,
+    'ULI Timestamp': 170,
+    'MBMS Flags': 171,
+    'RAN/NAS Cause': 172,
+    'CN Operator Selection Entity': 173,
+    'Trusted WLAN Mode Indication': 174,
+    'Node Number': 175,
+    'Node Identifier': 176,
+    'Presence Reporting Area Action': 177,
+    'Presence Reporting Area Information': 178,
+    'TWAN Identifier Timestamp': 179,
+    'Overload Control Information': 180,
+    'Load Control Information': 181,
+    'Metric': 182,
+    'Sequence Number': 183,
+    'APN and Relative Capacity': 184,
+    'WLAN Offloadability Indication': 185,
+    'Paging and Service Information': 186,
+    'Integer Number': 187,
+    'Millisecond Time Stamp': 188,
+    'Monitoring Event Information': 189,
+    'ECGI List': 190,
+    'Remote UE Context': 191,
+    'Remote User ID': 192,
+    'Remote UE IP information': 193,
+    'CIoT Optimizations Support Indication': 194,
+    'SCEF PDN Connection': 195,
+    'Header Compression Configuration': 196,
+    'Extended Protocol Configuration Options (ePCO)': 197,
+    'ePCO': 197,
+    'Serving PLMN Rate Control': 198,
+    'Counter': 199,
+    'Private Extension': 255,
+}
+
+
+
+message_name_to_type = {
+    'Echo Request': 1,
+    'Echo Response': 2,
+    'Version Not Supported Indication': 3,
+    'Create Session Request': 32,
+    'Create Session Response': 33,
+    'Modify Bearer Request': 34,
+    'Modify Bearer Response': 35,
+    'Delete Session Request': 36,
+    'Delete Session Response': 37,
+    'Change Notification Request': 38,
+    'Change Notification Response': 39,
+    'Remote UE Report Notification': 40,
+    'Remote UE Report Acknowledge': 41,
+    'Modify Bearer Command': 64,
+    'Modify Bearer Failure Indication': 65,
+    'Delete Bearer Command': 66,
+    'Delete Bearer Failure Indication': 67,
+    'Bearer Resource Command': 68,
+    'Bearer Resource Failure Indication': 69,
+    'Downlink Data Notification Failure Indication': 70,
+    'Trace Session Activation': 71,
+    'Trace Session Deactivation': 72,
+    'Stop Paging Indication': 73,
+    'Create Bearer Request': 95,
+    'Create Bearer Response': 96,
+    'Update Bearer Request': 97,
+    'Update Bearer Response': 98,
+    'Delete Bearer Request': 99,
+    'Delete Bearer Response': 100,
+    'Delete PDN Connection Set Request': 101,
+    'Delete PDN Connection Set Response': 102,
+    'PGW Downlink Triggering Notification': 103,
+    'PGW Downlink Triggering Acknowledge': 104,
+    'Identification Request': 128,
+    'Identification Response': 129,
+    'Context Request': 130,
+    'Context Response': 131,
+    'Context Acknowledge': 132,
+    'Forward Relocation Request': 133,
+    'Forward Relocation Response': 134,
+    'Forward Relocation Complete Notification': 135,
+    'Forward Relocation Complete Acknowledge': 136,
+    'Forward Access Context Notification': 137,
+    'Forward Access Context Acknowledge': 138,
+    'Relocation Cancel Request': 139,
+    'Relocation Cancel Response': 140,
+    'Configuration Transfer Tunnel': 141,
+    'Detach Notification': 149,
+    'Detach Acknowledge': 150,
+    'CS Paging Indication': 151,
+    'RAN Information Relay': 152,
+    'Alert MME Notification': 153,
+    'Alert MME Acknowledge': 154,
+    'UE Activity Notification': 155,
+    'UE Activity Acknowledge': 156,
+    'ISR Status Indication': 157,
+    'UE Registration Query Request': 158,
+    'UE Registration Query Response': 159,
+    'Create Forwarding Tunnel Request': 160,
+    'Create Forwarding Tunnel Response': 161,
+    'Suspend Notification': 162,
+    'Suspend Acknowledge': 163,
+    'Resume Notification': 164,
+    'Resume Acknowledge': 165,
+    'Create Indirect Data Forwarding Tunnel Request': 166,
+    'Create Indirect Data Forwarding Tunnel Response': 167,
+    'Delete Indirect Data Forwarding Tunnel Request': 168,
+    'Delete Indirect Data Forwarding Tunnel Response': 169,
+    'Release Access Bearers Request': 170,
+    'Release Access Bearers Response': 171,
+    'Downlink Data Notification': 176,
+    'Downlink Data Notification Acknowledge': 177,
+    'PGW Restart Notification': 179,
+    'PGW Restart Notification Acknowledge': 180,
+    'Update PDN Connection Set Request': 200,
+    'Update PDN Connection Set Response': 201,
+    'Modify Access Bearers Request': 211,
+    'Modify Access Bearers Response': 212,
+    'MBMS Session Start Request': 231,
+    'MBMS Session Start Response': 232,
+    'MBMS Session Update Request': 233,
+    'MBMS Session Update Response': 234,
+    'MBMS Session Stop Request': 235,
+    'MBMS Session Stop Response': 236,
+}
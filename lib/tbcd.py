@@ -0,0 +1,116 @@
+import unittest
+
+# TBCD (3GPP TS 29.002) packs two digits per octet, the first in the low nibble, with a filler of 0xf in
+# the high nibble of the last octet when the number of digits is odd.  Decoding swaps the nibbles of every
+# octet through a 256-entry table and lets bytes.hex() produce the digit pairs; encoding runs the same
+# path in reverse, so neither touches a nibble in Python.
+
+# octet -> octet with nibbles swapped
+tbcd_swap_table = bytes(((b & 0x0f) << 4) | (b >> 4) for b in range(256))
+
+# nibble values 10 through 14 come out of hex() as 'a' to 'e' and are the TBCD digits '*', '#', 'a', 'b', 'c'
+_hex_to_tbcd = str.maketrans('abcde', '*#abc')
+_tbcd_to_hex = str.maketrans('*#abc', 'abcde')
+
+
+def decode_tbcd(value):
+    """Decode a TBCD-encoded value (bytes, bytearray or memoryview) to a string of digits"""
+    digits = bytes(value).translate(tbcd_swap_table).hex()
+    if digits.endswith('f'):
+        digits = digits[:-1]
+    if digits.isdigit():
+        return digits
+    return digits.translate(_hex_to_tbcd)
+
+
+def encode_tbcd(digits):
+    """Encode a string of digits as TBCD.  A bytes-like 'digits' is taken to be already encoded and is
+       returned unchanged."""
+    if not isinstance(digits, str):
+        return digits
+    if not digits.isdigit():
+        digits = digits.translate(_tbcd_to_hex)
+    if len(digits) & 1:
+        digits += 'f'
+    try:
+        return bytes.fromhex(digits).translate(tbcd_swap_table)
+    except ValueError:
+        raise ValueError('Value ({}) is not a string of TBCD digits'.format(str(digits)))
+
+
+def decode_tbcd_batch(values):
+    """Decode a list of TBCD-encoded values, such as the IMSIs of every message in a capture, in one
+       pass: the values are joined, swapped and converted to hex together and the digits then sliced
+       back apart"""
+    joined = b''.join(values).translate(tbcd_swap_table).hex()
+    if not joined.isdigit():
+        joined = joined.translate(_hex_to_tbcd)
+
+    decoded = []
+    offset = 0
+    for value in values:
+        end = offset + 2 * len(value)
+        digits = joined[offset:end]
+        if digits.endswith('f'):
+            digits = digits[:-1]
+        decoded.append(digits)
+        offset = end
+    return decoded
+
+
+def encode_tbcd_batch(values):
+    """Encode a list of digit strings as TBCD"""
+    return [encode_tbcd(digits) for digits in values]
+
+
+def decode_plmn(value):
+    """Decode the three-octet PLMN identity at the start of 'value' (as carried in Serving Network, ULI,
+       TAI and ECGI) to the tuple (MCC, MNC), each a string of digits"""
+    digits = bytes(value[:3]).translate(tbcd_swap_table).hex()
+    # octets are MCC2 MCC1, MNC3 MCC3, MNC2 MNC1, so after the swap: MCC1 MCC2 MCC3 MNC3 MNC1 MNC2
+    if digits[3] == 'f':
+        return (digits[0:3], digits[4:6])
+    return (digits[0:3], digits[4:6] + digits[3])
+
+
+def encode_plmn(plmn):
+    """Encode (MCC, MNC), with a two- or three-digit MNC, as a three-octet PLMN identity.  A bytes-like
+       'plmn' is taken to be already encoded and is returned unchanged."""
+    if not isinstance(plmn, tuple):
+        return plmn
+    (mcc, mnc) = plmn
+    if len(mcc) != 3 or len(mnc) not in (2, 3):
+        raise ValueError('PLMN ({}) must have a three-digit MCC and a two- or three-digit MNC'.format(str(plmn)))
+    return bytes.fromhex(mcc + (mnc[2] if len(mnc) == 3 else 'f') + mnc[0:2]).translate(tbcd_swap_table)
+
+
+
+class Test_tbcd(unittest.TestCase):
+    def test_tbcd(self):
+        self.assertEqual(encode_tbcd('123456789012345'), b'\x21\x43\x65\x87\x09\x21\x43\xf5', "encode_tbcd() odd number of digits")
+        self.assertEqual(encode_tbcd('1234'), b'\x21\x43', "encode_tbcd() even number of digits")
+        self.assertEqual(encode_tbcd(b'\x21\x43'), b'\x21\x43', "encode_tbcd() passes encoded values through")
+        self.assertEqual(decode_tbcd(b'\x21\x43\x65\x87\x09\x21\x43\xf5'), '123456789012345', "decode_tbcd() strips filler")
+        self.assertEqual(decode_tbcd(memoryview(b'\x21\x43')), '1234', "decode_tbcd() of memoryview")
+        self.assertEqual(decode_tbcd(encode_tbcd('12*#a')), '12*#a', "TBCD special digits round trip")
+
+        with self.assertRaises(ValueError) as context:
+            encode_tbcd('12x4')
+
+
+    def test_tbcd_batch(self):
+        values = [b'\x21\x43\x65\x87\x09\x21\x43\xf5', b'\x21\x43', b'\x00\xf9', b'\xa1\xfb']
+        self.assertEqual(decode_tbcd_batch(values), [decode_tbcd(v) for v in values], "decode_tbcd_batch() matches decode_tbcd()")
+        self.assertEqual(decode_tbcd_batch([]), [], "decode_tbcd_batch() of nothing")
+        self.assertEqual(encode_tbcd_batch(['1234', '123']), [b'\x21\x43', b'\x21\xf3'], "encode_tbcd_batch()")
+
+
+    def test_plmn(self):
+        self.assertEqual(decode_plmn(b'\x21\xf3\x54'), ('123', '45'), "decode_plmn() two-digit MNC")
+        self.assertEqual(decode_plmn(b'\x13\x00\x62\xff'), ('310', '260'), "decode_plmn() three-digit MNC")
+        self.assertEqual(encode_plmn(('123', '45')), b'\x21\xf3\x54', "encode_plmn() two-digit MNC")
+        self.assertEqual(encode_plmn(('310', '260')), b'\x13\x00\x62', "encode_plmn() three-digit MNC")
+
+
+if __name__ == "__main__":
+    unittest.main()